@@ -4,7 +4,7 @@ from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
-from app.domain.exceptions import UserInsufficientFundsError, UserNotFoundError
+from app.domain.exceptions import PaymentIdempotencyConflictError, UserInsufficientFundsError, UserNotFoundError
 
 logger = logging.getLogger("api_exceptions")
 
@@ -18,6 +18,10 @@ def register_exception_handlers(app: FastAPI) -> None:
     async def insufficient_funds_handler(_: Request, exc: UserInsufficientFundsError):
         return JSONResponse(status_code=400, content={"detail": str(exc)})
 
+    @app.exception_handler(PaymentIdempotencyConflictError)
+    async def idempotency_conflict_handler(_: Request, exc: PaymentIdempotencyConflictError):
+        return JSONResponse(status_code=409, content={"detail": str(exc)})
+
     @app.exception_handler(IntegrityError)
     async def integrity_error_handler(_: Request, __: IntegrityError):
         return JSONResponse(status_code=409, content={"detail": "Conflict"})
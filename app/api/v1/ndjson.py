@@ -0,0 +1,42 @@
+from collections.abc import AsyncIterable, AsyncIterator
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Строка длиннее — заведомо не платёж; не копим её в памяти.
+MAX_LINE_BYTES = 64 * 1024
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """Ответ, который отдаётся, пока ещё читается тело запроса.
+
+    Обычный StreamingResponse при ASGI < 2.4 параллельно слушает receive() ради disconnect
+    и съел бы куски тела запроса. Здесь receive читает только сам обработчик, а обрыв
+    соединения проявится как ClientDisconnect при чтении тела или ошибка при записи.
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes | None]:
+    """Режет поток байт на строки по мере поступления; None — строка длиннее MAX_LINE_BYTES."""
+    buffer = b""
+    oversized = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield None if oversized else line
+            oversized = False
+        if len(buffer) > MAX_LINE_BYTES:
+            buffer = b""
+            oversized = True
+    if buffer or oversized:
+        yield None if oversized else buffer
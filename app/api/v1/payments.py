@@ -1,24 +1,39 @@
-﻿import logging
+﻿import json
+import logging
+from collections.abc import AsyncIterator
+from dataclasses import asdict
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app.api.v1.ndjson import NDJSON_MEDIA_TYPE, NDJSONStreamingResponse, iter_lines
 
 from app.api.v1.schemas.payment import (
     DepositRequestSchema,
+    PaymentBatchItemSchema,
+    PaymentBatchRequestSchema,
+    PaymentBatchResponse,
     PaymentCreateResponse,
     PaymentStatusResponse,
     WithdrawRequestSchema,
 )
-from app.application.dto.payment import DepositDTO, WithdrawDTO
+from app.application.dto.payment import DepositDTO, PaymentBatchItemDTO, WithdrawDTO
+from app.application.use_cases.create_payments_batch import CreatePaymentsBatchUseCase
 from app.application.use_cases.deposit_balance import DepositBalanceUseCase
 from app.application.use_cases.withdraw_balance import WithdrawBalanceUseCase
 from app.core.dependencies import (
+    build_payments_batch_use_case,
     get_deposit_use_case,
     get_payment_repo,
+    get_payments_batch_use_case,
     get_transaction_repo,
     get_withdraw_use_case,
 )
 from app.core.metrics import metrics
+from app.core.settings import settings
+from app.infrastructure.db.session import AsyncSessionLocal
 from app.infrastructure.repositories.payment import PaymentRepository
 from app.infrastructure.repositories.transaction import TransactionRepository
 
@@ -77,6 +92,129 @@ async def payments_withdraw(
     return _response(payment_id, data.user_id, data.amount, "withdraw", "processing")
 
 
+@router.post(
+    "/batch",
+    summary="Пакет платежей (асинхронно)",
+    description=(
+        "Создаёт пачку пополнений и списаний одной транзакцией и ставит их в очередь обработки. "
+        "Возвращает результат по каждому элементу, ошибки элементов не отменяют пакет."
+    ),
+    response_model=PaymentBatchResponse,
+)
+async def payments_batch(
+    data: PaymentBatchRequestSchema,
+    use_case: Annotated[CreatePaymentsBatchUseCase, Depends(get_payments_batch_use_case)],
+):
+    await metrics.inc("payments_batch_requests_total")
+    logger.info("batch request: items=%s", len(data.items))
+    results = await use_case.execute(
+        [
+            PaymentBatchItemDTO(
+                type=item.type,
+                user_id=item.user_id,
+                amount=item.amount,
+                idempotency_key=item.idempotency_key,
+            )
+            for item in data.items
+        ]
+    )
+    return {"items": [asdict(result) for result in results]}
+
+
+@router.post(
+    "/batch/stream",
+    summary="Потоковый пакет платежей (NDJSON)",
+    description=(
+        "Принимает application/x-ndjson — по платежу на строку в формате элемента /batch — и читает тело "
+        "по мере поступления. Платежи коммитятся пачками по PAYMENTS_STREAM_CHUNK_SIZE, результат каждой "
+        "строки (с номером line) отдаётся NDJSON сразу после коммита её пачки."
+    ),
+    response_class=NDJSONStreamingResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {NDJSON_MEDIA_TYPE: {"schema": PaymentBatchItemSchema.model_json_schema()}},
+        }
+    },
+)
+async def payments_batch_stream(request: Request):
+    await metrics.inc("payments_batch_stream_requests_total")
+    logger.info("batch stream request")
+    return NDJSONStreamingResponse(_stream_batch(request))
+
+
+async def _stream_batch(request: Request) -> AsyncIterator[bytes]:
+    chunk_size = settings.payments_stream_chunk_size
+    # Номера строк и элементы текущей пачки; в памяти не больше одной пачки.
+    lines: list[int] = []
+    items: list[PaymentBatchItemDTO] = []
+    total = 0
+
+    async with AsyncSessionLocal() as session:
+        use_case = build_payments_batch_use_case(session)
+        line_no = 0
+        async for raw in iter_lines(request.stream()):
+            line_no += 1
+            if raw is not None and not raw.strip():
+                continue
+            try:
+                if raw is None:
+                    raise ValueError("line_too_long")
+                item = PaymentBatchItemSchema.model_validate_json(raw)
+            except (ValidationError, ValueError) as exc:
+                yield _ndjson_line({"line": line_no, "status": "failed", "error": _invalid_line_error(exc)})
+                continue
+
+            lines.append(line_no)
+            items.append(
+                PaymentBatchItemDTO(
+                    type=item.type,
+                    user_id=item.user_id,
+                    amount=item.amount,
+                    idempotency_key=item.idempotency_key,
+                )
+            )
+            if len(items) >= chunk_size:
+                async for out in _flush_chunk(use_case, lines, items):
+                    yield out
+                total += len(items)
+                lines, items = [], []
+
+        if items:
+            async for out in _flush_chunk(use_case, lines, items):
+                yield out
+            total += len(items)
+
+    logger.info("batch stream finished: lines=%s items=%s", line_no, total)
+
+
+async def _flush_chunk(
+    use_case: CreatePaymentsBatchUseCase, lines: list[int], items: list[PaymentBatchItemDTO]
+) -> AsyncIterator[bytes]:
+    try:
+        results = await use_case.execute(items)
+    except SQLAlchemyError as exc:
+        # Ответ уже отдаётся, статус не поменять: пачка откатилась, сообщаем об этом по каждой её строке.
+        error = "conflict" if isinstance(exc, IntegrityError) else "database_error"
+        logger.exception("batch stream chunk failed: lines=%s-%s", lines[0], lines[-1])
+        for line_no, item in zip(lines, items):
+            yield _ndjson_line({"line": line_no, "user_id": item.user_id, "status": "failed", "error": error})
+        return
+    yield b"".join(_ndjson_line({"line": line_no, **asdict(result)}) for line_no, result in zip(lines, results))
+
+
+def _ndjson_line(payload: dict) -> bytes:
+    return json.dumps(payload, separators=(",", ":")).encode() + b"\n"
+
+
+def _invalid_line_error(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        error = exc.errors(include_url=False)[0]
+        location = ".".join(str(part) for part in error["loc"])
+        return f"invalid_line: {location} {error['msg']}".strip()
+    return str(exc)
+
+
 @router.get(
     "/{payment_id}",
     summary="Статус платежа",
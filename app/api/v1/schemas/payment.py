@@ -2,6 +2,8 @@
 
 from pydantic import BaseModel, Field, PositiveFloat
 
+from app.core.settings import settings
+
 
 class DepositRequestSchema(BaseModel):
     user_id: int = Field(..., gt=0, description="ID пользователя")
@@ -21,6 +23,29 @@ class PaymentCreateResponse(BaseModel):
     withdraw: Optional[float] = Field(default=None, description="Сумма списания, если это withdraw")
 
 
+class PaymentBatchItemSchema(BaseModel):
+    type: Literal["deposit", "withdraw"] = Field(..., description="Тип платежа")
+    user_id: int = Field(..., gt=0, description="ID пользователя")
+    amount: PositiveFloat = Field(..., description="Сумма (> 0)")
+    idempotency_key: Optional[str] = Field(default=None, max_length=64, description="Ключ идемпотентности элемента")
+
+
+class PaymentBatchRequestSchema(BaseModel):
+    items: list[PaymentBatchItemSchema] = Field(..., min_length=1, max_length=settings.payments_batch_max_items)
+
+
+class PaymentBatchItemResponse(BaseModel):
+    payment_id: Optional[int] = Field(default=None, description="ID платежа; нет, если платёж не создан")
+    user_id: int
+    status: Literal["processing", "success", "failed"]
+    error: Optional[str] = Field(default=None, description="user_not_found, insufficient_funds, idempotency_conflict")
+    idempotent: bool = Field(default=False, description="Платёж с этим ключом уже существовал")
+
+
+class PaymentBatchResponse(BaseModel):
+    items: list[PaymentBatchItemResponse]
+
+
 class PaymentStatusResponse(BaseModel):
     payment_id: int
     user_id: int
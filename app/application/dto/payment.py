@@ -14,3 +14,18 @@ class WithdrawDTO:
     amount: float
     commission: float = 0.0
     idempotency_key: str | None = None
+
+@dataclass
+class PaymentBatchItemDTO:
+    type: str  # "deposit" | "withdraw"
+    user_id: int
+    amount: float
+    idempotency_key: str | None = None
+
+@dataclass
+class PaymentBatchResultDTO:
+    user_id: int
+    status: str  # "processing" | "success" | "failed"
+    payment_id: int | None = None
+    error: str | None = None
+    idempotent: bool = False
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from app.domain.entities.user import User
 from app.infrastructure.db.models.payment import PaymentModel
+from app.infrastructure.db.models.transaction import TransactionType
+from app.infrastructure.repositories.payment_creation import CreatedPayment
 
 class IUserRepository(ABC):
     @abstractmethod
@@ -17,6 +19,20 @@ class IPaymentRepository(ABC):
         pass
 
 
+
+class IPaymentCreationRepository(ABC):
+    @abstractmethod
+    async def create(
+        self,
+        user_id: int,
+        amount: float,
+        commission: float,
+        type: TransactionType,
+        idempotency_key: str | None = None,
+    ) -> CreatedPayment | None:
+        pass
+
+
 class ITransactionRepository(ABC):
     @abstractmethod
     async def create(
@@ -29,3 +45,13 @@ class ITransactionRepository(ABC):
         status: str
     ):
         pass
+
+
+class IPaymentOutboxRepository(ABC):
+    @abstractmethod
+    async def add(self, payment_id: int):
+        pass
+
+    @abstractmethod
+    async def add_many(self, payment_ids: list[int]):
+        pass
@@ -0,0 +1,177 @@
+import logging
+from dataclasses import replace
+
+from app.application.dto.payment import PaymentBatchItemDTO, PaymentBatchResultDTO
+from app.core.metrics import metrics
+from app.core.settings import settings
+from app.infrastructure.db.models.payment import PaymentStatus
+from app.infrastructure.db.models.transaction import TransactionStatus, TransactionType
+from app.infrastructure.idempotency_filter import idempotency_filter
+
+
+logger = logging.getLogger("usecase.payments_batch")
+
+
+class CreatePaymentsBatchUseCase:
+    """Пакетный приём платежей: одна транзакция и многострочные INSERT на весь массив.
+
+    Результат — по элементу на каждый входной платёж в том же порядке: ошибки
+    (нет пользователя, не хватает средств) и повторы по Idempotency-Key не валят весь пакет.
+    """
+
+    def __init__(self, user_repo, payment_repo, transaction_repo, outbox_repo, session):
+        self.user_repo = user_repo
+        self.payment_repo = payment_repo
+        self.transaction_repo = transaction_repo
+        self.outbox_repo = outbox_repo
+        self.session = session
+
+    async def execute(self, items: list[PaymentBatchItemDTO]) -> list[PaymentBatchResultDTO]:
+        results: list[PaymentBatchResultDTO | None] = [None] * len(items)
+        # Индексы элементов, для которых создаются платежи, и строки payments в том же порядке.
+        created: list[int] = []
+        payment_rows: list[dict] = []
+
+        async with self.session.begin():
+            users = await self.user_repo.get_many(sorted({item.user_id for item in items}))
+            keys = {(item.user_id, item.idempotency_key) for item in items if item.idempotency_key}
+            # Ключи, которых заведомо нет в фильтре, в БД не ищем: почти все ключи новые. Фильтр — только
+            # оптимизация: если он ошибся, ключ поймает вставка, и платёж найдётся поиском после конфликта.
+            candidates = sorted(key for key in keys if idempotency_filter.might_contain(*key))
+            existing = await self.payment_repo.get_by_idempotency_keys(candidates) if candidates else {}
+            found = len(existing)
+            # Повтор ключа внутри пакета получает результат первого элемента с этим ключом.
+            seen_keys: dict[tuple[int, str], int] = {}
+            repeats: list[tuple[int, int]] = []
+
+            for index, item in enumerate(items):
+                key = (item.user_id, item.idempotency_key) if item.idempotency_key else None
+                if key in existing:
+                    results[index] = _idempotent_result(item.user_id, *existing[key])
+                    continue
+                if key in seen_keys:
+                    repeats.append((index, seen_keys[key]))
+                    continue
+                if item.user_id not in users:
+                    results[index] = PaymentBatchResultDTO(user_id=item.user_id, status="failed", error="user_not_found")
+                    continue
+
+                if key:
+                    seen_keys[key] = index
+                created.append(index)
+                payment_rows.append(
+                    {
+                        "user_id": item.user_id,
+                        "amount": item.amount,
+                        "commission": round(item.amount * settings.transaction_fee, 2),
+                        "status": PaymentStatus.NEW,
+                        "idempotency_key": item.idempotency_key,
+                        "last_error": None,
+                    }
+                )
+
+            # Сначала вставка, потом проверка средств: ключ, пропущенный фильтром (старый или занятый
+            # другим процессом), отсекает уникальный индекс, и такой платёж не должен занимать остаток.
+            payment_ids = await self.payment_repo.create_many(payment_rows)
+            conflicts = [
+                (row["user_id"], row["idempotency_key"])
+                for row, payment_id in zip(payment_rows, payment_ids)
+                if payment_id is None
+            ]
+            if conflicts:
+                existing.update(await self.payment_repo.get_by_idempotency_keys(conflicts))
+
+            # Непроведённые списания пакета уменьшают доступный остаток следующих списаний того же пользователя.
+            available = {user_id: float(user.balance) for user_id, user in users.items()}
+            transaction_rows: list[dict] = []
+            enqueued: list[int] = []
+            insufficient: list[int] = []
+            for index, row, payment_id in zip(created, payment_rows, payment_ids):
+                item = items[index]
+                key = (row["user_id"], row["idempotency_key"])
+                if payment_id is None:
+                    if key in existing:
+                        results[index] = _idempotent_result(item.user_id, *existing[key])
+                    else:
+                        # Ключ занят строкой, которой не видно и после конфликта: её удалили или она
+                        # в чужой незавершённой транзакции. Аналог 409 для одиночного платежа.
+                        logger.warning("payments batch key conflict: user_id=%s key=%s", *key)
+                        results[index] = PaymentBatchResultDTO(
+                            user_id=item.user_id, status="failed", error="idempotency_conflict"
+                        )
+                    continue
+                if row["idempotency_key"]:
+                    idempotency_filter.add(*key)
+
+                failed = False
+                if item.type == TransactionType.WITHDRAW.value:
+                    total_amount = round(row["amount"] + row["commission"], 2)
+                    if available[item.user_id] < total_amount:
+                        failed = True
+                        insufficient.append(payment_id)
+                    else:
+                        available[item.user_id] -= total_amount
+
+                results[index] = PaymentBatchResultDTO(
+                    user_id=item.user_id,
+                    status="failed" if failed else "processing",
+                    payment_id=payment_id,
+                    error="insufficient_funds" if failed else None,
+                )
+                transaction_rows.append(
+                    {
+                        "user_id": row["user_id"],
+                        "payment_id": payment_id,
+                        "amount": row["amount"],
+                        "commission": row["commission"],
+                        "type": TransactionType(item.type),
+                        "status": TransactionStatus.FAILED if failed else TransactionStatus.PROCESSING,
+                    }
+                )
+                if not failed:
+                    enqueued.append(payment_id)
+
+            for index, first in repeats:
+                results[index] = replace(results[first], idempotent=True)
+
+            if insufficient:
+                await self.payment_repo.fail_many(insufficient, "insufficient_funds")
+            await self.transaction_repo.create_many(transaction_rows)
+            # Задачи в очередь отправит outbox relay: записи коммитятся вместе с платежами.
+            await self.outbox_repo.add_many(enqueued)
+
+        hits = sum(1 for result in results if result.idempotent)
+        await metrics.inc("payments_batch_items_total", len(items))
+        await _report_filter(len(keys), len(candidates), found, len(conflicts))
+        if hits:
+            await metrics.inc("idempotency_hits_total", hits)
+        if enqueued:
+            await metrics.inc("payments_task_enqueued_total", len(enqueued))
+        logger.info(
+            "payments batch created: items=%s created=%s enqueued=%s idempotency_hits=%s",
+            len(items),
+            sum(1 for payment_id in payment_ids if payment_id is not None),
+            len(enqueued),
+            hits,
+        )
+        return results
+
+
+async def _report_filter(keys: int, candidates: int, found: int, missed: int) -> None:
+    # skipped — поиск не понадобился; false_positive — фильтр сказал "возможно", а платежа нет;
+    # missed — фильтр сказал "нет", а ключ уже был (вне окна фильтра или из другого процесса).
+    if keys:
+        await metrics.inc("idempotency_filter_skipped_total", keys - candidates)
+        await metrics.inc("idempotency_filter_hits_total", found)
+        await metrics.inc("idempotency_filter_false_positives_total", candidates - found)
+    if missed:
+        await metrics.inc("idempotency_filter_missed_total", missed)
+
+
+def _idempotent_result(user_id: int, payment_id: int, status: PaymentStatus) -> PaymentBatchResultDTO:
+    return PaymentBatchResultDTO(user_id=user_id, status=_public_status(status), payment_id=payment_id, idempotent=True)
+
+
+def _public_status(status: PaymentStatus) -> str:
+    # NEW и PROCESSING для клиента одно и то же: платёж ещё в обработке.
+    return "processing" if status in (PaymentStatus.NEW, PaymentStatus.PROCESSING) else status.value
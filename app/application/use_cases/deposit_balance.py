@@ -3,72 +3,48 @@ import logging
 from app.application.dto.payment import DepositDTO
 from app.core.metrics import metrics
 from app.core.settings import settings
-from app.domain.entities.user import User
 from app.domain.exceptions import UserNotFoundError
-from app.infrastructure.db.models.payment import PaymentStatus
-from app.infrastructure.db.models.transaction import TransactionStatus
-from app.workers.queue import enqueue_payment
+from app.infrastructure.db.models.transaction import TransactionType
+from app.infrastructure.idempotency_filter import idempotency_filter
 
 
 logger = logging.getLogger("usecase.deposit")
 
 
 class DepositBalanceUseCase:
-    def __init__(self, user_repo, payment_repo, transaction_repo, session):
-        self.user_repo = user_repo
-        self.payment_repo = payment_repo
-        self.transaction_repo = transaction_repo
+    def __init__(self, creation_repo, session):
+        self.creation_repo = creation_repo
         self.session = session
 
     async def execute(self, dto: DepositDTO) -> int:
-        payment_id: int | None = None
-        async with self.session.begin():
-            user: User | None = await self.user_repo.get_by_id(dto.user_id)
-            if not user:
-                raise UserNotFoundError(f"User {dto.user_id} not found")
-
-            if dto.idempotency_key:
-                existing = await self.payment_repo.get_by_idempotency_key(
-                    user_id=user.id,
-                    key=dto.idempotency_key,
-                )
-                if existing:
-                    await metrics.inc("idempotency_hits_total")
-                    logger.info("idempotency hit: user_id=%s payment_id=%s", user.id, existing.id)
-                    return existing.id
-
-            dto.commission = round(dto.amount * settings.transaction_fee, 2)
+        dto.commission = round(dto.amount * settings.transaction_fee, 2)
 
-            payment = await self.payment_repo.create(
-                user_id=user.id,
+        async with self.session.begin():
+            # Платёж, транзакция и задача в очередь — одним запросом; повтор по Idempotency-Key
+            # (в том числе параллельный) получает id исходного платежа.
+            payment = await self.creation_repo.create(
+                user_id=dto.user_id,
                 amount=dto.amount,
                 commission=dto.commission,
-                status=PaymentStatus.NEW,
+                type=TransactionType.DEPOSIT,
                 idempotency_key=dto.idempotency_key,
             )
+            if payment is None:
+                raise UserNotFoundError(f"User {dto.user_id} not found")
 
-            await self.session.flush()
-
-            await self.transaction_repo.create(
-                user_id=user.id,
-                payment_id=payment.id,
-                amount=dto.amount,
-                commission=dto.commission,
-                type="deposit",
-                status=TransactionStatus.PROCESSING.value,
-            )
-
-            payment_id = payment.id
-            logger.info(
-                "payment created: type=deposit payment_id=%s user_id=%s amount=%s commission=%s",
-                payment.id,
-                user.id,
-                dto.amount,
-                dto.commission,
-            )
-
-        if payment_id is not None:
-            enqueue_payment(payment_id)
-            await metrics.inc("payments_task_enqueued_total")
-
-        return payment_id
+        if not payment.created:
+            await metrics.inc("idempotency_hits_total")
+            logger.info("idempotency hit: user_id=%s payment_id=%s", dto.user_id, payment.payment_id)
+            return payment.payment_id
+
+        if dto.idempotency_key:
+            idempotency_filter.add(dto.user_id, dto.idempotency_key)
+        logger.info(
+            "payment created: type=deposit payment_id=%s user_id=%s amount=%s commission=%s",
+            payment.payment_id,
+            dto.user_id,
+            dto.amount,
+            dto.commission,
+        )
+        await metrics.inc("payments_task_enqueued_total")
+        return payment.payment_id
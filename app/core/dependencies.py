@@ -3,11 +3,14 @@
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.application.use_cases.create_payments_batch import CreatePaymentsBatchUseCase
 from app.application.use_cases.create_user import CreateUserUseCase
 from app.application.use_cases.deposit_balance import DepositBalanceUseCase
 from app.application.use_cases.withdraw_balance import WithdrawBalanceUseCase
 from app.infrastructure.db.session import get_session
 from app.infrastructure.repositories.payment import PaymentRepository
+from app.infrastructure.repositories.payment_creation import PaymentCreationRepository
+from app.infrastructure.repositories.payment_outbox import PaymentOutboxRepository
 from app.infrastructure.repositories.transaction import TransactionRepository
 from app.infrastructure.repositories.user import UserRepository
 
@@ -27,6 +30,14 @@ async def get_transaction_repo(session: SessionDep) -> TransactionRepository:
     return TransactionRepository(session)
 
 
+async def get_outbox_repo(session: SessionDep) -> PaymentOutboxRepository:
+    return PaymentOutboxRepository(session)
+
+
+async def get_creation_repo(session: SessionDep) -> PaymentCreationRepository:
+    return PaymentCreationRepository(session)
+
+
 async def get_create_user_use_case(
     session: SessionDep,
     user_repo: Annotated[UserRepository, Depends(get_user_repo)],
@@ -36,17 +47,34 @@ async def get_create_user_use_case(
 
 async def get_deposit_use_case(
     session: SessionDep,
-    user_repo: Annotated[UserRepository, Depends(get_user_repo)],
-    payment_repo: Annotated[PaymentRepository, Depends(get_payment_repo)],
-    transaction_repo: Annotated[TransactionRepository, Depends(get_transaction_repo)],
+    creation_repo: Annotated[PaymentCreationRepository, Depends(get_creation_repo)],
 ) -> DepositBalanceUseCase:
-    return DepositBalanceUseCase(user_repo, payment_repo, transaction_repo, session)
+    return DepositBalanceUseCase(creation_repo, session)
 
 
 async def get_withdraw_use_case(
+    session: SessionDep,
+    creation_repo: Annotated[PaymentCreationRepository, Depends(get_creation_repo)],
+) -> WithdrawBalanceUseCase:
+    return WithdrawBalanceUseCase(creation_repo, session)
+
+
+async def get_payments_batch_use_case(
     session: SessionDep,
     user_repo: Annotated[UserRepository, Depends(get_user_repo)],
     payment_repo: Annotated[PaymentRepository, Depends(get_payment_repo)],
     transaction_repo: Annotated[TransactionRepository, Depends(get_transaction_repo)],
-) -> WithdrawBalanceUseCase:
-    return WithdrawBalanceUseCase(user_repo, payment_repo, transaction_repo, session)
+    outbox_repo: Annotated[PaymentOutboxRepository, Depends(get_outbox_repo)],
+) -> CreatePaymentsBatchUseCase:
+    return CreatePaymentsBatchUseCase(user_repo, payment_repo, transaction_repo, outbox_repo, session)
+
+
+def build_payments_batch_use_case(session: AsyncSession) -> CreatePaymentsBatchUseCase:
+    # Для потокового приёма: сессия живёт, пока отдаётся ответ, а не только до выхода из обработчика.
+    return CreatePaymentsBatchUseCase(
+        UserRepository(session),
+        PaymentRepository(session),
+        TransactionRepository(session),
+        PaymentOutboxRepository(session),
+        session,
+    )
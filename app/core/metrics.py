@@ -1,5 +1,11 @@
 import asyncio
+import time
 from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+# Границы бакетов гистограмм по умолчанию, мс.
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
 
 
 class MetricsRegistry:
@@ -11,6 +17,30 @@ class MetricsRegistry:
         async with self._lock:
             self._counters[name] += value
 
+    async def set(self, name: str, value: int) -> None:
+        # Gauge: последнее значение, а не накопленная сумма.
+        async with self._lock:
+            self._counters[name] = value
+
+    async def observe(self, name: str, value: float, buckets: tuple[int, ...] = DEFAULT_BUCKETS_MS) -> None:
+        # Гистограмма как в Prometheus: кумулятивные бакеты name_le_<граница>, плюс name_count и name_sum.
+        async with self._lock:
+            for bound in buckets:
+                if value <= bound:
+                    self._counters[f"{name}_le_{bound}"] += 1
+            self._counters[f"{name}_le_inf"] += 1
+            self._counters[f"{name}_count"] += 1
+            self._counters[f"{name}_sum"] += int(value)
+
+    @asynccontextmanager
+    async def timer(self, name: str) -> AsyncIterator[None]:
+        # Время копится в микросекундах: счётчики целочисленные, а запросы к БД бывают быстрее 1 мс.
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            await self.inc(name, int((time.perf_counter() - started) * 1_000_000))
+
     async def snapshot(self) -> dict[str, int]:
         async with self._lock:
             return dict(self._counters)
@@ -0,0 +1,89 @@
+import random
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from app.core.metrics import metrics
+from app.core.settings import settings
+from app.core.shared_state import SharedState
+
+
+class RetryBudget:
+    """Бюджет ретраев (token bucket): каждая первая попытка добавляет ratio токена, ретрай тратит один.
+
+    Так ретраи не превышают заданной доли первых попыток; min_per_second — небольшой
+    гарантированный поток ретраев, когда новых платежей нет. Если задан path, bucket лежит
+    в файле в shared memory и один на все процессы хоста: N воркеров не получают N бюджетов.
+    """
+
+    def __init__(
+        self,
+        ratio: float | None = None,
+        min_per_second: float | None = None,
+        max_tokens: float | None = None,
+        path: str | None = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.ratio = ratio if ratio is not None else settings.retry_budget_ratio
+        self.min_per_second = min_per_second if min_per_second is not None else settings.retry_budget_min_per_second
+        self.max_tokens = max_tokens if max_tokens is not None else settings.retry_budget_max_tokens
+        self.path = path if path is not None else settings.retry_budget_state_path
+        self._clock = clock
+        # initialized, tokens, updated_at — время по time.time(), общее для процессов.
+        self._shared = SharedState(self.path, fields=3, name="retry budget")
+        self._tokens = self.max_tokens
+
+    def close(self) -> None:
+        self._shared.close()
+
+    @property
+    def tokens(self) -> float:
+        with self._bucket():
+            pass
+        return self._tokens
+
+    def deposit(self) -> None:
+        with self._bucket() as bucket:
+            bucket[1] = min(bucket[1] + self.ratio, self.max_tokens)
+
+    def try_spend(self) -> bool:
+        with self._bucket() as bucket:
+            if bucket[1] < 1:
+                return False
+            bucket[1] -= 1
+            return True
+
+    @contextmanager
+    def _bucket(self) -> Iterator[list[float]]:
+        with self._shared.locked() as bucket:
+            now = self._clock()
+            if not bucket[0]:
+                # Файл только что создан — первый процесс начинает с полного бюджета.
+                bucket[:] = 1.0, self.max_tokens, now
+            elapsed = max(now - bucket[2], 0.0)
+            bucket[1] = min(bucket[1] + elapsed * self.min_per_second, self.max_tokens)
+            bucket[2] = now
+            try:
+                yield bucket
+            finally:
+                # Последнее увиденное значение — для метрики retry_budget_tokens.
+                self._tokens = bucket[1]
+
+    async def record_first_attempt(self) -> None:
+        self.deposit()
+        await metrics.inc("retry_budget_first_attempts_total")
+        await metrics.set("retry_budget_tokens", int(self._tokens))
+
+    async def acquire_retry(self) -> bool:
+        allowed = self.try_spend()
+        await metrics.inc("retry_budget_retries_allowed_total" if allowed else "retry_budget_retries_deferred_total")
+        await metrics.set("retry_budget_tokens", int(self._tokens))
+        return allowed
+
+    @staticmethod
+    def defer_seconds() -> float:
+        # Разброс, чтобы отложенные ретраи не вернулись одной волной.
+        return settings.retry_budget_defer_seconds * (1 + random.random())
+
+
+retry_budget = RetryBudget()
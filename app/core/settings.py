@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Literal
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -34,18 +35,139 @@ class Settings(BaseSettings):
     celery_result_backend: str = Field(default="rpc://")
     celery_task_time_limit_seconds: int = Field(default=30)
     celery_task_soft_time_limit_seconds: int = Field(default=25)
+    # Не больше enqueue_batch_max_size id платежей в одном сообщении payments.process_batch.
+    enqueue_batch_max_size: int = Field(default=100)
+    payment_batch_concurrency: int = Field(default=10)
+    # 0 — одна очередь payments; N — очереди payments.p0..p{N-1} по user_id % N, у каждой один активный потребитель.
+    payment_partitions: int = Field(default=0)
+    # Неблокирующая публикация из API: буфер id и пачки publisher confirms.
+    publisher_buffer_size: int = Field(default=10000)
+    publisher_confirm_batch_size: int = Field(default=100)
+    publisher_confirm_timeout_seconds: float = Field(default=5.0)
+    publisher_reconnect_delay_seconds: float = Field(default=1.0)
+    publisher_shutdown_timeout_seconds: float = Field(default=10.0)
+    # Асинхронный потребитель (python -m app.workers.async_consumer).
+    async_consumer_concurrency: int = Field(default=50)
+    async_consumer_heartbeat_seconds: int = Field(default=30)
+    async_consumer_drain_timeout_seconds: float = Field(default=0.1)
+    async_consumer_reconnect_delay_seconds: float = Field(default=2.0)
 
     gateway_timeout_seconds: float = Field(default=1.0)
     gateway_max_attempts: int = Field(default=3)
     gateway_backoff_base_seconds: float = Field(default=1.0)
     gateway_backoff_max_seconds: float = Field(default=30.0)
     gateway_backoff_jitter_seconds: float = Field(default=0.5)
+    gateway_pool_max_connections: int = Field(default=100)
+    gateway_pool_max_keepalive_connections: int = Field(default=20)
+    gateway_pool_keepalive_expiry_seconds: float = Field(default=30.0)
+    gateway_http2: bool = Field(default=False)
+    # Circuit breaker: размыкается, если за окно не меньше min_calls вызовов и доля сбоев >= failure_rate.
+    gateway_breaker_window_seconds: float = Field(default=10.0)
+    gateway_breaker_min_calls: int = Field(default=20)
+    gateway_breaker_failure_rate: float = Field(default=0.5)
+    gateway_breaker_open_seconds: float = Field(default=5.0)
+    gateway_breaker_half_open_calls: int = Field(default=3)
+    # Адаптивный (AIMD) лимит одновременных вызовов шлюза на процесс.
+    gateway_limit_initial: int = Field(default=20)
+    gateway_limit_min: int = Field(default=1)
+    gateway_limit_max: int = Field(default=100)
+    gateway_limit_latency_target_seconds: float = Field(default=0.5)
+    gateway_limit_backoff_ratio: float = Field(default=0.9)
+    # Token bucket вызовов шлюза, общий для процессов хоста через файл в shared memory.
+    # 0 — без своего лимита, но Retry-After и X-RateLimit-Remaining: 0 соблюдаются всегда.
+    gateway_rate_limit_per_second: float = Field(default=0.0)
+    gateway_rate_limit_burst: int = Field(default=50)
+    # Пустая строка — состояние только в памяти процесса; общий для хоста bucket включается
+    # явно путём в shared memory (например, /dev/shm/payments-gateway-rate-limit).
+    gateway_rate_limit_state_path: str = Field(default="")
 
     # ===============================
     # Worker
     # ===============================
     worker_poll_interval_seconds: float = Field(default=0.5)
     worker_processing_timeout_seconds: float = Field(default=30.0)
+    # Должен быть заметно меньше worker_processing_timeout_seconds.
+    worker_lease_heartbeat_interval_seconds: float = Field(default=10.0)
+    worker_batch_size: int = Field(default=10)
+    worker_concurrency: int = Field(default=20)
+    worker_listen_enabled: bool = Field(default=True)
+    worker_fallback_poll_interval_seconds: float = Field(default=30.0)
+    worker_finalize_batch_size: int = Field(default=50)
+    worker_finalize_window_seconds: float = Field(default=0.01)
+
+    # ===============================
+    # Task archive
+    # ===============================
+    # archive — переносить завершённые задачи в payment_tasks_archive, delete — просто удалять.
+    task_archive_mode: Literal["archive", "delete"] = Field(default="archive")
+    task_archive_after_seconds: float = Field(default=86400.0)
+    task_archive_batch_size: int = Field(default=1000)
+    task_archive_batch_pause_seconds: float = Field(default=0.05)
+    task_archive_interval_seconds: float = Field(default=60.0)
+
+    # ===============================
+    # Task reaper
+    # ===============================
+    task_reaper_interval_seconds: float = Field(default=5.0)
+    task_reaper_batch_size: int = Field(default=1000)
+
+    # ===============================
+    # Outbox relay
+    # ===============================
+    # celery — публиковать payments.process(_batch) в RabbitMQ, db — создавать строки payment_tasks.
+    payment_queue_backend: Literal["celery", "db"] = Field(default="celery")
+    outbox_relay_batch_size: int = Field(default=500)
+    outbox_relay_listen_enabled: bool = Field(default=True)
+    outbox_relay_poll_interval_seconds: float = Field(default=0.5)
+    outbox_relay_fallback_poll_interval_seconds: float = Field(default=5.0)
+    outbox_relay_publish_timeout_seconds: float = Field(default=10.0)
+
+    # ===============================
+    # Retry scheduler
+    # ===============================
+    # Ретраи Celery-задач хранятся в payment_retries и выпускаются pump'ом не быстрее заданной скорости.
+    retry_bucket_seconds: float = Field(default=5.0)
+    retry_pump_rate_per_second: float = Field(default=200.0)
+    retry_pump_batch_size: int = Field(default=500)
+    retry_pump_interval_seconds: float = Field(default=0.5)
+    retry_pump_max_idle_seconds: float = Field(default=5.0)
+    retry_pump_publish_timeout_seconds: float = Field(default=10.0)
+
+    # ===============================
+    # Retry budget
+    # ===============================
+    # Ретраи к шлюзу — не больше retry_budget_ratio от первых попыток; сверх бюджета откладываются.
+    retry_budget_ratio: float = Field(default=0.1)
+    retry_budget_min_per_second: float = Field(default=1.0)
+    retry_budget_max_tokens: float = Field(default=100.0)
+    retry_budget_defer_seconds: float = Field(default=5.0)
+    # Пустая строка — бюджет свой у каждого процесса; общий для хоста включается
+    # явно путём в shared memory (например, /dev/shm/payments-retry-budget).
+    retry_budget_state_path: str = Field(default="")
+
+    # ===============================
+    # Payments batch API
+    # ===============================
+    payments_batch_max_items: int = Field(default=10000)
+    # Потоковый приём NDJSON: строки коммитятся пачками по столько элементов.
+    payments_stream_chunk_size: int = Field(default=1000)
+
+    # ===============================
+    # Idempotency filter
+    # ===============================
+    # Фильтр Блума по недавним ключам идемпотентности: заведомо новые ключи не ищутся в БД.
+    idempotency_filter_enabled: bool = Field(default=True)
+    idempotency_filter_capacity: int = Field(default=1_000_000)
+    idempotency_filter_false_positive_rate: float = Field(default=0.01)
+
+    # ===============================
+    # Supervisor
+    # ===============================
+    supervisor_procs: int = Field(default=2)
+    supervisor_check_interval_seconds: float = Field(default=1.0)
+    supervisor_restart_backoff_base_seconds: float = Field(default=1.0)
+    supervisor_restart_backoff_max_seconds: float = Field(default=30.0)
+    supervisor_shutdown_timeout_seconds: float = Field(default=30.0)
 
     # ===============================
     # Logging
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import struct
+import weakref
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: состояние остаётся в памяти процесса
+    fcntl = None
+
+logger = logging.getLogger("shared_state")
+
+
+class SharedState:
+    """Несколько float, общих для процессов хоста: файл в shared memory, изменения под fcntl.flock.
+
+    Без path (или без fcntl/прав на файл) состояние живёт в памяти процесса. Новый файл
+    заполнен нулями — инициализировать его должен первый процесс, который его прочитает.
+    """
+
+    def __init__(self, path: str, fields: int, name: str):
+        self.path = path
+        self.name = name
+        self._struct = struct.Struct("d" * fields)
+        self._fd: int | None = None
+        self._buffer: mmap.mmap | bytearray | None = None
+        _states.add(self)
+
+    def close(self) -> None:
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+        self._buffer = None
+
+    @contextmanager
+    def locked(self) -> Iterator[list[float]]:
+        """Значения под эксклюзивной блокировкой; изменения списка записываются при выходе без ошибки."""
+        if self._buffer is None:
+            self._open()
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            values = list(self._struct.unpack_from(self._buffer))
+            yield values
+            self._struct.pack_into(self._buffer, 0, *values)
+        finally:
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _open(self) -> None:
+        if not self.path or fcntl is None:
+            self._buffer = bytearray(self._struct.size)
+            return
+        try:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(self._fd).st_size < self._struct.size:
+                os.ftruncate(self._fd, self._struct.size)
+            self._buffer = mmap.mmap(self._fd, self._struct.size)
+        except OSError as exc:
+            # Нет /dev/shm (macOS) или нет прав — состояние остаётся на процесс, но работает.
+            logger.warning("shared state is process-local: name=%s path=%s error=%s", self.name, self.path, exc)
+            self.close()
+            self._buffer = bytearray(self._struct.size)
+            return
+        logger.info("shared state opened: name=%s path=%s", self.name, self.path)
+
+
+_states: weakref.WeakSet[SharedState] = weakref.WeakSet()
+
+
+def _reopen_after_fork() -> None:
+    # flock держится на открытом описании файла, а после fork оно общее с родителем: блокировка
+    # родителя не исключала бы детей. Ребёнок забывает унаследованный fd и откроет файл сам.
+    for state in list(_states):
+        state.close()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reopen_after_fork)
@@ -16,3 +16,7 @@ class UserInsufficientFundsError(UserError):
 
 class UserNotFoundError(UserError):
     pass
+
+
+class PaymentIdempotencyConflictError(Exception):
+    pass
@@ -0,0 +1,44 @@
+"""notify_payment_tasks
+
+Revision ID: 0003_notify_payment_tasks
+Revises: 0002_add_task_and_dlq
+Create Date: 2026-03-02 00:00:00
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0003_notify_payment_tasks"
+down_revision = "0002_add_task_and_dlq"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Будим воркеры (LISTEN payment_tasks), когда задача создана или снова переведена в new
+    # и её уже можно взять. Ретрай с будущим next_retry_at не будит: до его срока воркер
+    # досыпает сам. Payload пустой: одинаковые уведомления внутри одной транзакции Postgres схлопывает.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_payment_task_ready() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.status = 'new' AND (NEW.next_retry_at IS NULL OR NEW.next_retry_at <= now()) THEN
+                PERFORM pg_notify('payment_tasks', '');
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER payment_tasks_notify_ready
+        AFTER INSERT OR UPDATE OF status, next_retry_at ON payment_tasks
+        FOR EACH ROW EXECUTE FUNCTION notify_payment_task_ready();
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS payment_tasks_notify_ready ON payment_tasks")
+    op.execute("DROP FUNCTION IF EXISTS notify_payment_task_ready()")
@@ -0,0 +1,45 @@
+"""payment_tasks_reservation_indexes
+
+Revision ID: 0004_task_reservation_indexes
+Revises: 0003_notify_payment_tasks
+Create Date: 2026-03-09 00:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0004_task_reservation_indexes"
+down_revision = "0003_notify_payment_tasks"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Индексы строим CONCURRENTLY, чтобы не блокировать запись в рабочую очередь.
+    # CONCURRENTLY нельзя выполнять внутри транзакции — отсюда autocommit_block.
+    with op.get_context().autocommit_block():
+        # Новые задачи и ретраи, срок которых наступил: status = 'new' ORDER BY created_at.
+        op.create_index(
+            "ix_payment_tasks_ready",
+            "payment_tasks",
+            ["created_at", "next_retry_at"],
+            postgresql_where=sa.text("status = 'new'"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        # Зависшие задачи: status = 'processing' AND locked_at < :stuck_before.
+        op.create_index(
+            "ix_payment_tasks_stuck",
+            "payment_tasks",
+            ["locked_at"],
+            postgresql_where=sa.text("status = 'processing'"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_payment_tasks_stuck", table_name="payment_tasks", postgresql_concurrently=True, if_exists=True)
+        op.drop_index("ix_payment_tasks_ready", table_name="payment_tasks", postgresql_concurrently=True, if_exists=True)
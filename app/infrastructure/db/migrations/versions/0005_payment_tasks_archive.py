@@ -0,0 +1,59 @@
+"""payment_tasks_archive
+
+Revision ID: 0005_payment_tasks_archive
+Revises: 0004_task_reservation_indexes
+Create Date: 2026-03-16 00:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "0005_payment_tasks_archive"
+down_revision = "0004_task_reservation_indexes"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    payment_task_status_enum = postgresql.ENUM(
+        "new",
+        "processing",
+        "done",
+        "failed",
+        name="paymenttaskstatus",
+        create_type=False,
+    )
+
+    # Архив завершённых задач: без FK и уникальных ограничений, чтобы перенос был дешёвым.
+    op.create_table(
+        "payment_tasks_archive",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column("payment_id", sa.Integer(), nullable=False),
+        sa.Column("status", payment_task_status_enum, nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("last_error", sa.String(length=500), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("archived_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.text("now()")),
+    )
+    op.create_index("ix_payment_tasks_archive_payment_id", "payment_tasks_archive", ["payment_id"])
+
+    with op.get_context().autocommit_block():
+        # Кандидаты на архивацию: status IN ('done', 'failed') AND updated_at < :finished_before.
+        op.create_index(
+            "ix_payment_tasks_finished",
+            "payment_tasks",
+            ["updated_at"],
+            postgresql_where=sa.text("status IN ('done', 'failed')"),
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index("ix_payment_tasks_finished", table_name="payment_tasks", postgresql_concurrently=True, if_exists=True)
+    op.drop_index("ix_payment_tasks_archive_payment_id", table_name="payment_tasks_archive")
+    op.drop_table("payment_tasks_archive")
@@ -0,0 +1,28 @@
+"""payment_tasks_lease_version
+
+Revision ID: 0006_payment_tasks_lease_version
+Revises: 0005_payment_tasks_archive
+Create Date: 2026-03-20 00:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0006_payment_tasks_lease_version"
+down_revision = "0005_payment_tasks_archive"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Fencing token: растёт при каждом резервировании задачи. Воркер, чей lease уже
+    # перехвачен, финализирует со старой версией — и его запись отбрасывается.
+    op.add_column(
+        "payment_tasks",
+        sa.Column("lease_version", sa.Integer(), nullable=False, server_default="0"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("payment_tasks", "lease_version")
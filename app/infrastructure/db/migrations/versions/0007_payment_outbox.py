@@ -0,0 +1,67 @@
+"""payment_outbox
+
+Revision ID: 0007_payment_outbox
+Revises: 0006_payment_tasks_lease_version
+Create Date: 2026-03-24 00:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0007_payment_outbox"
+down_revision = "0006_payment_tasks_lease_version"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Transactional outbox: запись создаётся в одной транзакции с платежом,
+    # relay публикует её в очередь и проставляет sent_at.
+    op.create_table(
+        "payment_outbox",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("payment_id", sa.Integer(), sa.ForeignKey("payments.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.text("now()")),
+        sa.Column("sent_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index(
+        "ix_payment_outbox_pending",
+        "payment_outbox",
+        ["id"],
+        postgresql_where=sa.text("sent_at IS NULL"),
+    )
+    op.create_index(
+        "ix_payment_outbox_sent",
+        "payment_outbox",
+        ["sent_at"],
+        postgresql_where=sa.text("sent_at IS NOT NULL"),
+    )
+
+    # Будим relay (LISTEN payment_outbox) на каждую новую запись; как и в 0003,
+    # уведомления одной транзакции Postgres схлопывает в одно.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION notify_payment_outbox() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('payment_outbox', '');
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER payment_outbox_notify
+        AFTER INSERT ON payment_outbox
+        FOR EACH ROW EXECUTE FUNCTION notify_payment_outbox();
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS payment_outbox_notify ON payment_outbox")
+    op.execute("DROP FUNCTION IF EXISTS notify_payment_outbox()")
+    op.drop_index("ix_payment_outbox_sent", table_name="payment_outbox")
+    op.drop_index("ix_payment_outbox_pending", table_name="payment_outbox")
+    op.drop_table("payment_outbox")
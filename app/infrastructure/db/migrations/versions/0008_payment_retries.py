@@ -0,0 +1,37 @@
+"""payment_retries
+
+Revision ID: 0008_payment_retries
+Revises: 0007_payment_outbox
+Create Date: 2026-03-28 00:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0008_payment_retries"
+down_revision = "0007_payment_outbox"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Расписание ретраев вместо countdown в Celery: одна строка на платёж,
+    # pump выпускает наступившие корзины с ограниченной скоростью.
+    op.create_table(
+        "payment_retries",
+        sa.Column("id", sa.BigInteger(), primary_key=True),
+        sa.Column("payment_id", sa.Integer(), sa.ForeignKey("payments.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("retries", sa.Integer(), nullable=False),
+        sa.Column("queue", sa.String(length=100), nullable=False),
+        sa.Column("due_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("due_bucket", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False, server_default=sa.text("now()")),
+        sa.UniqueConstraint("payment_id", name="uq_payment_retries_payment_id"),
+    )
+    op.create_index("ix_payment_retries_due", "payment_retries", ["due_bucket", "due_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_payment_retries_due", table_name="payment_retries")
+    op.drop_table("payment_retries")
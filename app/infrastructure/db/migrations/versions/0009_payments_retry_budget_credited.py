@@ -0,0 +1,28 @@
+"""payments_retry_budget_credited
+
+Revision ID: 0009_payments_retry_budget_credited
+Revises: 0008_payment_retries
+Create Date: 2026-04-02 00:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0009_payments_retry_budget_credited"
+down_revision = "0008_payment_retries"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Первая попытка пополняет бюджет ретраев один раз на платёж. attempts для этого не годится:
+    # отложенный вызов возвращает попытку, и платёж снова выглядел бы как новый.
+    op.add_column(
+        "payments",
+        sa.Column("retry_budget_credited", sa.Boolean(), nullable=False, server_default=sa.false()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("payments", "retry_budget_credited")
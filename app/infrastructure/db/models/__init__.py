@@ -4,3 +4,6 @@ from .payment import PaymentModel
 from .transaction import TransactionModel
 from .payment_dlq import PaymentDLQModel
 from .payment_task import PaymentTaskModel
+from .payment_task_archive import PaymentTaskArchiveModel
+from .payment_outbox import PaymentOutboxModel
+from .payment_retry import PaymentRetryModel
@@ -4,6 +4,7 @@ from enum import Enum as PyEnum
 from datetime import datetime
 
 from sqlalchemy import (
+    Boolean,
     ForeignKey,
     Numeric,
     Enum,
@@ -72,6 +73,14 @@ class PaymentModel(Base):
         nullable=True,
     )
 
+    # Первая попытка уже пополнила бюджет ретраев (миграция 0009); дальше платёж только тратит его.
+    retry_budget_credited: Mapped[bool] = mapped_column(
+        Boolean,
+        default=False,
+        server_default="false",
+        nullable=False,
+    )
+
     next_retry_at: Mapped[datetime | None] = mapped_column(
         DateTime(timezone=True),
         nullable=True,
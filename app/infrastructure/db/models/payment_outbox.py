@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, func, text
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.infrastructure.db.base import Base
+
+
+class PaymentOutboxModel(Base):
+    __tablename__ = "payment_outbox"
+    __table_args__ = (
+        # Неотправленные записи в порядке создания — только их читает relay (миграция 0007).
+        Index(
+            "ix_payment_outbox_pending",
+            "id",
+            postgresql_where=text("sent_at IS NULL"),
+        ),
+        # Отправленные — для очистки архиватором.
+        Index(
+            "ix_payment_outbox_sent",
+            "sent_at",
+            postgresql_where=text("sent_at IS NOT NULL"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    payment_id: Mapped[int] = mapped_column(
+        ForeignKey("payments.id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
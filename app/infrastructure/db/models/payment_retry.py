@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, Integer, String, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.infrastructure.db.base import Base
+
+
+class PaymentRetryModel(Base):
+    """Отложенный ретрай платежа: хранится в БД до срока, а не ETA-сообщением в памяти воркера."""
+
+    __tablename__ = "payment_retries"
+    __table_args__ = (
+        # Pump читает корзины по возрастанию срока (миграция 0008).
+        Index("ix_payment_retries_due", "due_bucket", "due_at"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    payment_id: Mapped[int] = mapped_column(
+        ForeignKey("payments.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+    )
+    # Номер ретрая для заголовка retries сообщения payments.process.
+    retries: Mapped[int] = mapped_column(Integer, nullable=False)
+    queue: Mapped[str] = mapped_column(String(100), nullable=False)
+    due_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    # Начало корзины RETRY_BUCKET_SECONDS, в которую попадает due_at.
+    due_bucket: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
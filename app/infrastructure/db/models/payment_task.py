@@ -1,7 +1,7 @@
 from datetime import datetime
 from enum import Enum as PyEnum
 
-from sqlalchemy import DateTime, Enum, ForeignKey, Integer, String, func
+from sqlalchemy import DateTime, Enum, ForeignKey, Index, Integer, String, func, text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.infrastructure.db.base import Base
@@ -16,6 +16,27 @@ class PaymentTaskStatus(PyEnum):
 
 class PaymentTaskModel(Base):
     __tablename__ = "payment_tasks"
+    __table_args__ = (
+        # Частичные индексы под резервирование (миграция 0004): в них только "живые" строки,
+        # поэтому размер не зависит от накопленной истории done/failed.
+        Index(
+            "ix_payment_tasks_ready",
+            "created_at",
+            "next_retry_at",
+            postgresql_where=text("status = 'new'"),
+        ),
+        Index(
+            "ix_payment_tasks_stuck",
+            "locked_at",
+            postgresql_where=text("status = 'processing'"),
+        ),
+        # Завершённые задачи для архивации (миграция 0005); архиватор держит его маленьким.
+        Index(
+            "ix_payment_tasks_finished",
+            "updated_at",
+            postgresql_where=text("status IN ('done', 'failed')"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True)
     payment_id: Mapped[int] = mapped_column(
@@ -33,6 +54,8 @@ class PaymentTaskModel(Base):
         nullable=False,
     )
     attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # Fencing token (миграция 0006): увеличивается при каждом резервировании.
+    lease_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
     last_error: Mapped[str | None] = mapped_column(String(500), nullable=True)
     next_retry_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
     locked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
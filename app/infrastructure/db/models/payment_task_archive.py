@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from sqlalchemy import DateTime, Enum, Integer, String, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.infrastructure.db.base import Base
+from app.infrastructure.db.models.payment_task import PaymentTaskStatus
+
+
+class PaymentTaskArchiveModel(Base):
+    __tablename__ = "payment_tasks_archive"
+
+    # id переносится из payment_tasks как есть, без собственной последовательности.
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    payment_id: Mapped[int] = mapped_column(Integer, nullable=False, index=True)
+    status: Mapped[PaymentTaskStatus] = mapped_column(
+        Enum(
+            PaymentTaskStatus,
+            name="paymenttaskstatus",
+            values_callable=lambda enum_cls: [item.value for item in enum_cls],
+        ),
+        nullable=False,
+    )
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[str | None] = mapped_column(String(500), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    archived_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import logging
+from collections.abc import Callable
+
+import asyncpg
+from sqlalchemy.engine import make_url
+
+from app.core.settings import settings
+
+logger = logging.getLogger("db_notifications")
+
+
+def asyncpg_dsn(database_url: str) -> str:
+    # SQLAlchemy-URL (postgresql+asyncpg://...) -> обычный DSN для asyncpg.connect.
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class PgNotificationListener:
+    """Отдельное asyncpg-соединение, подписанное на LISTEN-канал Postgres."""
+
+    def __init__(self, channel: str, on_notify: Callable[[], None], database_url: str | None = None):
+        self.channel = channel
+        self._on_notify = on_notify
+        self._dsn = asyncpg_dsn(database_url or settings.database_url)
+        self._conn: asyncpg.Connection | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def connect(self) -> bool:
+        if self.connected:
+            return True
+
+        conn: asyncpg.Connection | None = None
+        try:
+            conn = await asyncpg.connect(self._dsn)
+            await conn.add_listener(self.channel, self._handle_notification)
+        except (OSError, asyncpg.PostgresError) as exc:
+            logger.warning("listen failed: channel=%s error=%s", self.channel, exc)
+            if conn is not None:
+                # Соединение открылось, но LISTEN не прошёл — закрываем, иначе каждая попытка его оставит.
+                await self._discard(conn)
+            self._conn = None
+            return False
+
+        conn.add_termination_listener(self._handle_termination)
+        self._conn = conn
+        logger.info("listening: channel=%s", self.channel)
+        # Пока соединения не было, уведомления могли потеряться — будим подписчика.
+        self._on_notify()
+        return True
+
+    async def close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            await conn.close()
+
+    @staticmethod
+    async def _discard(conn: asyncpg.Connection) -> None:
+        try:
+            await conn.close()
+        except (OSError, asyncpg.PostgresError):
+            conn.terminate()
+
+    def _handle_notification(self, _conn, _pid, _channel, _payload) -> None:
+        self._on_notify()
+
+    def _handle_termination(self, _conn) -> None:
+        logger.warning("listen connection lost: channel=%s", self.channel)
+        self._conn = None
+        self._on_notify()
@@ -2,6 +2,7 @@ from typing import Annotated
 
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
@@ -9,13 +10,18 @@ from sqlalchemy.ext.asyncio import (
 
 from app.core.settings import settings
 
-engine = create_async_engine(
-    settings.database_url,
-    echo=settings.db_echo or settings.debug,
-    pool_size=settings.db_pool_size,
-    max_overflow=settings.db_max_overflow,
-    pool_pre_ping=True,
-)
+
+def build_engine() -> AsyncEngine:
+    return create_async_engine(
+        settings.database_url,
+        echo=settings.db_echo or settings.debug,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_pre_ping=True,
+    )
+
+
+engine = build_engine()
 
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
@@ -23,6 +29,20 @@ AsyncSessionLocal = async_sessionmaker(
 )
 
 
+def rebuild_engine() -> AsyncEngine:
+    # После fork дочерний процесс не должен пользоваться пулом родителя:
+    # бросаем унаследованные соединения (не закрывая их) и строим свой engine.
+    global engine
+    engine.sync_engine.dispose(close=False)
+    engine = build_engine()
+    AsyncSessionLocal.configure(bind=engine)
+    return engine
+
+
+async def dispose_engine() -> None:
+    await engine.dispose()
+
+
 async def get_session() -> AsyncSession:
     async with AsyncSessionLocal() as session:
         yield session
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+
+from app.core.metrics import metrics
+from app.core.settings import settings
+from app.infrastructure.db.session import AsyncSessionLocal
+from app.infrastructure.repositories.payment import PaymentRepository
+
+logger = logging.getLogger("idempotency_filter")
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, false_positive_rate: float):
+        self.capacity = capacity
+        self.size = max(int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: bytes) -> list[int]:
+        # Двойное хеширование: k позиций из двух 64-битных половин одного blake2b.
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: bytes) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class IdempotencyKeyFilter:
+    """Фильтр Блума по недавним парам (user_id, idempotency_key) для отсечения заведомо новых ключей.
+
+    Два поколения по capacity ключей: когда текущее заполнено, предыдущее выбрасывается,
+    так что доля ложных срабатываний не растёт со временем. "Нет" от фильтра — только подсказка:
+    более старый ключ или ключ, вставленный другим процессом, всё равно поймает уникальный
+    индекс payments, а до прогрева фильтр на всё отвечает "возможно".
+    """
+
+    def __init__(self, capacity: int | None = None, false_positive_rate: float | None = None):
+        self.capacity = capacity or settings.idempotency_filter_capacity
+        self.false_positive_rate = false_positive_rate or settings.idempotency_filter_false_positive_rate
+        self.ready = False
+        self._current = BloomFilter(self.capacity, self.false_positive_rate)
+        self._previous: BloomFilter | None = None
+
+    @staticmethod
+    def _item(user_id: int, key: str) -> bytes:
+        return f"{user_id}:{key}".encode()
+
+    def might_contain(self, user_id: int, key: str) -> bool:
+        if not self.ready:
+            return True
+        item = self._item(user_id, key)
+        return item in self._current or (self._previous is not None and item in self._previous)
+
+    def add(self, user_id: int, key: str) -> None:
+        if self._current.count >= self.capacity:
+            self._previous = self._current
+            self._current = BloomFilter(self.capacity, self.false_positive_rate)
+        self._current.add(self._item(user_id, key))
+
+    async def warm(self) -> None:
+        """Загружает последние capacity ключей из payments; при ошибке фильтр остаётся выключенным."""
+        loaded = 0
+        try:
+            async with AsyncSessionLocal() as session:
+                async for user_id, key in PaymentRepository(session).iter_recent_idempotency_keys(self.capacity):
+                    self.add(user_id, key)
+                    loaded += 1
+        except Exception:
+            logger.exception("idempotency filter warmup failed, lookups stay enabled")
+            return
+        self.ready = True
+        await metrics.set("idempotency_filter_keys", loaded)
+        logger.info("idempotency filter warmed: keys=%s bits=%s hashes=%s", loaded, self._current.size, self._current.hashes)
+
+
+idempotency_filter = IdempotencyKeyFilter()
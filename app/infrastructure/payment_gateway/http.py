@@ -1,11 +1,20 @@
 from __future__ import annotations
 
+import asyncio
+import importlib.util
+import logging
+import time
 from dataclasses import dataclass
 from typing import Any
 
 import httpx
 
+from app.core.metrics import metrics
 from app.core.settings import settings
+from app.infrastructure.payment_gateway.rate_limit import GatewayRateLimiter
+from app.infrastructure.payment_gateway.resilience import AdaptiveConcurrencyLimit, CircuitBreaker, CircuitState
+
+logger = logging.getLogger("payment_gateway")
 
 
 @dataclass
@@ -14,25 +23,132 @@ class GatewayResponse:
     error: str | None = None
     raw_status: int | None = None
     retryable: bool = True
+    # Сколько секунд шлюз просил подождать (Retry-After) или сколько осталось до свободного токена.
+    retry_after: float | None = None
+    # False — вызов отсечён локально (нет токена, цепь разомкнута, нет места в лимите) и до шлюза
+    # не дошёл: попыткой платежа он не считается.
+    attempted: bool = True
 
 
 class PaymentGatewayClient:
     def __init__(self, base_url: str | None = None, timeout_seconds: float | None = None):
         self.base_url = base_url or settings.payment_gateway_url.rstrip("/")
         self.timeout_seconds = timeout_seconds or settings.gateway_timeout_seconds
+        self._client: httpx.AsyncClient | None = None
+        self.breaker = CircuitBreaker()
+        self.limit = AdaptiveConcurrencyLimit()
+        self.rate_limiter = GatewayRateLimiter()
+
+    @property
+    def is_open(self) -> bool:
+        return self._client is not None
+
+    async def open(self) -> None:
+        if self._client is None:
+            self._client = self._build_client()
+            logger.info("gateway client opened: base_url=%s", self.base_url)
+
+    async def close(self) -> None:
+        client, self._client = self._client, None
+        self.rate_limiter.close()
+        if client is not None:
+            await client.aclose()
+            logger.info("gateway client closed: base_url=%s", self.base_url)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        http2 = settings.gateway_http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            # HTTP/2 в httpx требует пакет h2 (httpx[http2]), без него остаёмся на HTTP/1.1.
+            logger.warning("gateway http2 requested but h2 is not installed, falling back to http/1.1")
+            http2 = False
+
+        limits = httpx.Limits(
+            max_connections=settings.gateway_pool_max_connections,
+            max_keepalive_connections=settings.gateway_pool_max_keepalive_connections,
+            keepalive_expiry=settings.gateway_pool_keepalive_expiry_seconds,
+        )
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout_seconds),
+            limits=limits,
+            http2=http2,
+        )
 
     async def charge(self, payload: dict[str, Any]) -> GatewayResponse:
+        if self._client is None:
+            await self.open()
+
+        wait = await self._wait_for_rate_limit()
+        if wait:
+            await metrics.inc("gateway_rate_limited_total")
+            # Токен не выдан локально — шлюз не вызывался, попытка не тратится.
+            return GatewayResponse(success=False, error="rate_limited", retry_after=wait, attempted=False)
+
+        # При разомкнутой цепи отказываем сразу, не вставая в очередь за местом в лимите.
+        # retry_in() ничего не тратит; пробу half-open берёт allow() уже после получения места.
+        if self.breaker.retry_in() > 0:
+            return await self._short_circuit()
+
+        if not await self.limit.acquire(self.timeout_seconds):
+            await metrics.inc("gateway_concurrency_limited_total")
+            # Место освободится не позже, чем закончится один из текущих вызовов.
+            return GatewayResponse(
+                success=False,
+                error="concurrency_limited",
+                retry_after=self.timeout_seconds,
+                attempted=False,
+            )
+        try:
+            if not self.breaker.allow():
+                # Цепь разомкнулась, пока ждали место: слот освобождает finally.
+                return await self._short_circuit()
+            return await self._call(payload)
+        finally:
+            self.limit.release()
+
+    async def _short_circuit(self) -> GatewayResponse:
+        await metrics.inc("gateway_short_circuited_total")
+        return GatewayResponse(
+            success=False,
+            error="circuit_open",
+            retry_after=self.breaker.retry_in(),
+            attempted=False,
+        )
+
+    async def _wait_for_rate_limit(self) -> float:
+        # Короткое ожидание токена дешевле ретрая; дольше таймаута вызова не ждём.
+        waited = 0.0
+        wait = self.rate_limiter.acquire()
+        while wait and waited + wait <= self.timeout_seconds:
+            await asyncio.sleep(wait)
+            waited += wait
+            wait = self.rate_limiter.acquire()
+        return wait
+
+    async def _call(self, payload: dict[str, Any]) -> GatewayResponse:
         url = f"{self.base_url}/pay"
-        timeout = httpx.Timeout(self.timeout_seconds)
+        started = time.perf_counter()
+        result: GatewayResponse | None = None
+        try:
+            result = await self._post(url, payload)
+            return result
+        finally:
+            # Неуспехом для цепи и лимита считаются только сбои шлюза, а не отказ по существу (4xx)
+            # и не 429: превышение квоты разруливает rate limiter.
+            failed = result is None or (not result.success and result.retryable and result.raw_status != 429)
+            self.breaker.record(failed)
+            self.limit.record(time.perf_counter() - started, failed)
+            await metrics.set("gateway_concurrency_limit", self.limit.limit)
+            await metrics.set("gateway_circuit_open", int(self.breaker.state != CircuitState.CLOSED))
 
+    async def _post(self, url: str, payload: dict[str, Any]) -> GatewayResponse:
         try:
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                response = await client.post(url, json=payload)
+            response = await self._client.post(url, json=payload)
         except httpx.TimeoutException:
             return GatewayResponse(success=False, error="timeout")
         except httpx.HTTPError as exc:
             return GatewayResponse(success=False, error=str(exc))
 
+        retry_after = self.rate_limiter.observe(response.status_code, response.headers)
         if response.status_code >= 200 and response.status_code < 300:
             return GatewayResponse(success=True, raw_status=response.status_code)
 
@@ -42,4 +158,10 @@ class PaymentGatewayClient:
             error=f"gateway_error_{response.status_code}",
             raw_status=response.status_code,
             retryable=retryable,
+            retry_after=retry_after,
         )
+
+
+# Один клиент (и один пул соединений) на процесс: API, PaymentWorker и Celery-воркер
+# открывают и закрывают его в своём жизненном цикле.
+gateway_client = PaymentGatewayClient()
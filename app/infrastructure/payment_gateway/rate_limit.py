@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections.abc import Callable, Iterator, Mapping
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+from app.core.settings import settings
+from app.core.shared_state import SharedState
+
+logger = logging.getLogger("payment_gateway")
+
+def parse_retry_after(value: str | None, now: float) -> float | None:
+    """Retry-After в секундах: число секунд или HTTP-дата."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(retry_at.timestamp() - now, 0.0)
+
+
+def _reset_seconds(reset: float, now: float) -> float:
+    # X-RateLimit-Reset бывает и числом секунд, и unix-временем сброса.
+    return max(reset - now, 0.0) if reset > 1_000_000_000 else reset
+
+
+def _header(headers: Mapping[str, str], *names: str) -> str | None:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class GatewayRateLimiter:
+    """Token bucket для вызовов шлюза, при заданном path — общий для всех процессов хоста.
+
+    Если задан path, состояние лежит в файле в shared memory и меняется под fcntl.flock, поэтому
+    N воркеров делят одну квоту шлюза, а не считают её каждый своей; без path bucket свой у процесса.
+    rate_per_second=0 — без собственного лимита, но 429 с Retry-After и исчерпанный
+    X-RateLimit-Remaining всё равно останавливают вызовы до указанного срока.
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float | None = None,
+        burst: int | None = None,
+        path: str | None = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.rate_per_second = rate_per_second if rate_per_second is not None else settings.gateway_rate_limit_per_second
+        self.burst = burst if burst is not None else settings.gateway_rate_limit_burst
+        self.path = path if path is not None else settings.gateway_rate_limit_state_path
+        self._clock = clock
+        # tokens, rate (токенов в секунду), updated_at, blocked_until — время по time.time(), общее для процессов.
+        self._shared = SharedState(self.path, fields=4, name="gateway rate limit")
+
+    def close(self) -> None:
+        self._shared.close()
+
+    def acquire(self) -> float:
+        """Берёт токен; возвращает 0 или сколько секунд ждать до следующей попытки."""
+        with self._state() as state:
+            now = self._clock()
+            if now < state.blocked_until:
+                return state.blocked_until - now
+            if self.rate_per_second <= 0:
+                return 0.0
+            state.refill(now, self.burst, self.rate_per_second)
+            if state.tokens >= 1:
+                state.tokens -= 1
+                return 0.0
+            return (1 - state.tokens) / state.rate
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> float | None:
+        """Подстраивает bucket под ответ шлюза; возвращает Retry-After в секундах, если он был."""
+        now = self._clock()
+        retry_after = None
+        if status_code in (429, 503):
+            retry_after = parse_retry_after(_header(headers, "retry-after"), now)
+        remaining = _header(headers, "ratelimit-remaining", "x-ratelimit-remaining")
+        reset = _header(headers, "ratelimit-reset", "x-ratelimit-reset")
+        if retry_after is None and status_code != 429 and remaining is None:
+            return None
+
+        with self._state() as state:
+            state.refill(now, self.burst, self.rate_per_second)
+            if status_code == 429:
+                # Превысили квоту: сбрасываем накопленное и замедляемся вдвое.
+                state.tokens = 0.0
+                if self.rate_per_second > 0:
+                    state.rate = max(state.rate / 2, self.rate_per_second / 100)
+                if retry_after is None:
+                    retry_after = 1 / state.rate if state.rate > 0 else 1.0
+            if retry_after is not None:
+                state.blocked_until = max(state.blocked_until, now + retry_after)
+                logger.warning("gateway rate limited: retry_after=%.2f", retry_after)
+            elif remaining is not None and reset is not None:
+                try:
+                    state.adjust(float(remaining), _reset_seconds(float(reset), now), now, self.rate_per_second)
+                except ValueError:
+                    logger.warning("gateway rate limit headers ignored: remaining=%s reset=%s", remaining, reset)
+        return retry_after
+
+    @contextmanager
+    def _state(self) -> Iterator[_BucketState]:
+        with self._shared.locked() as values:
+            state = _BucketState(*values)
+            if state.updated_at == 0:
+                # Файл только что создан — первый процесс инициализирует полный bucket.
+                state = _BucketState(float(self.burst), self.rate_per_second, self._clock(), 0.0)
+            yield state
+            values[:] = state.tokens, state.rate, state.updated_at, state.blocked_until
+
+
+@dataclass
+class _BucketState:
+    tokens: float
+    rate: float
+    updated_at: float
+    blocked_until: float
+
+    def refill(self, now: float, burst: int, rate_per_second: float) -> None:
+        elapsed = max(now - self.updated_at, 0.0)
+        self.tokens = min(self.tokens + elapsed * self.rate, float(burst))
+        # После замедления темп возвращается к настроенному линейно, за ~10 секунд.
+        self.rate = min(self.rate + elapsed * rate_per_second / 10, rate_per_second)
+        self.updated_at = now
+
+    def adjust(self, remaining: float, reset: float, now: float, rate_per_second: float) -> None:
+        if remaining <= 0:
+            self.tokens = 0.0
+            self.blocked_until = max(self.blocked_until, now + reset)
+        elif rate_per_second > 0 and reset > 0:
+            # Темп, при котором остаток квоты растянется до её сброса, но не выше настроенного.
+            self.rate = min(max(remaining / reset, rate_per_second / 100), rate_per_second)
+            self.tokens = min(self.tokens, remaining)
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import asyncio
+import enum
+import logging
+import time
+from collections import deque
+from collections.abc import Callable
+
+from app.core.settings import settings
+
+logger = logging.getLogger("payment_gateway")
+
+
+class CircuitState(str, enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Размыкает вызовы шлюза, когда доля ошибок и таймаутов за окно превышает порог.
+
+    Через open_seconds пропускает half_open_calls пробных вызовов: если все успешны —
+    цепь замыкается, первая же ошибка снова её размыкает.
+    """
+
+    def __init__(
+        self,
+        window_seconds: float | None = None,
+        min_calls: int | None = None,
+        failure_rate: float | None = None,
+        open_seconds: float | None = None,
+        half_open_calls: int | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window_seconds = window_seconds if window_seconds is not None else settings.gateway_breaker_window_seconds
+        self.min_calls = min_calls if min_calls is not None else settings.gateway_breaker_min_calls
+        self.failure_rate = failure_rate if failure_rate is not None else settings.gateway_breaker_failure_rate
+        self.open_seconds = open_seconds if open_seconds is not None else settings.gateway_breaker_open_seconds
+        self.half_open_calls = (
+            half_open_calls if half_open_calls is not None else settings.gateway_breaker_half_open_calls
+        )
+        self._clock = clock
+        self.state = CircuitState.CLOSED
+        # (время, ошибка) по вызовам за последние window_seconds.
+        self._calls: deque[tuple[float, bool]] = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+
+    def allow(self) -> bool:
+        if self.state == CircuitState.OPEN:
+            if self._clock() - self._opened_at < self.open_seconds:
+                return False
+            self._transition(CircuitState.HALF_OPEN)
+        if self.state == CircuitState.HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                return False
+            self._probes += 1
+        return True
+
+    def retry_in(self) -> float:
+        """Через сколько секунд цепь снова пропустит вызов; 0 — пропускает сейчас."""
+        if self.state == CircuitState.OPEN:
+            return max(self.open_seconds - (self._clock() - self._opened_at), 0.0)
+        if self.state == CircuitState.HALF_OPEN and self._probes >= self.half_open_calls:
+            # Пробы уже идут; если они провалятся, цепь разомкнётся ещё на open_seconds.
+            return self.open_seconds
+        return 0.0
+
+    def record(self, failed: bool) -> None:
+        if self.state == CircuitState.HALF_OPEN:
+            if failed:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition(CircuitState.CLOSED)
+            return
+        if self.state == CircuitState.OPEN:
+            # Ответ на вызов, начатый до размыкания.
+            return
+
+        now = self._clock()
+        self._calls.append((now, failed))
+        self._failures += failed
+        self._evict(now)
+        if len(self._calls) >= self.min_calls and self._failures / len(self._calls) >= self.failure_rate:
+            self._open()
+
+    def _evict(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            _, failed = self._calls.popleft()
+            self._failures -= failed
+
+    def _open(self) -> None:
+        self._opened_at = self._clock()
+        self._transition(CircuitState.OPEN)
+
+    def _transition(self, state: CircuitState) -> None:
+        logger.warning("gateway circuit %s: previous=%s", state.value, self.state.value)
+        self.state = state
+        self._calls.clear()
+        self._failures = 0
+        self._probes = 0
+        self._probe_successes = 0
+
+
+class AdaptiveConcurrencyLimit:
+    """Лимит одновременных вызовов шлюза по AIMD.
+
+    Пока вызовы успешны и быстрее latency_target_seconds, лимит растёт на 1 за "окно" из limit
+    вызовов; ошибка, таймаут или медленный ответ умножают его на backoff_ratio — не чаще раза
+    за время одного вызова: сбои вызовов, начатых до прошлого снижения, его не повторяют.
+    Вызовы сверх лимита ждут свободного места не дольше wait_timeout.
+    """
+
+    def __init__(
+        self,
+        initial: int | None = None,
+        min_limit: int | None = None,
+        max_limit: int | None = None,
+        latency_target_seconds: float | None = None,
+        backoff_ratio: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_limit = min_limit if min_limit is not None else settings.gateway_limit_min
+        self.max_limit = max_limit if max_limit is not None else settings.gateway_limit_max
+        self.latency_target_seconds = (
+            latency_target_seconds if latency_target_seconds is not None else settings.gateway_limit_latency_target_seconds
+        )
+        self.backoff_ratio = backoff_ratio if backoff_ratio is not None else settings.gateway_limit_backoff_ratio
+        self._limit = float(initial if initial is not None else settings.gateway_limit_initial)
+        self._clock = clock
+        self._decreased_at = float("-inf")
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return max(int(self._limit), self.min_limit)
+
+    async def acquire(self, wait_timeout: float) -> bool:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return True
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=wait_timeout)
+            return True
+        except BaseException as exc:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done():
+                # Место выдали одновременно с таймаутом или отменой — отдаём его следующему.
+                self.release()
+            if isinstance(exc, asyncio.TimeoutError):
+                return False
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def record(self, latency_seconds: float, failed: bool) -> None:
+        if failed or latency_seconds > self.latency_target_seconds:
+            now = self._clock()
+            # Пачка одновременных сбоев — один эпизод перегрузки, а не N: иначе лимит падает до минимума.
+            if now - latency_seconds >= self._decreased_at:
+                self._limit = max(self._limit * self.backoff_ratio, self.min_limit)
+                self._decreased_at = now
+        elif self.in_flight * 2 >= self.limit:
+            # Растём, только когда лимит действительно используется.
+            self._limit = min(self._limit + 1 / self._limit, self.max_limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
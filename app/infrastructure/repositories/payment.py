@@ -1,6 +1,9 @@
+from collections.abc import AsyncIterator
+
 from app.infrastructure.db.models.payment import PaymentModel, PaymentStatus
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import insert, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 class PaymentRepository:
     def __init__(self, session: AsyncSession):
@@ -38,3 +41,68 @@ class PaymentRepository:
             )
         )
         return result.scalar_one_or_none()
+
+    async def create_many(self, rows: list[dict]) -> list[int | None]:
+        """Многострочный INSERT ... RETURNING id в порядке rows; None — idempotency_key уже занят."""
+        keyed = [row for row in rows if row["idempotency_key"]]
+        plain = [row for row in rows if not row["idempotency_key"]]
+
+        plain_ids: list[int] = []
+        if plain:
+            result = await self.session.execute(
+                insert(PaymentModel).returning(PaymentModel.id, sort_by_parameter_order=True),
+                plain,
+            )
+            plain_ids = list(result.scalars().all())
+
+        # Строки с ключом не валят пачку на конфликте: ключ мог занять другой процесс.
+        keyed_ids: dict[tuple[int, str], int] = {}
+        if keyed:
+            result = await self.session.execute(
+                pg_insert(PaymentModel)
+                .on_conflict_do_nothing(constraint="uq_payments_user_idempotency_key")
+                .returning(PaymentModel.user_id, PaymentModel.idempotency_key, PaymentModel.id),
+                keyed,
+            )
+            keyed_ids = {(user_id, key): payment_id for user_id, key, payment_id in result.all()}
+
+        plain_iter = iter(plain_ids)
+        return [
+            keyed_ids.get((row["user_id"], row["idempotency_key"])) if row["idempotency_key"] else next(plain_iter)
+            for row in rows
+        ]
+
+    async def fail_many(self, payment_ids: list[int], last_error: str) -> None:
+        await self.session.execute(
+            update(PaymentModel)
+            .where(PaymentModel.id.in_(payment_ids))
+            .values(status=PaymentStatus.FAILED, last_error=last_error)
+        )
+
+    async def iter_recent_idempotency_keys(self, limit: int) -> AsyncIterator[tuple[int, str]]:
+        """Последние limit пар (user_id, idempotency_key), новые первыми; читается серверным курсором."""
+        result = await self.session.stream(
+            select(PaymentModel.user_id, PaymentModel.idempotency_key)
+            .where(PaymentModel.idempotency_key.is_not(None))
+            .order_by(PaymentModel.id.desc())
+            .limit(limit)
+            .execution_options(yield_per=10000)
+        )
+        async for user_id, key in result:
+            yield user_id, key
+
+    async def get_by_idempotency_keys(
+        self, keys: list[tuple[int, str]]
+    ) -> dict[tuple[int, str], tuple[int, PaymentStatus]]:
+        """Одним запросом ищет платежи по парам (user_id, idempotency_key)."""
+        if not keys:
+            return {}
+        result = await self.session.execute(
+            select(
+                PaymentModel.user_id,
+                PaymentModel.idempotency_key,
+                PaymentModel.id,
+                PaymentModel.status,
+            ).where(tuple_(PaymentModel.user_id, PaymentModel.idempotency_key).in_(keys))
+        )
+        return {(user_id, key): (payment_id, status) for user_id, key, payment_id, status in result.all()}
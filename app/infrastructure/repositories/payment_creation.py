@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+
+from sqlalchemy import case, literal, null, select, true
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.settings import settings
+from app.domain.exceptions import PaymentIdempotencyConflictError
+from app.infrastructure.db.models.payment import PaymentModel, PaymentStatus
+from app.infrastructure.db.models.payment_outbox import PaymentOutboxModel
+from app.infrastructure.db.models.payment_task import PaymentTaskModel, PaymentTaskStatus
+from app.infrastructure.db.models.transaction import TransactionModel, TransactionStatus, TransactionType
+from app.infrastructure.db.models.user import UserModel
+
+
+@dataclass
+class CreatedPayment:
+    payment_id: int
+    status: PaymentStatus
+    # False — платёж с этим idempotency_key уже был, payment_id и status — его.
+    created: bool
+
+
+class PaymentCreationRepository:
+    """Создание платежа одним запросом: CTE вставляет платёж, его транзакцию и задачу в очередь."""
+
+    def __init__(self, session: AsyncSession, queue_backend: str | None = None):
+        self.session = session
+        # celery — запись outbox для relay; db — сразу строка payment_tasks для PaymentWorker.
+        self.queue_backend = queue_backend or settings.payment_queue_backend
+
+    async def create(
+        self,
+        user_id: int,
+        amount: float,
+        commission: float,
+        type: TransactionType,
+        idempotency_key: str | None = None,
+    ) -> CreatedPayment | None:
+        """Возвращает None, если пользователя нет.
+
+        Списание, на которое не хватает баланса, создаётся сразу в FAILED с транзакцией FAILED
+        и без задачи — как и раньше, баланс не блокируется, его проверит финализация.
+        """
+        result = await self.session.execute(self._statement(user_id, amount, commission, type, idempotency_key))
+        row = result.one_or_none()
+        if row is None:
+            return None
+        _, payment_id, status = row
+        if payment_id is not None:
+            return CreatedPayment(payment_id, status, created=True)
+
+        # Ключ уже занят: платёж создан раньше или параллельным запросом, INSERT дождался его COMMIT.
+        result = await self.session.execute(
+            select(PaymentModel.id, PaymentModel.status).where(
+                PaymentModel.user_id == user_id,
+                PaymentModel.idempotency_key == idempotency_key,
+            )
+        )
+        row = result.one_or_none()
+        if row is None:
+            # Ключ занят строкой, которой не видно и после конфликта (её удалили или она
+            # в чужой незавершённой транзакции): клиенту — 409, повтор запроса разрешит спор.
+            raise PaymentIdempotencyConflictError(
+                f"Payment with this Idempotency-Key is being processed. user_id={user_id}"
+            )
+        payment_id, status = row
+        return CreatedPayment(payment_id, status, created=False)
+
+    def _statement(
+        self,
+        user_id: int,
+        amount: float,
+        commission: float,
+        type: TransactionType,
+        idempotency_key: str | None,
+    ):
+        amount_param = literal(amount, PaymentModel.amount.type)
+        commission_param = literal(commission, PaymentModel.commission.type)
+
+        payment_user = (
+            select(UserModel.id, UserModel.balance)
+            .where(UserModel.id == user_id)
+            .cte("payment_user")
+        )
+        if type == TransactionType.WITHDRAW:
+            insufficient = payment_user.c.balance < round(amount + commission, 2)
+        else:
+            insufficient = literal(False)
+
+        created_payment = (
+            insert(PaymentModel)
+            .from_select(
+                ["user_id", "amount", "commission", "status", "idempotency_key", "last_error", "attempts"],
+                select(
+                    payment_user.c.id,
+                    amount_param,
+                    commission_param,
+                    case(
+                        (insufficient, literal(PaymentStatus.FAILED, PaymentModel.status.type)),
+                        else_=literal(PaymentStatus.NEW, PaymentModel.status.type),
+                    ),
+                    literal(idempotency_key, PaymentModel.idempotency_key.type),
+                    case((insufficient, literal("insufficient_funds", PaymentModel.last_error.type)), else_=null()),
+                    literal(0),
+                ),
+            )
+            .on_conflict_do_nothing(constraint="uq_payments_user_idempotency_key")
+            .returning(PaymentModel.id, PaymentModel.status)
+            .cte("created_payment")
+        )
+        failed = created_payment.c.status == PaymentStatus.FAILED
+
+        created_transaction = (
+            insert(TransactionModel)
+            .from_select(
+                ["user_id", "payment_id", "amount", "commission", "type", "status"],
+                select(
+                    literal(user_id, TransactionModel.user_id.type),
+                    created_payment.c.id,
+                    amount_param,
+                    commission_param,
+                    literal(type, TransactionModel.type.type),
+                    case(
+                        (failed, literal(TransactionStatus.FAILED, TransactionModel.status.type)),
+                        else_=literal(TransactionStatus.PROCESSING, TransactionModel.status.type),
+                    ),
+                ),
+            )
+            .cte("created_transaction")
+        )
+
+        if self.queue_backend == "db":
+            queued = insert(PaymentTaskModel).from_select(
+                ["payment_id", "status", "attempts", "lease_version"],
+                select(
+                    created_payment.c.id,
+                    literal(PaymentTaskStatus.NEW, PaymentTaskModel.status.type),
+                    literal(0),
+                    literal(0),
+                ).where(~failed),
+            )
+        else:
+            queued = insert(PaymentOutboxModel).from_select(
+                ["payment_id"],
+                select(created_payment.c.id).where(~failed),
+            )
+
+        # Строка есть, только если пользователь найден; id платежа NULL — конфликт по ключу.
+        # Вставки транзакции и задачи не участвуют в SELECT, поэтому добавлены явно.
+        return (
+            select(payment_user.c.id, created_payment.c.id, created_payment.c.status)
+            .select_from(payment_user.outerjoin(created_payment, true()))
+            .add_cte(created_transaction, queued.cte("queued"))
+        )
@@ -0,0 +1,185 @@
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import DateTime, Integer, cast, column, func, select, update, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.infrastructure.db.models.payment import PaymentModel, PaymentStatus
+from app.infrastructure.db.models.payment_dlq import PaymentDLQModel
+from app.infrastructure.db.models.payment_task import PaymentTaskModel, PaymentTaskStatus
+from app.infrastructure.db.models.transaction import TransactionModel, TransactionStatus, TransactionType
+from app.infrastructure.db.models.user import UserModel
+
+
+@dataclass
+class LockedTaskRow:
+    task_id: int
+    task_status: PaymentTaskStatus
+    task_attempts: int
+    lease_version: int
+    payment_id: int
+    payment_status: PaymentStatus
+    payment_attempts: int
+    user_id: int
+    amount: Decimal
+    commission: Decimal
+    transaction_type: TransactionType | None
+
+
+@dataclass
+class PaymentChange:
+    payment_id: int
+    status: PaymentStatus
+    last_error: str | None
+    next_retry_at: datetime | None
+    attempts: int
+
+
+@dataclass
+class TaskChange:
+    task_id: int
+    status: PaymentTaskStatus
+    last_error: str | None
+    next_retry_at: datetime | None
+    # None — счётчик попыток не меняется.
+    attempts: int | None = None
+
+
+class PaymentFinalizationRepository:
+    """Set-based запросы финализации: одна пачка исходов — несколько UPDATE ... FROM (VALUES ...)."""
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def lock_tasks(self, task_ids: list[int]) -> dict[int, LockedTaskRow]:
+        stmt = (
+            select(
+                PaymentTaskModel.id,
+                PaymentTaskModel.status,
+                PaymentTaskModel.attempts,
+                PaymentTaskModel.lease_version,
+                PaymentModel.id,
+                PaymentModel.status,
+                PaymentModel.attempts,
+                PaymentModel.user_id,
+                PaymentModel.amount,
+                PaymentModel.commission,
+                TransactionModel.type,
+            )
+            .join(PaymentModel, PaymentModel.id == PaymentTaskModel.payment_id)
+            .outerjoin(TransactionModel, TransactionModel.payment_id == PaymentModel.id)
+            .where(PaymentTaskModel.id.in_(task_ids))
+            .order_by(PaymentTaskModel.id)
+            .with_for_update(of=[PaymentTaskModel, PaymentModel])
+        )
+        result = await self.session.execute(stmt)
+        rows = [LockedTaskRow(*row) for row in result.all()]
+        return {row.task_id: row for row in rows}
+
+    async def lock_balances(self, user_ids: set[int]) -> dict[int, Decimal]:
+        if not user_ids:
+            return {}
+        # Порядок по id — чтобы параллельные финализаторы не ловили deadlock на users.
+        result = await self.session.execute(
+            select(UserModel.id, UserModel.balance)
+            .where(UserModel.id.in_(user_ids))
+            .order_by(UserModel.id)
+            .with_for_update()
+        )
+        return {user_id: balance for user_id, balance in result.all()}
+
+    async def update_balances(self, balances: dict[int, Decimal]) -> None:
+        if not balances:
+            return
+        users = UserModel.__table__
+        data = values(
+            column("id", users.c.id.type),
+            column("balance", users.c.balance.type),
+            name="v",
+        ).data(list(balances.items()))
+        await self.session.execute(
+            update(UserModel).where(UserModel.id == data.c.id).values(balance=data.c.balance)
+        )
+
+    async def update_payments(self, changes: list[PaymentChange]) -> None:
+        if not changes:
+            return
+        payments = PaymentModel.__table__
+        data = values(
+            column("id", Integer),
+            column("status", payments.c.status.type),
+            column("last_error", payments.c.last_error.type),
+            column("next_retry_at", payments.c.next_retry_at.type),
+            column("attempts", Integer),
+            name="v",
+        ).data([
+            (change.payment_id, change.status, change.last_error, change.next_retry_at, change.attempts)
+            for change in changes
+        ])
+        # NULL в VALUES без явного cast Postgres считает text.
+        await self.session.execute(
+            update(PaymentModel)
+            .where(PaymentModel.id == data.c.id)
+            .values(
+                status=data.c.status,
+                last_error=data.c.last_error,
+                next_retry_at=cast(data.c.next_retry_at, DateTime(timezone=True)),
+                attempts=data.c.attempts,
+                locked_at=None,
+            )
+        )
+
+    async def update_transactions(self, statuses: dict[int, TransactionStatus]) -> None:
+        if not statuses:
+            return
+        transactions = TransactionModel.__table__
+        data = values(
+            column("payment_id", Integer),
+            column("status", transactions.c.status.type),
+            name="v",
+        ).data(list(statuses.items()))
+        await self.session.execute(
+            update(TransactionModel)
+            .where(TransactionModel.payment_id == data.c.payment_id)
+            .values(status=data.c.status)
+        )
+
+    async def update_tasks(self, changes: list[TaskChange]) -> None:
+        if not changes:
+            return
+        tasks = PaymentTaskModel.__table__
+        data = values(
+            column("id", Integer),
+            column("status", tasks.c.status.type),
+            column("last_error", tasks.c.last_error.type),
+            column("next_retry_at", tasks.c.next_retry_at.type),
+            column("attempts", Integer),
+            name="v",
+        ).data([
+            (change.task_id, change.status, change.last_error, change.next_retry_at, change.attempts)
+            for change in changes
+        ])
+        await self.session.execute(
+            update(PaymentTaskModel)
+            .where(PaymentTaskModel.id == data.c.id)
+            .values(
+                status=data.c.status,
+                last_error=data.c.last_error,
+                next_retry_at=cast(data.c.next_retry_at, DateTime(timezone=True)),
+                attempts=func.coalesce(cast(data.c.attempts, Integer), PaymentTaskModel.attempts),
+                locked_at=None,
+            )
+        )
+
+    async def insert_dlq(self, records: list[dict[str, object]]) -> list[int]:
+        if not records:
+            return []
+        result = await self.session.execute(
+            insert(PaymentDLQModel)
+            .values(records)
+            .on_conflict_do_nothing(index_elements=[PaymentDLQModel.payment_id])
+            .returning(PaymentDLQModel.payment_id)
+        )
+        return list(result.scalars().all())
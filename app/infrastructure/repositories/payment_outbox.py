@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.infrastructure.db.models.payment import PaymentModel
+from app.infrastructure.db.models.payment_outbox import PaymentOutboxModel
+
+# Канал LISTEN/NOTIFY, в который пишет триггер payment_outbox_notify (миграция 0007).
+PAYMENT_OUTBOX_CHANNEL = "payment_outbox"
+
+
+@dataclass
+class OutboxRecord:
+    id: int
+    payment_id: int
+    user_id: int
+    created_at: datetime
+
+
+class PaymentOutboxRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def add(self, payment_id: int) -> PaymentOutboxModel:
+        record = PaymentOutboxModel(payment_id=payment_id)
+        self.session.add(record)
+        return record
+
+    async def add_many(self, payment_ids: list[int]) -> None:
+        if payment_ids:
+            await self.session.execute(
+                insert(PaymentOutboxModel),
+                [{"payment_id": payment_id} for payment_id in payment_ids],
+            )
+
+    async def claim_batch(self, limit: int) -> list[OutboxRecord]:
+        """Блокирует до limit неотправленных записей; параллельные relay берут разные строки."""
+        # user_id нужен для выбора очереди-партиции; сами платежи не блокируем.
+        result = await self.session.execute(
+            select(
+                PaymentOutboxModel.id,
+                PaymentOutboxModel.payment_id,
+                PaymentModel.user_id,
+                PaymentOutboxModel.created_at,
+            )
+            .join(PaymentModel, PaymentModel.id == PaymentOutboxModel.payment_id)
+            .where(PaymentOutboxModel.sent_at.is_(None))
+            .order_by(PaymentOutboxModel.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True, of=PaymentOutboxModel)
+        )
+        return [OutboxRecord(*row) for row in result.all()]
+
+    async def mark_sent(self, ids: list[int]) -> None:
+        await self.session.execute(
+            update(PaymentOutboxModel)
+            .where(PaymentOutboxModel.id.in_(ids))
+            .values(sent_at=func.now())
+        )
+
+    async def purge_sent(self, sent_before: datetime, limit: int) -> int:
+        doomed = (
+            select(PaymentOutboxModel.id)
+            .where(PaymentOutboxModel.sent_at < sent_before)
+            .order_by(PaymentOutboxModel.sent_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("doomed")
+        )
+        result = await self.session.execute(
+            delete(PaymentOutboxModel).where(PaymentOutboxModel.id == doomed.c.id).returning(PaymentOutboxModel.id)
+        )
+        return len(result.all())
@@ -0,0 +1,85 @@
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.infrastructure.db.models.payment_retry import PaymentRetryModel
+
+
+@dataclass
+class DueRetry:
+    payment_id: int
+    retries: int
+    queue: str
+    due_at: datetime
+
+
+def due_bucket(due_at: datetime, bucket_seconds: float) -> datetime:
+    epoch = due_at.timestamp()
+    return datetime.fromtimestamp(epoch - epoch % bucket_seconds, tz=timezone.utc)
+
+
+class PaymentRetryRepository:
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def schedule_many(self, retries: list[DueRetry], bucket_seconds: float) -> None:
+        stmt = pg_insert(PaymentRetryModel).values(
+            [
+                {
+                    "payment_id": retry.payment_id,
+                    "retries": retry.retries,
+                    "queue": retry.queue,
+                    "due_at": retry.due_at,
+                    "due_bucket": due_bucket(retry.due_at, bucket_seconds),
+                }
+                for retry in retries
+            ]
+        )
+        # У платежа не больше одного запланированного ретрая: дубль (например, повторная
+        # доставка сообщения) оставляет более ранний срок и больший счётчик.
+        excluded = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PaymentRetryModel.payment_id],
+            set_={
+                "retries": func.greatest(PaymentRetryModel.retries, excluded.retries),
+                "queue": excluded.queue,
+                "due_at": func.least(PaymentRetryModel.due_at, excluded.due_at),
+                "due_bucket": func.least(PaymentRetryModel.due_bucket, excluded.due_bucket),
+            },
+        )
+        await self.session.execute(stmt)
+
+    async def claim_due(self, now: datetime, limit: int, bucket_seconds: float) -> list[DueRetry]:
+        """Удаляет и возвращает до limit наступивших ретраев, самые ранние корзины — первыми.
+
+        Вызывать в транзакции: при ошибке публикации откат вернёт строки в расписание.
+        """
+        due = (
+            select(PaymentRetryModel.id)
+            .where(
+                PaymentRetryModel.due_bucket <= due_bucket(now, bucket_seconds),
+                PaymentRetryModel.due_at <= now,
+            )
+            .order_by(PaymentRetryModel.due_bucket, PaymentRetryModel.due_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("due")
+        )
+        result = await self.session.execute(
+            delete(PaymentRetryModel)
+            .where(PaymentRetryModel.id == due.c.id)
+            .returning(
+                PaymentRetryModel.payment_id,
+                PaymentRetryModel.retries,
+                PaymentRetryModel.queue,
+                PaymentRetryModel.due_at,
+            )
+        )
+        return sorted((DueRetry(*row) for row in result.all()), key=lambda retry: retry.due_at)
+
+    async def next_due_at(self) -> datetime | None:
+        result = await self.session.execute(select(func.min(PaymentRetryModel.due_at)))
+        return result.scalar_one_or_none()
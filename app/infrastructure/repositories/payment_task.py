@@ -1,9 +1,49 @@
+from dataclasses import dataclass
 from datetime import datetime
 
-from sqlalchemy import and_, or_, select
+from sqlalchemy import Integer, column, delete, func, insert, or_, select, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.infrastructure.db.models.payment import PaymentModel, PaymentStatus
 from app.infrastructure.db.models.payment_task import PaymentTaskModel, PaymentTaskStatus
+from app.infrastructure.db.models.payment_task_archive import PaymentTaskArchiveModel
+from app.infrastructure.db.models.transaction import TransactionModel, TransactionType
+
+# Канал LISTEN/NOTIFY, в который пишет триггер payment_tasks_notify_ready (миграция 0003).
+PAYMENT_TASKS_CHANNEL = "payment_tasks"
+
+
+@dataclass
+class ReservedPaymentTask:
+    task_id: int
+    payment_id: int
+    attempts: int
+    lease_version: int
+    # Состояние платежа до резервирования; payment_status/payment_type равны None,
+    # если платежа или транзакции нет.
+    payment_status: PaymentStatus | None
+    payment_last_error: str | None
+    payment_retry_budget_credited: bool | None
+    user_id: int | None
+    amount: float | None
+    commission: float | None
+    payment_type: TransactionType | None
+
+    @property
+    def is_finalized(self) -> bool:
+        return self.payment_status in (PaymentStatus.SUCCESS, PaymentStatus.FAILED)
+
+    def gateway_payload(self) -> dict[str, object] | None:
+        if self.payment_status is None or self.payment_type is None:
+            return None
+        return {
+            "payment_id": self.payment_id,
+            "user_id": self.user_id,
+            "amount": float(self.amount),
+            "commission": float(self.commission),
+            "type": self.payment_type.value,
+        }
 
 
 class PaymentTaskRepository:
@@ -15,34 +55,250 @@ class PaymentTaskRepository:
         self.session.add(task)
         return task
 
+    async def create_many(self, payment_ids: list[int]) -> None:
+        # Повторная доставка из outbox не должна падать на unique(payment_id).
+        stmt = pg_insert(PaymentTaskModel).values(
+            [
+                {"payment_id": payment_id, "status": PaymentTaskStatus.NEW, "attempts": 0}
+                for payment_id in payment_ids
+            ]
+        )
+        await self.session.execute(stmt.on_conflict_do_nothing(index_elements=[PaymentTaskModel.payment_id]))
+
     async def get_by_payment_id(self, payment_id: int) -> PaymentTaskModel | None:
         result = await self.session.execute(
             select(PaymentTaskModel).where(PaymentTaskModel.payment_id == payment_id)
         )
         return result.scalar_one_or_none()
 
-    async def reserve_next(self, now: datetime, stuck_before: datetime) -> PaymentTaskModel | None:
-        stmt = (
-            select(PaymentTaskModel)
-            .where(
-                or_(
-                    PaymentTaskModel.status == PaymentTaskStatus.NEW,
-                    and_(
-                        PaymentTaskModel.status == PaymentTaskStatus.PROCESSING,
-                        PaymentTaskModel.locked_at.is_not(None),
-                        PaymentTaskModel.locked_at < stuck_before,
-                    ),
-                )
-            )
+    async def reserve_batch(self, now: datetime, limit: int) -> list[ReservedPaymentTask]:
+        """Резервирует до limit задач и сразу отдаёт данные для шлюза — одним запросом."""
+        # Берём только готовые NEW (частичный индекс ix_payment_tasks_ready);
+        # зависшие PROCESSING возвращает в NEW отдельный PaymentTaskReaper.
+        ready = (
+            select(PaymentTaskModel.id)
             .where(
+                PaymentTaskModel.status == PaymentTaskStatus.NEW,
                 or_(
                     PaymentTaskModel.next_retry_at.is_(None),
                     PaymentTaskModel.next_retry_at <= now,
-                )
+                ),
             )
             .order_by(PaymentTaskModel.created_at)
-            .limit(1)
+            .limit(limit)
             .with_for_update(skip_locked=True)
+            .cte("ready")
+        )
+        reserved = (
+            update(PaymentTaskModel)
+            .where(PaymentTaskModel.id == ready.c.id)
+            .values(
+                status=PaymentTaskStatus.PROCESSING,
+                attempts=PaymentTaskModel.attempts + 1,
+                lease_version=PaymentTaskModel.lease_version + 1,
+                locked_at=now,
+                next_retry_at=None,
+            )
+            .returning(
+                PaymentTaskModel.id,
+                PaymentTaskModel.payment_id,
+                PaymentTaskModel.attempts,
+                PaymentTaskModel.lease_version,
+            )
+            .cte("reserved")
+        )
+        started = (
+            update(PaymentModel)
+            .where(
+                PaymentModel.id == reserved.c.payment_id,
+                PaymentModel.status.not_in([PaymentStatus.SUCCESS, PaymentStatus.FAILED]),
+            )
+            .values(
+                status=PaymentStatus.PROCESSING,
+                attempts=reserved.c.attempts,
+                retry_budget_credited=True,
+                locked_at=now,
+                next_retry_at=None,
+            )
+            .cte("started")
+        )
+        # Основной SELECT видит снимок до UPDATE в CTE, поэтому payments.status — статус до резервирования.
+        stmt = (
+            select(
+                reserved.c.id,
+                reserved.c.payment_id,
+                reserved.c.attempts,
+                reserved.c.lease_version,
+                PaymentModel.status,
+                PaymentModel.last_error,
+                PaymentModel.retry_budget_credited,
+                PaymentModel.user_id,
+                PaymentModel.amount,
+                PaymentModel.commission,
+                TransactionModel.type,
+            )
+            .select_from(reserved)
+            .outerjoin(PaymentModel, PaymentModel.id == reserved.c.payment_id)
+            .outerjoin(TransactionModel, TransactionModel.payment_id == reserved.c.payment_id)
+            .add_cte(started)
         )
         result = await self.session.execute(stmt)
+        return [ReservedPaymentTask(*row) for row in result.all()]
+
+    async def close_finalized(self, tasks: list[ReservedPaymentTask]) -> None:
+        """Закрывает задачи, чей платёж уже был финализирован до резервирования."""
+        done_ids = [task.task_id for task in tasks if task.payment_status == PaymentStatus.SUCCESS]
+        failed = [task for task in tasks if task.payment_status == PaymentStatus.FAILED]
+        if done_ids:
+            await self.session.execute(
+                update(PaymentTaskModel)
+                .where(PaymentTaskModel.id.in_(done_ids))
+                .values(status=PaymentTaskStatus.DONE, locked_at=None)
+            )
+        if failed:
+            # Ошибка у каждой задачи своя — одним UPDATE ... FROM (VALUES ...), как в финализации.
+            data = values(
+                column("id", Integer),
+                column("last_error", PaymentTaskModel.__table__.c.last_error.type),
+                name="v",
+            ).data([(task.task_id, task.payment_last_error) for task in failed])
+            await self.session.execute(
+                update(PaymentTaskModel)
+                .where(PaymentTaskModel.id == data.c.id)
+                .values(status=PaymentTaskStatus.FAILED, last_error=data.c.last_error, locked_at=None)
+            )
+
+    async def defer(self, tasks: list[ReservedPaymentTask], next_retry_at: datetime) -> None:
+        """Возвращает зарезервированные задачи в NEW без попытки: ретрай отложен бюджетом."""
+        task_ids = [task.task_id for task in tasks]
+        payment_ids = [task.payment_id for task in tasks]
+        await self.session.execute(
+            update(PaymentTaskModel)
+            .where(PaymentTaskModel.id.in_(task_ids))
+            .values(
+                status=PaymentTaskStatus.NEW,
+                attempts=PaymentTaskModel.attempts - 1,
+                next_retry_at=next_retry_at,
+                locked_at=None,
+            )
+        )
+        await self.session.execute(
+            update(PaymentModel)
+            .where(
+                PaymentModel.id.in_(payment_ids),
+                PaymentModel.status.not_in([PaymentStatus.SUCCESS, PaymentStatus.FAILED]),
+            )
+            .values(
+                status=PaymentStatus.NEW,
+                attempts=PaymentModel.attempts - 1,
+                next_retry_at=next_retry_at,
+                locked_at=None,
+            )
+        )
+
+    async def next_deadline(self) -> datetime | None:
+        """Ближайший момент, когда задача станет доступна без NOTIFY: ретрай по next_retry_at."""
+        # Зависшие задачи возвращает PaymentTaskReaper, его UPDATE сам шлёт NOTIFY.
+        result = await self.session.execute(
+            select(func.min(PaymentTaskModel.next_retry_at)).where(
+                PaymentTaskModel.status == PaymentTaskStatus.NEW,
+                PaymentTaskModel.next_retry_at.is_not(None),
+            )
+        )
         return result.scalar_one_or_none()
+
+    async def renew_leases(self, leases: dict[int, int], now: datetime) -> list[int]:
+        """Продлевает locked_at задачам, которыми воркер всё ещё владеет (id -> lease_version)."""
+        if not leases:
+            return []
+        data = values(
+            column("id", Integer),
+            column("lease_version", Integer),
+            name="v",
+        ).data(list(leases.items()))
+        # Строки, которые прямо сейчас финализируются, пропускаем (SKIP LOCKED), а порядок по id
+        # совпадает с финализатором — чтобы не ловить deadlock.
+        owned = (
+            select(PaymentTaskModel.id)
+            .join(data, data.c.id == PaymentTaskModel.id)
+            .where(
+                PaymentTaskModel.status == PaymentTaskStatus.PROCESSING,
+                PaymentTaskModel.lease_version == data.c.lease_version,
+            )
+            .order_by(PaymentTaskModel.id)
+            .with_for_update(of=PaymentTaskModel, skip_locked=True)
+            .cte("owned")
+        )
+        result = await self.session.execute(
+            update(PaymentTaskModel)
+            .where(PaymentTaskModel.id == owned.c.id)
+            .values(locked_at=now)
+            .returning(PaymentTaskModel.id)
+        )
+        return list(result.scalars().all())
+
+    async def reclaim_stuck(self, stuck_before: datetime, limit: int) -> list[int]:
+        """Возвращает в NEW до limit задач, зависших в PROCESSING; отдаёт их id."""
+        stuck = (
+            select(PaymentTaskModel.id)
+            .where(
+                PaymentTaskModel.status == PaymentTaskStatus.PROCESSING,
+                PaymentTaskModel.locked_at < stuck_before,
+            )
+            .order_by(PaymentTaskModel.locked_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("stuck")
+        )
+        reclaimed = (
+            update(PaymentTaskModel)
+            .where(PaymentTaskModel.id == stuck.c.id)
+            .values(
+                status=PaymentTaskStatus.NEW,
+                last_error="processing_timeout",
+                locked_at=None,
+                next_retry_at=None,
+            )
+            .returning(PaymentTaskModel.id, PaymentTaskModel.payment_id)
+            .cte("reclaimed")
+        )
+        payments = (
+            update(PaymentModel)
+            .where(
+                PaymentModel.id == reclaimed.c.payment_id,
+                PaymentModel.status == PaymentStatus.PROCESSING,
+            )
+            .values(status=PaymentStatus.NEW, last_error="processing_timeout", locked_at=None)
+            .cte("reclaimed_payments")
+        )
+        result = await self.session.execute(select(reclaimed.c.id).add_cte(payments))
+        return list(result.scalars().all())
+
+    async def archive_finished(self, finished_before: datetime, limit: int, keep_archive: bool = True) -> int:
+        """Переносит (или просто удаляет) до limit завершённых задач; возвращает число строк."""
+        doomed = (
+            select(PaymentTaskModel.id)
+            .where(
+                PaymentTaskModel.status.in_([PaymentTaskStatus.DONE, PaymentTaskStatus.FAILED]),
+                PaymentTaskModel.updated_at < finished_before,
+            )
+            .order_by(PaymentTaskModel.updated_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .cte("doomed")
+        )
+        moved = delete(PaymentTaskModel).where(PaymentTaskModel.id == doomed.c.id)
+        if not keep_archive:
+            result = await self.session.execute(moved.returning(PaymentTaskModel.id))
+            return len(result.all())
+
+        columns = ["id", "payment_id", "status", "attempts", "last_error", "created_at", "updated_at"]
+        moved = moved.returning(*(PaymentTaskModel.__table__.c[name] for name in columns)).cte("moved")
+        stmt = (
+            insert(PaymentTaskArchiveModel)
+            .from_select(columns, select(*(moved.c[name] for name in columns)))
+            .add_cte(moved)
+            .returning(PaymentTaskArchiveModel.id)
+        )
+        result = await self.session.execute(stmt)
+        return len(result.all())
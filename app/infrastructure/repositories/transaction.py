@@ -1,6 +1,6 @@
 from app.infrastructure.db.models.transaction import TransactionModel, TransactionType, TransactionStatus
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import insert, select
 
 class TransactionRepository:
     def __init__(self, session: AsyncSession):
@@ -23,3 +23,7 @@ class TransactionRepository:
             select(TransactionModel).where(TransactionModel.payment_id == payment_id)
         )
         return result.scalar_one_or_none()
+
+    async def create_many(self, rows: list[dict]) -> None:
+        if rows:
+            await self.session.execute(insert(TransactionModel), rows)
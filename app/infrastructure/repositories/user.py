@@ -30,3 +30,8 @@ class UserRepository:
             raise ValueError(f"User {user.id} not found in DB")
         db_user.balance = user.balance
         self.session.add(db_user)
+
+    # ------------------ Получение пользователей пачкой ------------------
+    async def get_many(self, user_ids: list[int]) -> dict[int, User]:
+        result = await self.session.execute(select(UserModel).where(UserModel.id.in_(user_ids)))
+        return {db_user.id: User(id=db_user.id, balance=db_user.balance) for db_user in result.scalars().all()}
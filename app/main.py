@@ -9,6 +9,8 @@ from app.core.settings import settings
 from app.infrastructure.db import models as _models  # noqa: F401
 from app.infrastructure.db.base import Base
 from app.infrastructure.db.session import engine
+from app.infrastructure.idempotency_filter import idempotency_filter
+from app.infrastructure.payment_gateway.http import gateway_client
 
 setup_logging()
 
@@ -27,7 +29,11 @@ async def lifespan(_: FastAPI):
     if settings.auto_create_tables:
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+    await gateway_client.open()
+    if settings.idempotency_filter_enabled:
+        await idempotency_filter.warm()
     yield
+    await gateway_client.close()
     await engine.dispose()
 
 
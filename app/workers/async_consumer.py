@@ -0,0 +1,336 @@
+"""Асинхронный потребитель задач payments.process(_batch): один event loop на процесс.
+
+    python -m app.workers.async_consumer --concurrency 50
+    python -m app.workers.async_consumer --consumer-index 0 --consumer-count 4
+
+В отличие от prefork-воркера Celery, где дочерний процесс ждёт ответа шлюза по одной
+задаче за раз, здесь процесс держит до --concurrency неподтверждённых сообщений
+(basic.qos prefetch) и обрабатывает их конкурентно. Семантика acks_late сохраняется:
+сообщение подтверждается только после того, как платёж финализирован (или ретрай
+записан в расписание payment_retries).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import queue
+import signal
+import socket
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from kombu import Connection
+from kombu.message import Message
+
+from app.core.logging import setup_logging
+from app.core.metrics import metrics
+from app.core.settings import settings
+from app.infrastructure.db.session import dispose_engine
+from app.infrastructure.payment_gateway.http import gateway_client
+from app.infrastructure.repositories.payment_retry import DueRetry
+from app.workers.celery_app import (
+    PAYMENT_QUEUE,
+    PROCESS_PAYMENT_BATCH_TASK,
+    PROCESS_PAYMENT_TASK,
+    assigned_partitions,
+    celery_app,
+    is_partition_queue,
+    partition_queue,
+    payment_batch_concurrency,
+)
+from app.workers.payment_processor import PaymentProcessor
+from app.workers.retry_scheduler import deferred_retry, retry_at, schedule_retries
+from app.workers.tasks import MAX_RETRIES, retry_countdown
+
+logger = logging.getLogger("async_consumer")
+
+
+@dataclass
+class _Delivery:
+    message: Message
+    payment_ids: list[int]
+    batch: bool
+    retries: int
+    eta: datetime | None
+    time_limit: float
+    # Номер AMQP-соединения: delivery tag действителен только в канале, где сообщение получено.
+    generation: int
+    # Очередь, из которой пришло сообщение; ретраи возвращаются в неё же.
+    queue: str
+
+
+@dataclass
+class _Settlement:
+    delivery: _Delivery
+    # Ретраи не удалось записать в расписание — сообщение возвращается в очередь, а не теряется.
+    requeue: bool = False
+
+
+class AsyncPaymentConsumer:
+    """AMQP-соединение живёт в отдельном потоке (kombu синхронный), платежи — в event loop.
+
+    ack/reject/requeue выполняются только в потоке соединения: канал kombu
+    не потокобезопасен, поэтому loop передаёт результаты туда через очередь.
+    """
+
+    def __init__(
+        self,
+        concurrency: int | None = None,
+        processor: PaymentProcessor | None = None,
+        partitions: list[int] | None = None,
+    ):
+        self.concurrency = concurrency or settings.async_consumer_concurrency
+        self.processor = processor or PaymentProcessor(gateway=gateway_client)
+        # Партиции, которые читает процесс; None — все (см. assigned_partitions).
+        self.partitions = partitions
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._settlements: queue.Queue[_Settlement] = queue.Queue()
+        self._stop_event = threading.Event()
+        self._unacked = 0
+        self._generation = 0
+        # Партиция -> lock: сообщения одной партиции обрабатываются по одному, в порядке получения.
+        self._partition_locks: dict[str, asyncio.Lock] = {}
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        await gateway_client.open()
+        thread = threading.Thread(target=self._consume, name="amqp-consumer", daemon=True)
+        thread.start()
+        logger.info("async consumer started: concurrency=%s partitions=%s", self.concurrency, self.partitions)
+        if self.partitions is None and settings.payment_partitions > 1:
+            logger.warning(
+                "async consumer subscribed to all %s partitions: with x-single-active-consumer the first process "
+                "serves all of them, use --consumer-index/--consumer-count to spread them",
+                settings.payment_partitions,
+            )
+        try:
+            await asyncio.to_thread(thread.join)
+        finally:
+            await gateway_client.close()
+        logger.info("async consumer stopped")
+
+    # --- поток соединения -------------------------------------------------
+
+    def _task_queues(self) -> list:
+        queues = list(celery_app.amqp.queues.values())
+        if self.partitions is None:
+            return queues
+        names = {partition_queue(partition) for partition in self.partitions}
+        return [queue for queue in queues if not is_partition_queue(queue.name) or queue.name in names]
+
+    def _consume(self) -> None:
+        task_queues = self._task_queues()
+        while not self._stop_event.is_set():
+            conn = Connection(settings.celery_broker_url, heartbeat=settings.async_consumer_heartbeat_seconds)
+            try:
+                with conn:
+                    self._consume_connection(conn, task_queues)
+                return
+            except conn.connection_errors as exc:
+                # Неподтверждённые сообщения брокер вернёт в очередь сам; результаты обработчиков,
+                # которые ещё идут, относятся к старому каналу и будут отброшены.
+                logger.warning("broker connection lost: error=%s unacked=%s", exc, self._unacked)
+                self._generation += 1
+                self._unacked = 0
+                self._stop_event.wait(settings.async_consumer_reconnect_delay_seconds)
+
+    def _consume_connection(self, conn: Connection, task_queues: list) -> None:
+        conn.ensure_connection(max_retries=None)
+        consumer = conn.Consumer(
+            task_queues,
+            callbacks=[self._on_message],
+            prefetch_count=self.concurrency,
+            accept=["json"],
+        )
+        with consumer:
+            while not self._stop_event.is_set():
+                self._settle_pending()
+                try:
+                    conn.drain_events(timeout=settings.async_consumer_drain_timeout_seconds)
+                except socket.timeout:
+                    pass
+                conn.heartbeat_check()
+
+            # Новые сообщения не берём, ждём завершения начатых, чтобы подтвердить их.
+            consumer.cancel()
+            logger.info("async consumer draining: unacked=%s", self._unacked)
+            while self._unacked:
+                try:
+                    self._settle(self._settlements.get(timeout=settings.async_consumer_drain_timeout_seconds))
+                except queue.Empty:
+                    pass
+                conn.heartbeat_check()
+
+    def _on_message(self, body, message: Message) -> None:
+        headers = message.headers or {}
+        task_name = headers.get("task")
+        if task_name not in (PROCESS_PAYMENT_TASK, PROCESS_PAYMENT_BATCH_TASK):
+            logger.error("unexpected task rejected: task=%s id=%s", task_name, headers.get("id"))
+            message.reject()
+            return
+
+        try:
+            delivery = self._delivery(body, message, task_name == PROCESS_PAYMENT_BATCH_TASK)
+        except (TypeError, ValueError, KeyError, IndexError) as exc:
+            # Исключение в колбэке kombu оборвало бы соединение вместе со всеми сообщениями в работе.
+            logger.error("malformed message rejected: task=%s id=%s error=%s", task_name, headers.get("id"), exc)
+            message.reject()
+            return
+        self._unacked += 1
+        asyncio.run_coroutine_threadsafe(self._handle(delivery), self._loop)
+
+    def _delivery(self, body, message: Message, batch: bool) -> _Delivery:
+        headers = message.headers or {}
+        args, kwargs, _ = body
+        if batch:
+            payment_ids = [int(payment_id) for payment_id in (args[0] if args else kwargs["payment_ids"])]
+        else:
+            payment_ids = [int(args[0] if args else kwargs["payment_id"])]
+        eta = headers.get("eta")
+        # Лимит из заголовка задаёт время всей задачи; пачке он не подходит — там лимит на платёж.
+        hard_limit = None if batch else (headers.get("timelimit") or (None, None))[0]
+        return _Delivery(
+            message=message,
+            payment_ids=payment_ids,
+            batch=batch,
+            retries=int(headers.get("retries") or 0),
+            eta=datetime.fromisoformat(eta) if eta else None,
+            time_limit=hard_limit or settings.celery_task_time_limit_seconds,
+            generation=self._generation,
+            queue=(message.delivery_info or {}).get("routing_key") or PAYMENT_QUEUE,
+        )
+
+    def _settle_pending(self) -> None:
+        while True:
+            try:
+                settlement = self._settlements.get_nowait()
+            except queue.Empty:
+                return
+            self._settle(settlement)
+
+    def _settle(self, settlement: _Settlement) -> None:
+        delivery = settlement.delivery
+        if delivery.generation != self._generation:
+            return
+        if settlement.requeue:
+            delivery.message.requeue()
+        else:
+            delivery.message.ack()
+        self._unacked -= 1
+
+    # --- event loop -------------------------------------------------------
+
+    async def _handle(self, delivery: _Delivery) -> None:
+        # Расчёт нужен всегда: без него _unacked не уменьшится и остановка будет ждать вечно.
+        requeue = True
+        try:
+            requeue = not await self._run_delivery(delivery)
+        except Exception:
+            logger.exception("message handling failed: payment_ids=%s", delivery.payment_ids)
+        finally:
+            self._settlements.put(_Settlement(delivery, requeue=requeue))
+
+    async def _run_delivery(self, delivery: _Delivery) -> bool:
+        """Обрабатывает сообщение; False — ретраи не записаны и сообщение надо вернуть в очередь."""
+        if delivery.eta is not None and delivery.eta > datetime.now(timezone.utc):
+            return await self._postpone(delivery)
+
+        if is_partition_queue(delivery.queue):
+            # Партицию брокер отдаёт только одному потребителю (x-single-active-consumer),
+            # а здесь её сообщения идут строго по одному — платежи пользователя не ждут друг друга на lock.
+            lock = self._partition_locks.setdefault(delivery.queue, asyncio.Lock())
+            async with lock:
+                results = await self._process(delivery)
+        else:
+            results = await self._process(delivery)
+        # Как и в Celery-задачах: одиночный платёж с исключением не повторяется,
+        # а из пачки по одному повторяются все неудачные.
+        failed = ("retry", "error") if delivery.batch else ("retry",)
+        retry_ids = [payment_id for payment_id, result in results.items() if result in failed]
+        deferred_ids = [payment_id for payment_id, result in results.items() if result == "deferred"]
+        await metrics.inc("async_consumer_messages_total")
+        return await self._schedule_retries(delivery, retry_ids, deferred_ids)
+
+    async def _schedule_retries(self, delivery: _Delivery, retry_ids: list[int], deferred_ids: list[int]) -> bool:
+        countdowns = {
+            payment_id: retry_countdown(delivery.retries, self.processor.pop_retry_after(payment_id))
+            for payment_id in retry_ids
+        }
+        if retry_ids and delivery.retries >= MAX_RETRIES:
+            logger.error("max retries exceeded: payment_ids=%s retries=%s", retry_ids, delivery.retries)
+            retry_ids = []
+
+        retries = [
+            DueRetry(payment_id, delivery.retries + 1, delivery.queue, retry_at(countdowns[payment_id]))
+            for payment_id in retry_ids
+        ]
+        retries += [
+            deferred_retry(payment_id, delivery.retries, delivery.queue, self.processor.pop_retry_after(payment_id))
+            for payment_id in deferred_ids
+        ]
+        try:
+            await schedule_retries(retries)
+        except Exception:
+            logger.exception("retry schedule failed: payment_ids=%s", retry_ids + deferred_ids)
+            return False
+        for payment_id in retry_ids:
+            logger.warning("retry scheduled: payment_id=%s countdown=%s", payment_id, countdowns[payment_id])
+        return True
+
+    async def _postpone(self, delivery: _Delivery) -> bool:
+        # Ждать ETA в обработчике — держать слот prefetch: несколько далёких сообщений
+        # заняли бы всю --concurrency и остановили партицию. Срок уходит в payment_retries.
+        retries = [
+            DueRetry(payment_id, delivery.retries, delivery.queue, delivery.eta) for payment_id in delivery.payment_ids
+        ]
+        try:
+            await schedule_retries(retries)
+        except Exception:
+            logger.exception("eta schedule failed: payment_ids=%s", delivery.payment_ids)
+            return False
+        logger.info("eta message postponed: payment_ids=%s eta=%s", delivery.payment_ids, delivery.eta.isoformat())
+        return True
+
+    async def _process(self, delivery: _Delivery) -> dict[int, str]:
+        return await self.processor.process_many(
+            delivery.payment_ids,
+            concurrency=payment_batch_concurrency(delivery.queue),
+            time_limit=delivery.time_limit,
+        )
+
+
+async def _main(concurrency: int | None, partitions: list[int] | None) -> None:
+    consumer = AsyncPaymentConsumer(concurrency=concurrency, partitions=partitions)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, consumer.stop)
+
+    await consumer.run()
+    await dispose_engine()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=None, help="сколько платежей обрабатывать одновременно")
+    parser.add_argument("--consumer-index", type=int, default=None, help="номер процесса: читает партиции p %% count == index")
+    parser.add_argument("--consumer-count", type=int, default=None, help="сколько процессов делят партиции")
+    args = parser.parse_args()
+    partitions = None
+    if args.consumer_count is not None:
+        index = args.consumer_index or 0
+        if not 0 <= index < args.consumer_count:
+            parser.error("--consumer-index must be in [0, --consumer-count)")
+        partitions = assigned_partitions(index, args.consumer_count)
+
+    setup_logging()
+    asyncio.run(_main(args.concurrency, partitions))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,61 @@
 ﻿from __future__ import annotations
 
 from celery import Celery
+from kombu import Exchange, Queue
 
 from app.core.settings import settings
 
+PROCESS_PAYMENT_TASK = "payments.process"
+PROCESS_PAYMENT_BATCH_TASK = "payments.process_batch"
+PAYMENT_QUEUE = "payments"
+
+
+def partition_queue(partition: int) -> str:
+    return f"{PAYMENT_QUEUE}.p{partition}"
+
+
+def is_partition_queue(queue: str | None) -> bool:
+    return bool(queue) and queue.startswith(f"{PAYMENT_QUEUE}.p")
+
+
+def payment_batch_concurrency(queue: str | None) -> int:
+    # В партиции платежи одного пользователя обрабатываются строго по очереди,
+    # поэтому и пачку из неё разбираем последовательно — без ожидания блокировки users.
+    return 1 if is_partition_queue(queue) else settings.payment_batch_concurrency
+
+
+def payment_queue_for(user_id: int) -> str:
+    """Очередь платежей пользователя: все его платежи попадают в одну партицию."""
+    if settings.payment_partitions <= 0:
+        return PAYMENT_QUEUE
+    return partition_queue(user_id % settings.payment_partitions)
+
+
+def assigned_partitions(index: int, count: int) -> list[int]:
+    """Партиции потребителя index из count (p % count == index).
+
+    С x-single-active-consumer активным для очереди становится первый подписчик, поэтому
+    процессы, подписанные на все партиции, не делят их между собой: один работает, остальные ждут.
+    """
+    return [partition for partition in range(settings.payment_partitions) if partition % count == index]
+
+
+def payment_queues() -> list[Queue]:
+    # x-single-active-consumer: партицию в каждый момент читает только один потребитель,
+    # остальные подписчики — горячий резерв и получают её, когда активный отключится.
+    # Routing key равен имени очереди: иначе Celery привяжет все партиции ключом "payments".
+    exchange = Exchange(PAYMENT_QUEUE, type="direct")
+    return [Queue(PAYMENT_QUEUE, exchange, routing_key=PAYMENT_QUEUE)] + [
+        Queue(
+            partition_queue(partition),
+            exchange,
+            routing_key=partition_queue(partition),
+            queue_arguments={"x-single-active-consumer": True},
+        )
+        for partition in range(settings.payment_partitions)
+    ]
+
+
 celery_app = Celery(
     "payments",
     broker=settings.celery_broker_url,
@@ -13,11 +65,15 @@ celery_app = Celery(
 celery_app.conf.update(
     task_acks_late=True,
     worker_prefetch_multiplier=1,
-    task_default_queue="payments",
+    task_default_queue=PAYMENT_QUEUE,
+    task_queues=payment_queues(),
     broker_connection_retry_on_startup=True,
     task_time_limit=settings.celery_task_time_limit_seconds,
     task_soft_time_limit=settings.celery_task_soft_time_limit_seconds,
 )
+if settings.payment_partitions > 0:
+    # Дочерние процессы prefork делят сообщения одной очереди: порядок в партиции держит только один.
+    celery_app.conf.worker_concurrency = 1
 
 # Ensure tasks are registered
 import app.workers.tasks  # noqa: E402,F401
@@ -0,0 +1,294 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from enum import Enum as PyEnum
+
+from app.core.metrics import metrics
+from app.core.settings import settings
+from app.infrastructure.db.models.payment import PaymentStatus
+from app.infrastructure.db.models.payment_task import PaymentTaskStatus
+from app.infrastructure.db.models.transaction import TransactionStatus, TransactionType
+from app.infrastructure.db.session import AsyncSessionLocal
+from app.infrastructure.repositories.payment_finalization import (
+    LockedTaskRow,
+    PaymentChange,
+    PaymentFinalizationRepository,
+    TaskChange,
+)
+
+logger = logging.getLogger("payment_finalizer")
+
+# Суммарное время работы воркера с БД (резервирование + финализация), мкс.
+# Делённое на payments_processing_started_total даёт время БД на один платёж.
+DB_TIME_METRIC = "worker_db_time_us_total"
+
+
+class OutcomeKind(PyEnum):
+    SUCCESS = "success"
+    RETRY = "retry"
+    FAILED = "failed"
+    # Вызов шлюза отсечён локально: задача возвращается в очередь без траты попытки.
+    DEFERRED = "deferred"
+
+
+@dataclass
+class TaskOutcome:
+    task_id: int
+    kind: OutcomeKind
+    error: str | None = None
+    # Версия lease, под которой воркер звал шлюз; None — без проверки.
+    lease_version: int | None = None
+    # Не раньше чем через сколько секунд повторять: Retry-After шлюза (RETRY) или срок отсрочки (DEFERRED).
+    retry_after: float | None = None
+
+
+@dataclass
+class _BatchChanges:
+    balances: dict[int, Decimal]
+    changed_users: set[int] = field(default_factory=set)
+    payments: list[PaymentChange] = field(default_factory=list)
+    transactions: dict[int, TransactionStatus] = field(default_factory=dict)
+    tasks: list[TaskChange] = field(default_factory=list)
+    dlq: list[dict[str, object]] = field(default_factory=list)
+    succeeded: int = 0
+    failed: int = 0
+    retried: int = 0
+    deferred: int = 0
+
+
+class PaymentFinalizer:
+    """Копит исходы вызовов шлюза и применяет их пачкой в одной транзакции."""
+
+    def __init__(self, batch_size: int | None = None, window_seconds: float | None = None):
+        self.batch_size = batch_size or settings.worker_finalize_batch_size
+        self.window_seconds = window_seconds if window_seconds is not None else settings.worker_finalize_window_seconds
+        self._queue: asyncio.Queue[tuple[TaskOutcome, asyncio.Future] | None] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+
+    async def submit(self, outcome: TaskOutcome) -> None:
+        """Ждёт, пока исход будет закоммичен вместе со своей пачкой."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((outcome, future))
+        await future
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.window_seconds
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    item = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[TaskOutcome, asyncio.Future]]) -> None:
+        try:
+            async with metrics.timer(DB_TIME_METRIC):
+                await self.apply([outcome for outcome, _ in batch])
+        except Exception as exc:
+            logger.exception("finalize batch failed: size=%s", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def apply(self, outcomes: list[TaskOutcome]) -> None:
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                repo = PaymentFinalizationRepository(session)
+                rows = await repo.lock_tasks([outcome.task_id for outcome in outcomes])
+                applied = [outcome for outcome in outcomes if not self._is_fenced(outcome, rows.get(outcome.task_id))]
+                balances = await repo.lock_balances({
+                    rows[outcome.task_id].user_id
+                    for outcome in applied
+                    if outcome.kind == OutcomeKind.SUCCESS and outcome.task_id in rows
+                })
+
+                changes = _BatchChanges(balances=balances)
+                for outcome in applied:
+                    row = rows.get(outcome.task_id)
+                    if row is None:
+                        # Задача удалена вместе с платежом (ON DELETE CASCADE) — применять нечего.
+                        logger.warning("finalize skipped: task not found task_id=%s", outcome.task_id)
+                        continue
+                    if outcome.kind == OutcomeKind.SUCCESS:
+                        self._apply_success(changes, row)
+                    elif outcome.kind == OutcomeKind.RETRY:
+                        self._apply_failure(changes, row, outcome.error or "gateway_error", now, outcome.retry_after)
+                    elif outcome.kind == OutcomeKind.DEFERRED:
+                        next_retry_at = now + timedelta(seconds=outcome.retry_after or 0)
+                        self._apply_deferral(changes, row, outcome.error or "gateway_error", next_retry_at)
+                    else:
+                        self._mark_failed(changes, row, outcome.error or "gateway_error")
+
+                await repo.update_balances({user_id: changes.balances[user_id] for user_id in changes.changed_users})
+                await repo.update_payments(changes.payments)
+                await repo.update_transactions(changes.transactions)
+                await repo.update_tasks(changes.tasks)
+                written = await repo.insert_dlq(changes.dlq)
+
+        await metrics.inc("worker_finalize_batches_total")
+        await metrics.inc("worker_finalized_total", len(outcomes))
+        if len(applied) < len(outcomes):
+            await metrics.inc("payment_tasks_fenced_writes_total", len(outcomes) - len(applied))
+        if changes.succeeded:
+            await metrics.inc("payments_success_total", changes.succeeded)
+        if changes.failed:
+            await metrics.inc("payments_failed_total", changes.failed)
+        if changes.retried:
+            await metrics.inc("payments_retried_total", changes.retried)
+        if changes.deferred:
+            await metrics.inc("payments_deferred_total", changes.deferred)
+        if written:
+            await metrics.inc("dlq_written_total", len(written))
+            for payment_id in written:
+                logger.warning("dlq written: payment_id=%s", payment_id)
+
+    def _is_fenced(self, outcome: TaskOutcome, row: LockedTaskRow | None) -> bool:
+        # Задачу перехватили (reaper вернул её в new или её зарезервировал другой воркер):
+        # исход устаревшего владельца не применяем, иначе возможна двойная финализация.
+        if row is None or outcome.lease_version is None:
+            return False
+        if row.task_status == PaymentTaskStatus.PROCESSING and row.lease_version == outcome.lease_version:
+            return False
+        logger.warning(
+            "finalize fenced: task_id=%s lease_version=%s current_lease_version=%s task_status=%s",
+            outcome.task_id,
+            outcome.lease_version,
+            row.lease_version,
+            row.task_status.value,
+        )
+        return True
+
+    def _apply_success(self, changes: _BatchChanges, row: LockedTaskRow) -> None:
+        if row.payment_status == PaymentStatus.SUCCESS:
+            changes.tasks.append(TaskChange(row.task_id, PaymentTaskStatus.DONE, None, None))
+            return
+
+        if row.transaction_type is None:
+            logger.error("apply_success failed: missing_transaction payment_id=%s", row.payment_id)
+            self._fail(changes, row, "missing_transaction", row.payment_attempts)
+            return
+
+        balance = changes.balances.get(row.user_id)
+        if balance is None:
+            logger.error("apply_success failed: missing_user payment_id=%s", row.payment_id)
+            self._fail(changes, row, "missing_user", row.payment_attempts)
+            return
+
+        if row.transaction_type == TransactionType.DEPOSIT:
+            balance = balance + (row.amount - row.commission)
+        else:
+            total_amount = row.amount + row.commission
+            if balance < total_amount:
+                logger.warning("apply_success failed: insufficient_funds payment_id=%s", row.payment_id)
+                self._fail(changes, row, "insufficient_funds", row.payment_attempts)
+                return
+            balance = balance - total_amount
+
+        # Баланс накапливается в памяти: следующий платёж того же пользователя в пачке видит уже новый.
+        changes.balances[row.user_id] = balance
+        changes.changed_users.add(row.user_id)
+        changes.payments.append(PaymentChange(row.payment_id, PaymentStatus.SUCCESS, None, None, row.payment_attempts))
+        changes.transactions[row.payment_id] = TransactionStatus.SUCCESS
+        changes.tasks.append(TaskChange(row.task_id, PaymentTaskStatus.DONE, None, None))
+        changes.succeeded += 1
+        logger.info("payment success: payment_id=%s", row.payment_id)
+
+    def _apply_failure(
+        self,
+        changes: _BatchChanges,
+        row: LockedTaskRow,
+        error: str,
+        now: datetime,
+        retry_after: float | None = None,
+    ) -> None:
+        if row.task_attempts >= settings.gateway_max_attempts:
+            logger.error("payment failed: max_attempts payment_id=%s error=%s", row.payment_id, error)
+            self._fail(changes, row, error, row.task_attempts)
+            return
+
+        logger.warning(
+            "payment retry scheduled: payment_id=%s error=%s next_attempt=%s",
+            row.payment_id,
+            error,
+            row.task_attempts + 1,
+        )
+        backoff_seconds = settings.gateway_backoff_base_seconds * (2 ** (row.task_attempts - 1))
+        backoff_seconds = min(backoff_seconds, settings.gateway_backoff_max_seconds)
+        jitter = random.uniform(0, settings.gateway_backoff_jitter_seconds)
+        # Retry-After шлюза — нижняя граница: раньше него повтор снова получит 429/503.
+        next_retry_at = now + timedelta(seconds=max(backoff_seconds + jitter, retry_after or 0.0))
+
+        changes.tasks.append(TaskChange(row.task_id, PaymentTaskStatus.NEW, error, next_retry_at))
+        changes.payments.append(PaymentChange(row.payment_id, PaymentStatus.NEW, error, next_retry_at, row.task_attempts))
+        if row.transaction_type is not None:
+            changes.transactions[row.payment_id] = TransactionStatus.PROCESSING
+        changes.retried += 1
+
+    def _apply_deferral(self, changes: _BatchChanges, row: LockedTaskRow, error: str, next_retry_at: datetime) -> None:
+        # Как отсрочка бюджетом ретраев при резервировании: попытка, которую засчитал reserve_batch,
+        # возвращается, и до gateway_max_attempts платёж доходит только вызовами, дошедшими до шлюза.
+        attempts = row.task_attempts - 1
+        logger.warning(
+            "payment deferred: payment_id=%s error=%s next_retry_at=%s",
+            row.payment_id,
+            error,
+            next_retry_at.isoformat(),
+        )
+        changes.tasks.append(TaskChange(row.task_id, PaymentTaskStatus.NEW, error, next_retry_at, attempts))
+        changes.payments.append(PaymentChange(row.payment_id, PaymentStatus.NEW, error, next_retry_at, attempts))
+        changes.deferred += 1
+
+    def _mark_failed(self, changes: _BatchChanges, row: LockedTaskRow, error: str) -> None:
+        logger.error("payment failed: payment_id=%s error=%s", row.payment_id, error)
+        self._fail(changes, row, error, row.task_attempts)
+
+    def _fail(self, changes: _BatchChanges, row: LockedTaskRow, error: str, attempts: int) -> None:
+        changes.tasks.append(TaskChange(row.task_id, PaymentTaskStatus.FAILED, error, None))
+        changes.payments.append(PaymentChange(row.payment_id, PaymentStatus.FAILED, error, None, attempts))
+        if row.transaction_type is not None:
+            changes.transactions[row.payment_id] = TransactionStatus.FAILED
+        changes.dlq.append({
+            "payment_id": row.payment_id,
+            "user_id": row.user_id,
+            "amount": row.amount,
+            "commission": row.commission,
+            "payment_type": row.transaction_type.value if row.transaction_type else "unknown",
+            "error": error,
+            "attempts": attempts,
+        })
+        changes.failed += 1
@@ -0,0 +1,192 @@
+"""Relay transactional outbox: переносит записи payment_outbox в очередь задач.
+
+    python -m app.workers.outbox_relay
+
+API пишет запись outbox в той же транзакции, что платёж и транзакцию, поэтому
+падение процесса после COMMIT больше не оставляет платёж в NEW без задачи.
+Relay забирает записи пачками (FOR UPDATE SKIP LOCKED — можно запускать несколько),
+публикует их (PAYMENT_QUEUE_BACKEND=celery) или создаёт строки payment_tasks
+(PAYMENT_QUEUE_BACKEND=db) и отмечает отправленными в той же транзакции.
+Доставка at-least-once: после сбоя между публикацией и COMMIT пачка уйдёт повторно,
+обработка платежа к этому готова.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+import time
+from datetime import datetime, timezone
+
+from app.core.logging import setup_logging
+from app.core.metrics import metrics
+from app.core.settings import settings
+from app.infrastructure.db.notifications import PgNotificationListener
+from app.infrastructure.db.session import AsyncSessionLocal, dispose_engine
+from app.infrastructure.repositories.payment_outbox import (
+    PAYMENT_OUTBOX_CHANNEL,
+    OutboxRecord,
+    PaymentOutboxRepository,
+)
+from app.infrastructure.repositories.payment_task import PaymentTaskRepository
+from app.workers.celery_app import payment_queue_for
+from app.workers.publisher import PaymentPublisher
+from app.workers.queue import payment_publisher
+
+logger = logging.getLogger("outbox_relay")
+
+OUTBOX_LAG_METRIC = "outbox_lag_ms"
+
+
+class OutboxRelay:
+    def __init__(self, backend: str | None = None, publisher: PaymentPublisher | None = None):
+        self.backend = backend or settings.payment_queue_backend
+        # Публикатор нужен только для celery: в режиме db задачи создаются в той же транзакции.
+        self._publisher = None
+        if self.backend == "celery":
+            self._publisher = publisher or payment_publisher
+        self._stop_event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._listener: PgNotificationListener | None = None
+        if settings.outbox_relay_listen_enabled:
+            self._listener = PgNotificationListener(PAYMENT_OUTBOX_CHANNEL, self._wakeup.set)
+
+    async def start(self) -> None:
+        if self._task is None:
+            if self._publisher is not None:
+                self._publisher.start()
+            if self._listener:
+                await self._listener.connect()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+        if self._listener:
+            await self._listener.close()
+        if self._publisher is not None:
+            await self._publisher.stop()
+
+    async def run(self) -> None:
+        logger.info(
+            "outbox relay started: backend=%s batch_size=%s",
+            self.backend,
+            settings.outbox_relay_batch_size,
+        )
+        while not self._stop_event.is_set():
+            # Сбрасываем до чтения: NOTIFY, пришедший во время запроса, не потеряется.
+            self._wakeup.clear()
+            try:
+                relayed = await self.relay_once()
+            except Exception:
+                logger.exception("outbox relay pass failed")
+                await self._wait_for_work(settings.outbox_relay_poll_interval_seconds)
+                continue
+            if not relayed:
+                await self._wait_for_work(await self._idle_timeout())
+        logger.info("outbox relay stopped")
+
+    async def relay_once(self) -> int:
+        """Переносит записи пачками, пока outbox не опустеет; возвращает число записей."""
+        started = time.perf_counter()
+        total = 0
+
+        while not self._stop_event.is_set():
+            relayed = await self._relay_batch()
+            total += relayed
+            if relayed < settings.outbox_relay_batch_size:
+                break
+
+        if total:
+            elapsed = max(time.perf_counter() - started, 1e-6)
+            rows_per_second = int(total / elapsed)
+            await metrics.inc("outbox_relayed_total", total)
+            await metrics.set("outbox_relay_rows_per_second", rows_per_second)
+            logger.info(
+                "outbox relayed: backend=%s rows=%s seconds=%.2f rows_per_second=%s",
+                self.backend,
+                total,
+                elapsed,
+                rows_per_second,
+            )
+        return total
+
+    async def _relay_batch(self) -> int:
+        # Записи остаются заблокированными до COMMIT: пока пачка публикуется,
+        # другой relay её не возьмёт, а при ошибке она вернётся в outbox нетронутой.
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                outbox = PaymentOutboxRepository(session)
+                records = await outbox.claim_batch(settings.outbox_relay_batch_size)
+                if not records:
+                    return 0
+
+                if self.backend == "db":
+                    await PaymentTaskRepository(session).create_many([record.payment_id for record in records])
+                else:
+                    await self._publish(records)
+                await outbox.mark_sent([record.id for record in records])
+
+        await self._report_lag(records)
+        return len(records)
+
+    async def _publish(self, records: list[OutboxRecord]) -> None:
+        # Платежи одного пользователя уходят в одну партицию в порядке создания.
+        by_queue: dict[str, list[int]] = {}
+        for record in records:
+            by_queue.setdefault(payment_queue_for(record.user_id), []).append(record.payment_id)
+
+        # Не больше ENQUEUE_BATCH_MAX_SIZE платежей в одном сообщении payments.process_batch.
+        size = settings.enqueue_batch_max_size
+        confirmations = [
+            self._publisher.publish(payment_ids[i : i + size], queue=queue)
+            for queue, payment_ids in by_queue.items()
+            for i in range(0, len(payment_ids), size)
+        ]
+        await asyncio.wait_for(
+            asyncio.gather(*confirmations),
+            timeout=settings.outbox_relay_publish_timeout_seconds,
+        )
+
+    async def _report_lag(self, records: list[OutboxRecord]) -> None:
+        # Лаг — от COMMIT платежа в API до отправки записи в очередь.
+        now = datetime.now(timezone.utc)
+        for record in records:
+            await metrics.observe(OUTBOX_LAG_METRIC, (now - record.created_at).total_seconds() * 1000)
+        oldest = min(record.created_at for record in records)
+        await metrics.set("outbox_lag_max_ms", int((now - oldest).total_seconds() * 1000))
+
+    async def _idle_timeout(self) -> float:
+        # Без LISTEN-соединения — частый опрос, с ним опрос только страхует от потерянных NOTIFY.
+        if self._listener is None or not await self._listener.connect():
+            return settings.outbox_relay_poll_interval_seconds
+        return settings.outbox_relay_fallback_poll_interval_seconds
+
+    async def _wait_for_work(self, timeout: float) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _main() -> None:
+    relay = OutboxRelay()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await relay.start()
+    await stop.wait()
+    await relay.stop()
+    await dispose_engine()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(_main())
@@ -1,5 +1,6 @@
 ﻿from __future__ import annotations
 
+import asyncio
 import logging
 import random
 from datetime import datetime, timedelta, timezone
@@ -7,20 +8,27 @@ from datetime import datetime, timedelta, timezone
 from sqlalchemy import select
 
 from app.core.metrics import metrics
+from app.core.retry_budget import retry_budget
 from app.core.settings import settings
 from app.infrastructure.db.models.payment import PaymentModel, PaymentStatus
 from app.infrastructure.db.models.transaction import TransactionModel, TransactionStatus, TransactionType
 from app.infrastructure.db.models.user import UserModel
 from app.infrastructure.db.session import AsyncSessionLocal
-from app.infrastructure.payment_gateway.http import PaymentGatewayClient
+from app.infrastructure.payment_gateway.http import PaymentGatewayClient, gateway_client
 from app.infrastructure.repositories.payment_dlq import PaymentDLQRepository
 
 logger = logging.getLogger("payment_processor")
 
 
 class PaymentProcessor:
-    def __init__(self) -> None:
-        self.gateway = PaymentGatewayClient()
+    def __init__(self, gateway: PaymentGatewayClient | None = None) -> None:
+        self.gateway = gateway or gateway_client
+        # payment_id -> не раньше чем через сколько секунд повторять платёж, вернувшийся как "deferred"
+        # или "retry" с Retry-After шлюза; вызывающий забирает значение через pop_retry_after.
+        self._retry_after: dict[int, float] = {}
+
+    def pop_retry_after(self, payment_id: int) -> float | None:
+        return self._retry_after.pop(payment_id, None)
 
     async def process(self, payment_id: int) -> str:
         async with AsyncSessionLocal() as session:
@@ -34,6 +42,20 @@ class PaymentProcessor:
                     logger.info("payment already finalized: payment_id=%s status=%s", payment.id, payment.status.value)
                     return payment.status.value
 
+                # То же правило, что у PaymentWorker: бюджет пополняется один раз на платёж.
+                if not payment.retry_budget_credited:
+                    payment.retry_budget_credited = True
+                    await retry_budget.record_first_attempt()
+                elif not await retry_budget.acquire_retry():
+                    # Бюджет ретраев исчерпан (шлюз, скорее всего, лежит): попытку не тратим и шлюз не зовём.
+                    delay = retry_budget.defer_seconds()
+                    payment.status = PaymentStatus.NEW
+                    payment.locked_at = None
+                    payment.next_retry_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+                    self._retry_after[payment.id] = delay
+                    logger.warning("retry deferred: payment_id=%s attempts=%s", payment.id, payment.attempts)
+                    return "deferred"
+
                 payment.status = PaymentStatus.PROCESSING
                 payment.attempts = payment.attempts + 1
                 payment.locked_at = datetime.now(timezone.utc)
@@ -46,6 +68,11 @@ class PaymentProcessor:
             return "failed"
 
         response = await self.gateway.charge(payload)
+        if not response.attempted:
+            # До шлюза вызов не дошёл (цепь разомкнута, нет места в лимите): попытку возвращаем.
+            await self._defer(payment_id, response.error or "gateway_error", response.retry_after or 0.0)
+            return "deferred"
+
         if response.success:
             await metrics.inc("gateway_success_total")
             await self._apply_success(payment_id)
@@ -56,13 +83,39 @@ class PaymentProcessor:
                 await metrics.inc("gateway_timeouts_total")
             else:
                 await metrics.inc("gateway_errors_total")
-            await self._apply_failure(payment_id, response.error or "gateway_error")
+            await self._apply_failure(payment_id, response.error or "gateway_error", response.retry_after)
             return "retry"
 
         await metrics.inc("gateway_non_retryable_errors_total")
         await self._mark_failed(payment_id, response.error or "gateway_error")
         return "failed"
 
+    async def process_many(
+        self,
+        payment_ids: list[int],
+        concurrency: int,
+        time_limit: float | None = None,
+    ) -> dict[int, str]:
+        """Обрабатывает пачку платежей, не больше concurrency одновременно; ошибка одного не трогает остальные."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def process_one(payment_id: int) -> str:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(self.process(payment_id), time_limit)
+                except asyncio.TimeoutError:
+                    # Транзакция отменённой обработки откатывается; платёж перепроверится в ретрае.
+                    logger.error("payment time limit exceeded: payment_id=%s limit=%s", payment_id, time_limit)
+                    await metrics.inc("payments_time_limit_exceeded_total")
+                    return "retry"
+                except Exception:
+                    logger.exception("payment processing crashed: payment_id=%s", payment_id)
+                    return "error"
+
+        payment_ids = list(dict.fromkeys(payment_ids))
+        results = await asyncio.gather(*(process_one(payment_id) for payment_id in payment_ids))
+        return dict(zip(payment_ids, results))
+
     async def _build_payload(self, payment_id: int) -> dict[str, object] | None:
         async with AsyncSessionLocal() as session:
             payment = await session.get(PaymentModel, payment_id)
@@ -127,7 +180,7 @@ class PaymentProcessor:
                 await metrics.inc("payments_success_total")
                 logger.info("payment success: payment_id=%s", payment.id)
 
-    async def _apply_failure(self, payment_id: int, error: str) -> None:
+    async def _apply_failure(self, payment_id: int, error: str, retry_after: float | None = None) -> None:
         async with AsyncSessionLocal() as session:
             async with session.begin():
                 payment = await session.get(PaymentModel, payment_id, with_for_update=True)
@@ -158,9 +211,26 @@ class PaymentProcessor:
                 payment.status = PaymentStatus.NEW
                 payment.last_error = error
                 payment.locked_at = None
-                payment.next_retry_at = datetime.now(timezone.utc) + timedelta(seconds=backoff_seconds + jitter)
+                delay = max(backoff_seconds + jitter, retry_after or 0.0)
+                payment.next_retry_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
                 if transaction:
                     transaction.status = TransactionStatus.PROCESSING
+        if retry_after is not None:
+            self._retry_after[payment_id] = retry_after
+
+    async def _defer(self, payment_id: int, error: str, delay: float) -> None:
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                payment = await session.get(PaymentModel, payment_id, with_for_update=True)
+                if not payment or payment.status != PaymentStatus.PROCESSING:
+                    return
+                payment.status = PaymentStatus.NEW
+                payment.attempts = payment.attempts - 1
+                payment.last_error = error
+                payment.locked_at = None
+                payment.next_retry_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        self._retry_after[payment_id] = delay
+        logger.warning("gateway call deferred: payment_id=%s error=%s retry_after=%s", payment_id, error, delay)
 
     async def _mark_failed(self, payment_id: int, error: str) -> None:
         async with AsyncSessionLocal() as session:
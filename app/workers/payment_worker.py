@@ -2,105 +2,246 @@
 
 import asyncio
 import logging
-import random
 from datetime import datetime, timedelta, timezone
 
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
-
 from app.core.metrics import metrics
+from app.core.retry_budget import retry_budget
 from app.core.settings import settings
-from app.infrastructure.db.models.payment import PaymentModel, PaymentStatus
-from app.infrastructure.db.models.payment_task import PaymentTaskModel, PaymentTaskStatus
-from app.infrastructure.db.models.transaction import TransactionModel, TransactionStatus, TransactionType
-from app.infrastructure.db.models.user import UserModel
+from app.infrastructure.db.notifications import PgNotificationListener
 from app.infrastructure.db.session import AsyncSessionLocal
-from app.infrastructure.payment_gateway.http import PaymentGatewayClient
-from app.infrastructure.repositories.payment_dlq import PaymentDLQRepository
-from app.infrastructure.repositories.payment_task import PaymentTaskRepository
+from app.infrastructure.payment_gateway.http import GatewayResponse, PaymentGatewayClient, gateway_client
+from app.infrastructure.repositories.payment_task import (
+    PAYMENT_TASKS_CHANNEL,
+    PaymentTaskRepository,
+    ReservedPaymentTask,
+)
+from app.workers.finalizer import DB_TIME_METRIC, OutcomeKind, PaymentFinalizer, TaskOutcome
 
 logger = logging.getLogger("payment_worker")
 
 
 class PaymentWorker:
-    def __init__(self):
+    def __init__(self, gateway: PaymentGatewayClient | None = None):
         self._stop_event = asyncio.Event()
         self._task: asyncio.Task | None = None
-        self.gateway = PaymentGatewayClient()
+        self._in_flight: set[asyncio.Task] = set()
+        # task_id -> lease_version задач, которые сейчас в работе; их lease продлевает heartbeat.
+        self._leases: dict[int, int] = {}
+        self._heartbeat_task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._listener: PgNotificationListener | None = None
+        if settings.worker_listen_enabled:
+            self._listener = PgNotificationListener(PAYMENT_TASKS_CHANNEL, self._wakeup.set)
+        self.gateway = gateway or gateway_client
+        self.finalizer = PaymentFinalizer()
 
     async def start(self) -> None:
         if self._task is None:
+            await self.gateway.open()
+            if self._listener:
+                await self._listener.connect()
             self._task = asyncio.create_task(self.run())
 
     async def stop(self) -> None:
         self._stop_event.set()
+        self._wakeup.set()
         if self._task:
             await self._task
+            self._task = None
+        if self._listener:
+            await self._listener.close()
+        await self.gateway.close()
 
     async def run(self) -> None:
-        logger.info("payment worker started")
+        logger.info(
+            "payment worker started: batch_size=%s concurrency=%s",
+            settings.worker_batch_size,
+            settings.worker_concurrency,
+        )
+        await self.finalizer.start()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
         while not self._stop_event.is_set():
-            task_id = await self._reserve_task()
-            if task_id is None:
-                await asyncio.sleep(settings.worker_poll_interval_seconds)
+            free_slots = settings.worker_concurrency - len(self._in_flight)
+            if free_slots <= 0:
+                await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED)
                 continue
 
-            await self._process_task(task_id)
+            # Сбрасываем до резервирования: NOTIFY, пришедший во время запроса, не потеряется.
+            self._wakeup.clear()
+            try:
+                reserved = await self._reserve_tasks(min(free_slots, settings.worker_batch_size))
+            except Exception:
+                # БД недоступна — не роняем цикл (и процесс под супервизором), пробуем позже.
+                logger.exception("reserve tasks failed")
+                await self._wait_for_work(settings.worker_poll_interval_seconds)
+                continue
+            if not reserved:
+                await self._wait_for_work()
+                continue
 
-        logger.info("payment worker stopped")
+            for task_id, lease_version, payload in reserved:
+                self._spawn(task_id, lease_version, payload)
 
-    async def _reserve_task(self) -> int | None:
-        now = datetime.now(timezone.utc)
-        stuck_before = now - timedelta(seconds=settings.worker_processing_timeout_seconds)
+        if self._in_flight:
+            logger.info("payment worker draining: in_flight=%s", len(self._in_flight))
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        self._heartbeat_task.cancel()
+        await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+        self._heartbeat_task = None
+        await self.finalizer.stop()
+        logger.info("payment worker stopped")
 
+    def _spawn(self, task_id: int, lease_version: int, payload: dict[str, object] | None) -> None:
+        self._leases[task_id] = lease_version
+        task = asyncio.create_task(self._process_task(task_id, lease_version, payload))
+        self._in_flight.add(task)
+        task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task: asyncio.Task) -> None:
+        self._in_flight.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("task processing crashed", exc_info=task.exception())
+
+    async def _heartbeat(self) -> None:
+        # Продлеваем lease всем задачам в работе одним UPDATE, пока шлюз отвечает,
+        # чтобы reaper не вернул их в очередь посреди вызова.
+        while True:
+            await asyncio.sleep(settings.worker_lease_heartbeat_interval_seconds)
+            try:
+                await self._renew_leases()
+            except Exception:
+                logger.exception("lease renewal failed")
+
+    async def _renew_leases(self) -> None:
+        leases = dict(self._leases)
+        if not leases:
+            return
+        async with metrics.timer(DB_TIME_METRIC):
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    renewed = await PaymentTaskRepository(session).renew_leases(leases, datetime.now(timezone.utc))
+
+        if renewed:
+            await metrics.inc("payment_tasks_lease_renewals_total", len(renewed))
+        # Задачи, завершившиеся за время запроса, потерянными не считаем.
+        lost = sorted(task_id for task_id in leases.keys() - set(renewed) if self._leases.get(task_id) == leases[task_id])
+        if lost:
+            logger.warning("lease renewal skipped: task_ids=%s", lost)
+
+    async def _wait_for_work(self, timeout: float | None = None) -> None:
+        if timeout is None:
+            timeout = await self._idle_timeout()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _idle_timeout(self) -> float:
+        # Без LISTEN-соединения работаем как раньше — частым опросом.
+        if self._listener is None or not await self._listener.connect():
+            return settings.worker_poll_interval_seconds
+
+        # С LISTEN новые задачи приходят через NOTIFY, а опрос нужен только
+        # для ретраев по next_retry_at.
         async with AsyncSessionLocal() as session:
-            async with session.begin():
-                repo = PaymentTaskRepository(session)
-                task = await repo.reserve_next(now=now, stuck_before=stuck_before)
-                if not task:
-                    return None
+            deadline = await PaymentTaskRepository(session).next_deadline()
 
-                task.status = PaymentTaskStatus.PROCESSING
-                task.attempts = task.attempts + 1
-                task.locked_at = now
-                task.next_retry_at = None
+        timeout = settings.worker_fallback_poll_interval_seconds
+        if deadline is not None:
+            until_deadline = (deadline - datetime.now(timezone.utc)).total_seconds()
+            # Срок уже наступил, но строку держит другой воркер — не крутимся в холостую.
+            timeout = min(timeout, max(until_deadline, settings.worker_poll_interval_seconds))
+        return timeout
 
-                payment = await session.get(PaymentModel, task.payment_id, with_for_update=True)
-                if payment:
-                    if payment.status == PaymentStatus.SUCCESS:
-                        task.status = PaymentTaskStatus.DONE
-                        task.locked_at = None
-                        logger.info("task skipped: already success payment_id=%s task_id=%s", task.payment_id, task.id)
-                        return None
-                    if payment.status == PaymentStatus.FAILED:
-                        task.status = PaymentTaskStatus.FAILED
-                        task.last_error = payment.last_error
-                        task.locked_at = None
-                        logger.info("task skipped: already failed payment_id=%s task_id=%s", task.payment_id, task.id)
-                        return None
+    async def _reserve_tasks(self, limit: int) -> list[tuple[int, int, dict[str, object] | None]]:
+        now = datetime.now(timezone.utc)
 
-                    payment.status = PaymentStatus.PROCESSING
-                    payment.attempts = task.attempts
-                    payment.locked_at = now
-                    payment.next_retry_at = None
-                await session.flush()
-                await metrics.inc("payments_processing_started_total")
-                logger.info("task reserved: task_id=%s payment_id=%s attempt=%s", task.id, task.payment_id, task.attempts)
+        async with metrics.timer(DB_TIME_METRIC):
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    repo = PaymentTaskRepository(session)
+                    tasks = await repo.reserve_batch(now=now, limit=limit)
+                    finalized = [task for task in tasks if task.is_finalized]
+                    if finalized:
+                        await repo.close_finalized(finalized)
+                    deferred = await self._apply_retry_budget([task for task in tasks if not task.is_finalized])
+                    if deferred:
+                        await repo.defer(deferred, now + timedelta(seconds=retry_budget.defer_seconds()))
+
+        deferred_ids = {task.task_id for task in deferred}
+        reserved: list[tuple[int, int, dict[str, object] | None]] = []
+        for task in tasks:
+            if task.is_finalized:
+                logger.info(
+                    "task skipped: already %s payment_id=%s task_id=%s",
+                    task.payment_status.value,
+                    task.payment_id,
+                    task.task_id,
+                )
+                continue
+            if task.task_id in deferred_ids:
+                logger.info("retry deferred: payment_id=%s task_id=%s", task.payment_id, task.task_id)
+                continue
+            logger.info("task reserved: task_id=%s payment_id=%s attempt=%s", task.task_id, task.payment_id, task.attempts)
+            reserved.append((task.task_id, task.lease_version, task.gateway_payload()))
+
+        if reserved:
+            await metrics.inc("payments_processing_started_total", len(reserved))
+        return reserved
+
+    @staticmethod
+    async def _apply_retry_budget(tasks: list[ReservedPaymentTask]) -> list[ReservedPaymentTask]:
+        """Учитывает первые попытки в бюджете и возвращает ретраи, на которые бюджета нет."""
+        deferred: list[ReservedPaymentTask] = []
+        for task in tasks:
+            # Первая попытка — пока платёж не пополнял бюджет: отложенный вызов возвращает attempts,
+            # и по счётчику попыток платёж пополнял бы бюджет при каждом резервировании.
+            if not task.payment_retry_budget_credited:
+                await retry_budget.record_first_attempt()
+            elif not await retry_budget.acquire_retry():
+                deferred.append(task)
+        return deferred
+
+    async def _process_task(self, task_id: int, lease_version: int, payload: dict[str, object] | None) -> None:
+        try:
+            if payload is None:
+                await self.finalizer.submit(
+                    TaskOutcome(task_id, OutcomeKind.FAILED, "missing_transaction", lease_version)
+                )
+                return
 
-                return task.id
+            response = await self.gateway.charge(payload)
+            outcome = await self._outcome(task_id, lease_version, payload, response)
+            await self.finalizer.submit(outcome)
+        finally:
+            self._leases.pop(task_id, None)
 
-    async def _process_task(self, task_id: int) -> None:
-        payload = await self._build_payload_from_task(task_id)
-        if payload is None:
-            await self._mark_failed_task(task_id, "missing_transaction")
-            return
+    async def _outcome(
+        self,
+        task_id: int,
+        lease_version: int,
+        payload: dict[str, object],
+        response: GatewayResponse,
+    ) -> TaskOutcome:
+        if not response.attempted:
+            logger.warning(
+                "gateway call deferred: payment_id=%s error=%s retry_after=%s",
+                payload.get("payment_id"),
+                response.error,
+                response.retry_after,
+            )
+            return TaskOutcome(
+                task_id,
+                OutcomeKind.DEFERRED,
+                response.error,
+                lease_version,
+                retry_after=response.retry_after,
+            )
 
-        response = await self.gateway.charge(payload)
         if response.success:
             await metrics.inc("gateway_success_total")
             logger.info("gateway success: payment_id=%s", payload.get("payment_id"))
-            await self._apply_success(task_id)
-            return
+            return TaskOutcome(task_id, OutcomeKind.SUCCESS, lease_version=lease_version)
 
         if response.retryable:
             if response.error == "timeout":
@@ -108,222 +249,14 @@ class PaymentWorker:
             else:
                 await metrics.inc("gateway_errors_total")
             logger.warning("gateway retryable error: payment_id=%s error=%s", payload.get("payment_id"), response.error)
-            await self._apply_failure(task_id, response.error or "gateway_error")
-        else:
-            await metrics.inc("gateway_non_retryable_errors_total")
-            logger.error("gateway non-retryable error: payment_id=%s error=%s", payload.get("payment_id"), response.error)
-            await self._mark_failed_task(task_id, response.error or "gateway_error")
-
-    async def _build_payload_from_task(self, task_id: int) -> dict[str, object] | None:
-        async with AsyncSessionLocal() as session:
-            task = await session.get(PaymentTaskModel, task_id)
-            if not task:
-                return None
-
-            payment = await session.get(PaymentModel, task.payment_id)
-            if not payment:
-                return None
-
-            transaction = await session.execute(
-                select(TransactionModel).where(TransactionModel.payment_id == payment.id)
+            return TaskOutcome(
+                task_id,
+                OutcomeKind.RETRY,
+                response.error or "gateway_error",
+                lease_version,
+                retry_after=response.retry_after,
             )
-            transaction = transaction.scalar_one_or_none()
-            if not transaction:
-                return None
-
-            return {
-                "payment_id": payment.id,
-                "user_id": payment.user_id,
-                "amount": float(payment.amount),
-                "commission": float(payment.commission),
-                "type": transaction.type.value,
-            }
-
-    async def _apply_success(self, task_id: int) -> None:
-        async with AsyncSessionLocal() as session:
-            async with session.begin():
-                task = await session.get(PaymentTaskModel, task_id, with_for_update=True)
-                if not task:
-                    return
-
-                payment = await session.get(PaymentModel, task.payment_id, with_for_update=True)
-                if not payment or payment.status == PaymentStatus.SUCCESS:
-                    task.status = PaymentTaskStatus.DONE
-                    task.locked_at = None
-                    return
 
-                transaction = await session.execute(
-                    select(TransactionModel)
-                    .where(TransactionModel.payment_id == payment.id)
-                    .with_for_update()
-                )
-                transaction = transaction.scalar_one_or_none()
-                if not transaction:
-                    payment.status = PaymentStatus.FAILED
-                    payment.last_error = "missing_transaction"
-                    payment.locked_at = None
-                    task.status = PaymentTaskStatus.FAILED
-                    task.last_error = "missing_transaction"
-                    task.locked_at = None
-                    await metrics.inc("payments_failed_total")
-                    logger.error("apply_success failed: missing_transaction payment_id=%s", payment.id)
-                    await self._write_dlq(session, payment, transaction, "missing_transaction")
-                    return
-
-                user = await session.get(UserModel, payment.user_id, with_for_update=True)
-                if not user:
-                    payment.status = PaymentStatus.FAILED
-                    payment.last_error = "missing_user"
-                    payment.locked_at = None
-                    transaction.status = TransactionStatus.FAILED
-                    task.status = PaymentTaskStatus.FAILED
-                    task.last_error = "missing_user"
-                    task.locked_at = None
-                    await metrics.inc("payments_failed_total")
-                    logger.error("apply_success failed: missing_user payment_id=%s", payment.id)
-                    await self._write_dlq(session, payment, transaction, "missing_user")
-                    return
-
-                if transaction.type == TransactionType.DEPOSIT:
-                    net_amount = float(payment.amount) - float(payment.commission)
-                    user.balance = float(user.balance) + net_amount
-                else:
-                    total_amount = float(payment.amount) + float(payment.commission)
-                    if float(user.balance) < total_amount:
-                        payment.status = PaymentStatus.FAILED
-                        payment.last_error = "insufficient_funds"
-                        payment.locked_at = None
-                        transaction.status = TransactionStatus.FAILED
-                        task.status = PaymentTaskStatus.FAILED
-                        task.last_error = "insufficient_funds"
-                        task.locked_at = None
-                        await metrics.inc("payments_failed_total")
-                        logger.warning("apply_success failed: insufficient_funds payment_id=%s", payment.id)
-                        await self._write_dlq(session, payment, transaction, "insufficient_funds")
-                        return
-                    user.balance = float(user.balance) - total_amount
-
-                payment.status = PaymentStatus.SUCCESS
-                payment.last_error = None
-                payment.locked_at = None
-                payment.next_retry_at = None
-                transaction.status = TransactionStatus.SUCCESS
-
-                task.status = PaymentTaskStatus.DONE
-                task.last_error = None
-                task.locked_at = None
-                task.next_retry_at = None
-
-                await metrics.inc("payments_success_total")
-                logger.info("payment success: payment_id=%s", payment.id)
-
-    async def _apply_failure(self, task_id: int, error: str) -> None:
-        async with AsyncSessionLocal() as session:
-            async with session.begin():
-                task = await session.get(PaymentTaskModel, task_id, with_for_update=True)
-                if not task:
-                    return
-
-                payment = await session.get(PaymentModel, task.payment_id, with_for_update=True)
-                if not payment:
-                    task.status = PaymentTaskStatus.FAILED
-                    task.last_error = "missing_payment"
-                    task.locked_at = None
-                    return
-                payment.attempts = task.attempts
-
-                transaction = await session.execute(
-                    select(TransactionModel)
-                    .where(TransactionModel.payment_id == payment.id)
-                    .with_for_update()
-                )
-                transaction = transaction.scalar_one_or_none()
-
-                if task.attempts >= settings.gateway_max_attempts:
-                    payment.status = PaymentStatus.FAILED
-                    payment.last_error = error
-                    payment.locked_at = None
-                    if transaction:
-                        transaction.status = TransactionStatus.FAILED
-                    task.status = PaymentTaskStatus.FAILED
-                    task.last_error = error
-                    task.locked_at = None
-                    await metrics.inc("payments_failed_total")
-                    logger.error("payment failed: max_attempts payment_id=%s error=%s", payment.id, error)
-                    await self._write_dlq(session, payment, transaction, error)
-                    return
-
-                await metrics.inc("payments_retried_total")
-                logger.warning("payment retry scheduled: payment_id=%s error=%s next_attempt=%s",
-                               payment.id, error, task.attempts + 1)
-                backoff_seconds = settings.gateway_backoff_base_seconds * (2 ** (task.attempts - 1))
-                backoff_seconds = min(backoff_seconds, settings.gateway_backoff_max_seconds)
-                jitter = random.uniform(0, settings.gateway_backoff_jitter_seconds)
-                task.status = PaymentTaskStatus.NEW
-                task.last_error = error
-                task.locked_at = None
-                task.next_retry_at = datetime.now(timezone.utc) + timedelta(seconds=backoff_seconds + jitter)
-                if transaction:
-                    transaction.status = TransactionStatus.PROCESSING
-
-                payment.status = PaymentStatus.NEW
-                payment.last_error = error
-                payment.locked_at = None
-                payment.next_retry_at = task.next_retry_at
-                payment.attempts = task.attempts
-
-    async def _mark_failed_task(self, task_id: int, error: str) -> None:
-        async with AsyncSessionLocal() as session:
-            async with session.begin():
-                task = await session.get(PaymentTaskModel, task_id, with_for_update=True)
-                if not task:
-                    return
-                task.status = PaymentTaskStatus.FAILED
-                task.last_error = error
-                task.locked_at = None
-
-                payment = await session.get(PaymentModel, task.payment_id, with_for_update=True)
-                if payment:
-                    payment.status = PaymentStatus.FAILED
-                    payment.last_error = error
-                    payment.locked_at = None
-                    payment.attempts = task.attempts
-
-                transaction = await session.execute(
-                    select(TransactionModel)
-                    .where(TransactionModel.payment_id == task.payment_id)
-                    .with_for_update()
-                )
-                transaction = transaction.scalar_one_or_none()
-                if transaction:
-                    transaction.status = TransactionStatus.FAILED
-
-                await metrics.inc("payments_failed_total")
-                logger.error("payment failed: payment_id=%s error=%s", task.payment_id, error)
-                if payment:
-                    await self._write_dlq(session, payment, transaction, error)
-
-    async def _write_dlq(
-        self,
-        session: AsyncSession,
-        payment: PaymentModel,
-        transaction: TransactionModel | None,
-        error: str,
-    ) -> None:
-        repo = PaymentDLQRepository(session)
-        existing = await repo.get_by_payment_id(payment.id)
-        if existing:
-            return
-
-        payment_type = transaction.type.value if transaction else "unknown"
-        await repo.create(
-            payment_id=payment.id,
-            user_id=payment.user_id,
-            amount=float(payment.amount),
-            commission=float(payment.commission),
-            payment_type=payment_type,
-            error=error,
-            attempts=payment.attempts,
-        )
-        await metrics.inc("dlq_written_total")
-        logger.warning("dlq written: payment_id=%s error=%s", payment.id, error)
+        await metrics.inc("gateway_non_retryable_errors_total")
+        logger.error("gateway non-retryable error: payment_id=%s error=%s", payload.get("payment_id"), response.error)
+        return TaskOutcome(task_id, OutcomeKind.FAILED, response.error or "gateway_error", lease_version)
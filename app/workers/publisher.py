@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import queue
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+from kombu import Connection, Producer
+
+from app.core.metrics import metrics
+from app.core.settings import settings
+
+logger = logging.getLogger("payment_publisher")
+
+PUBLISH_LATENCY_METRIC = "publish_latency_ms"
+
+
+@dataclass
+class _Item:
+    payment_ids: list[int]
+    enqueued_at: float
+    # Параметры send_task для сообщения: очередь-партиция, счётчик ретраев.
+    options: dict[str, object] = field(default_factory=dict)
+    # Завершается в event loop, когда брокер подтвердил сообщение.
+    confirmed: asyncio.Future | None = None
+
+
+def _resolve(future: asyncio.Future | None) -> None:
+    if future is not None and not future.done():
+        future.set_result(None)
+
+
+class _ConfirmTracker:
+    """Сопоставляет delivery tag канала в режиме confirm с опубликованными сообщениями."""
+
+    def __init__(self) -> None:
+        self.last_tag = 0
+        self.unconfirmed: dict[int, _Item] = {}
+        self.acked: list[_Item] = []
+        self.nacked: list[_Item] = []
+
+    def published(self, item: _Item) -> None:
+        # После confirm.select брокер нумерует публикации в канале подряд, начиная с 1.
+        self.last_tag += 1
+        self.unconfirmed[self.last_tag] = item
+
+    def on_ack(self, delivery_tag: int, multiple: bool) -> None:
+        self.acked.extend(self._pop(delivery_tag, multiple))
+
+    def on_nack(self, delivery_tag: int, multiple: bool) -> None:
+        self.nacked.extend(self._pop(delivery_tag, multiple))
+
+    def _pop(self, delivery_tag: int, multiple: bool) -> list[_Item]:
+        tags = [tag for tag in self.unconfirmed if tag <= delivery_tag] if multiple else [delivery_tag]
+        return [self.unconfirmed.pop(tag) for tag in tags if tag in self.unconfirmed]
+
+
+class PaymentPublisher:
+    """Публикует задачи в брокер из отдельного потока через долгоживущий канал с publisher confirms.
+
+    Запрос только кладёт id в ограниченный буфер (O(1), event loop не блокируется); поток
+    забирает сообщения пачками, публикует их и ждёт подтверждений от брокера на всю пачку сразу.
+    """
+
+    def __init__(
+        self,
+        send: Callable[..., None],
+        buffer_size: int | None = None,
+        confirm_batch_size: int | None = None,
+    ):
+        # send(payment_ids, **options) — отправка одного сообщения через celery_app.send_task.
+        self._send = send
+        self.confirm_batch_size = confirm_batch_size or settings.publisher_confirm_batch_size
+        self._buffer: queue.Queue[_Item | None] = queue.Queue(maxsize=buffer_size or settings.publisher_buffer_size)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        # Опубликованные, но не подтверждённые при обрыве соединения — отправляются повторно.
+        self._retry: list[_Item] = []
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._loop = asyncio.get_running_loop()
+            self._thread = threading.Thread(target=self._run, name="amqp-publisher", daemon=True)
+            self._thread.start()
+            logger.info("publisher started")
+
+    async def stop(self) -> None:
+        if self._thread is None:
+            return
+        thread, self._thread = self._thread, None
+        await asyncio.to_thread(self._buffer.put, None)
+        await asyncio.to_thread(thread.join, settings.publisher_shutdown_timeout_seconds)
+        if thread.is_alive():
+            logger.error("publisher did not stop in time: buffered=%s", self._buffer.qsize())
+        else:
+            logger.info("publisher stopped")
+
+    def publish(self, payment_ids: list[int], **options) -> asyncio.Future:
+        """Ставит id в буфер; возвращённый future завершается после подтверждения брокером."""
+        confirmed = self._loop.create_future()
+        try:
+            self._buffer.put_nowait(_Item(payment_ids, time.perf_counter(), options, confirmed))
+        except queue.Full:
+            # Буфер полон (брокер недоступен или не успевает) — не теряем id и не блокируем loop:
+            # отправляем обычным синхронным путём в пуле потоков.
+            logger.warning("publisher buffer full: payment_ids=%s", payment_ids)
+            self._report(metrics.inc("publisher_buffer_overflow_total"))
+            return self._loop.run_in_executor(None, functools.partial(self._send, payment_ids, **options))
+        return confirmed
+
+    def _report(self, coro) -> None:
+        # Метрики живут в event loop приложения; поток публикатора передаёт их туда.
+        try:
+            asyncio.run_coroutine_threadsafe(coro, self._loop)
+        except RuntimeError:
+            coro.close()
+
+    # --- поток публикатора ------------------------------------------------
+
+    def _run(self) -> None:
+        stopping = False
+        while True:
+            conn = Connection(settings.celery_broker_url)
+            try:
+                with conn:
+                    conn.ensure_connection(max_retries=1)
+                    stopping = self._serve(conn, stopping)
+                return
+            except Exception as exc:
+                # Брокер недоступен или канал закрыт: буфер копится (до publisher_buffer_size), переподключаемся.
+                logger.warning("publisher connection lost: error=%s unconfirmed=%s", exc, len(self._retry))
+                if stopping and not self._retry:
+                    return
+                time.sleep(settings.publisher_reconnect_delay_seconds)
+
+    def _serve(self, conn: Connection, stopping: bool) -> bool:
+        channel = conn.channel()
+        channel.confirm_select()
+        tracker = _ConfirmTracker()
+        channel.events["basic_ack"].add(tracker.on_ack)
+        channel.events["basic_nack"].add(tracker.on_nack)
+        producer = Producer(channel)
+        logger.info("publisher connected: broker=%s", conn.as_uri())
+
+        while True:
+            if self._retry:
+                batch, self._retry = self._retry, []
+            elif stopping:
+                return stopping
+            else:
+                batch, stopping = self._next_batch()
+            if batch:
+                self._publish_batch(conn, producer, tracker, batch)
+
+    def _next_batch(self) -> tuple[list[_Item], bool]:
+        batch: list[_Item] = []
+        item = self._buffer.get()
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= self.confirm_batch_size:
+                return batch, False
+            try:
+                item = self._buffer.get_nowait()
+            except queue.Empty:
+                return batch, False
+        return batch, True
+
+    def _publish_batch(self, conn: Connection, producer: Producer, tracker: _ConfirmTracker, batch: list[_Item]) -> None:
+        try:
+            for item in batch:
+                # retry=False: переподключение делаем сами, иначе kombu молча сменит канал и номера тегов.
+                self._send(item.payment_ids, producer=producer, retry=False, **item.options)
+                tracker.published(item)
+
+            deadline = time.monotonic() + settings.publisher_confirm_timeout_seconds
+            while tracker.unconfirmed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout("publisher confirms timed out")
+                conn.drain_events(timeout=remaining)
+        except BaseException:
+            published = set(map(id, tracker.acked))
+            self._retry = [item for item in batch if id(item) not in published]
+            raise
+        finally:
+            # Подтверждённые до сбоя сообщения тоже отдаём ждущим: иначе outbox relay и retry pump
+            # дождутся таймаута и опубликуют их повторно.
+            self._confirm(tracker)
+
+        if tracker.nacked:
+            logger.warning("publisher nacked by broker: messages=%s", len(tracker.nacked))
+            self._report(metrics.inc("publisher_nacked_total", len(tracker.nacked)))
+            self._retry, tracker.nacked = tracker.nacked, []
+
+    def _confirm(self, tracker: _ConfirmTracker) -> None:
+        acked, tracker.acked = tracker.acked, []
+        now = time.perf_counter()
+        for item in acked:
+            self._loop.call_soon_threadsafe(_resolve, item.confirmed)
+            self._report(metrics.observe(PUBLISH_LATENCY_METRIC, (now - item.enqueued_at) * 1000))
+        self._report(metrics.inc("publisher_published_total", len(acked)))
+
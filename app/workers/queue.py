@@ -1,5 +1,14 @@
-﻿from app.workers.celery_app import celery_app
+﻿from __future__ import annotations
 
+from app.workers.celery_app import PROCESS_PAYMENT_BATCH_TASK, PROCESS_PAYMENT_TASK, celery_app
+from app.workers.publisher import PaymentPublisher
 
-def enqueue_payment(payment_id: int) -> None:
-    celery_app.send_task("payments.process", args=[payment_id])
+
+def send_payments(payment_ids: list[int], **options) -> None:
+    if len(payment_ids) == 1:
+        celery_app.send_task(PROCESS_PAYMENT_TASK, args=[payment_ids[0]], **options)
+    else:
+        celery_app.send_task(PROCESS_PAYMENT_BATCH_TASK, args=[payment_ids], **options)
+
+
+payment_publisher = PaymentPublisher(send=send_payments)
@@ -0,0 +1,172 @@
+"""Отложенные ретраи платежей в БД и pump, который выпускает их в очередь.
+
+    python -m app.workers.retry_scheduler
+
+Вместо self.retry(countdown=...) задачи записывают срок ретрая в payment_retries
+(корзины по RETRY_BUCKET_SECONDS), а сообщение сразу подтверждают. Воркеры не держат
+в памяти ETA-сообщения, сколько бы ретраев ни накопилось за время отказа шлюза,
+а pump отправляет наступившие ретраи не быстрее RETRY_PUMP_RATE_PER_SECOND.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.core.logging import setup_logging
+from app.core.metrics import metrics
+from app.core.retry_budget import retry_budget
+from app.core.settings import settings
+from app.infrastructure.db.session import AsyncSessionLocal, dispose_engine
+from app.infrastructure.repositories.payment_retry import DueRetry, PaymentRetryRepository
+from app.workers.publisher import PaymentPublisher
+
+logger = logging.getLogger("retry_scheduler")
+
+
+def retry_at(countdown: float) -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=countdown)
+
+
+def deferred_retry(payment_id: int, retries: int, queue: str, delay: float | None = None) -> DueRetry:
+    # Отложенный ретрай (бюджетом или локальным отказом клиента шлюза) попыткой не считается:
+    # счётчик retries не растёт.
+    if delay is None:
+        delay = retry_budget.defer_seconds()
+    return DueRetry(payment_id, retries, queue, retry_at(delay))
+
+
+async def schedule_retries(retries: list[DueRetry]) -> None:
+    if not retries:
+        return
+    # Один платёж дважды в INSERT ... ON CONFLICT DO UPDATE не передать — оставляем ранний срок.
+    unique: dict[int, DueRetry] = {}
+    for retry in sorted(retries, key=lambda retry: retry.due_at, reverse=True):
+        unique[retry.payment_id] = retry
+
+    async with AsyncSessionLocal() as session:
+        async with session.begin():
+            await PaymentRetryRepository(session).schedule_many(list(unique.values()), settings.retry_bucket_seconds)
+    await metrics.inc("payment_retries_scheduled_total", len(unique))
+
+
+class RetryPump:
+    """Выпускает наступившие ретраи в брокер с ограниченной скоростью (token bucket)."""
+
+    def __init__(self, publisher: PaymentPublisher | None = None, rate_per_second: float | None = None):
+        if publisher is None:
+            from app.workers.queue import send_payments
+
+            # Свой публикатор: у outbox relay в том же процессе свой жизненный цикл.
+            publisher = PaymentPublisher(send=send_payments)
+        self._publisher = publisher
+        self.rate_per_second = rate_per_second or settings.retry_pump_rate_per_second
+        self._stop_event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._tokens = 0.0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._publisher.start()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        self._stop_event.set()
+        if self._task:
+            await self._task
+            self._task = None
+        await self._publisher.stop()
+
+    async def run(self) -> None:
+        logger.info(
+            "retry pump started: rate_per_second=%s bucket_seconds=%s",
+            self.rate_per_second,
+            settings.retry_bucket_seconds,
+        )
+        last_tick = time.monotonic()
+        delay = settings.retry_pump_interval_seconds
+        while not self._stop_event.is_set():
+            await self._sleep(delay)
+            now = time.monotonic()
+            self._refill(now - last_tick)
+            last_tick = now
+            try:
+                released = await self.pump_once()
+                delay = await self._next_delay(released)
+            except Exception:
+                logger.exception("retry pump pass failed")
+                delay = settings.retry_pump_interval_seconds
+        logger.info("retry pump stopped")
+
+    async def _next_delay(self, released: int) -> float:
+        """Пауза до следующего прохода: до ближайшего срока, если сейчас выпускать нечего."""
+        interval = settings.retry_pump_interval_seconds
+        if released or self._tokens < 1:
+            return interval
+        async with AsyncSessionLocal() as session:
+            next_due = await PaymentRetryRepository(session).next_due_at()
+        if next_due is None:
+            return settings.retry_pump_max_idle_seconds
+        # Ретрай, записанный после запроса, может наступить раньше: спим не дольше max_idle.
+        seconds = (next_due - datetime.now(timezone.utc)).total_seconds()
+        return min(max(seconds, interval), settings.retry_pump_max_idle_seconds)
+
+    def _refill(self, elapsed: float) -> None:
+        # Простой не копит больше одной пачки: после паузы pump не выстреливает всем бэклогом.
+        self._tokens = min(self._tokens + elapsed * self.rate_per_second, settings.retry_pump_batch_size)
+
+    async def pump_once(self) -> int:
+        limit = int(self._tokens)
+        if limit <= 0:
+            return 0
+
+        now = datetime.now(timezone.utc)
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                due = await PaymentRetryRepository(session).claim_due(now, limit, settings.retry_bucket_seconds)
+                if due:
+                    # Строки удаляются только вместе с COMMIT после подтверждения брокером.
+                    await self._publish(due)
+
+        self._tokens -= len(due)
+        if due:
+            await metrics.inc("payment_retries_released_total", len(due))
+            await metrics.set("retry_pump_lag_ms", int((now - due[0].due_at).total_seconds() * 1000))
+            logger.info("retries released: count=%s", len(due))
+        return len(due)
+
+    async def _publish(self, due: list[DueRetry]) -> None:
+        confirmations = [
+            self._publisher.publish([retry.payment_id], queue=retry.queue, retries=retry.retries) for retry in due
+        ]
+        await asyncio.wait_for(
+            asyncio.gather(*confirmations),
+            timeout=settings.retry_pump_publish_timeout_seconds,
+        )
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _main() -> None:
+    pump = RetryPump()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await pump.start()
+    await stop.wait()
+    await pump.stop()
+    await dispose_engine()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(_main())
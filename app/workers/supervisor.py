@@ -0,0 +1,175 @@
+"""Запуск нескольких процессов PaymentWorker под одним супервизором.
+
+    python -m app.workers.supervisor --procs 4
+
+Процессы создаются через fork; engine, пул соединений и HTTP-клиент шлюза каждый
+ребёнок строит заново уже после fork, унаследованные от родителя не используются.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from dataclasses import dataclass
+
+from app.core.logging import setup_logging
+from app.core.settings import settings
+from app.infrastructure.db.session import dispose_engine, rebuild_engine
+from app.infrastructure.payment_gateway.http import PaymentGatewayClient
+
+logger = logging.getLogger("supervisor")
+
+WORKER_ROLE = "worker"
+MAINTENANCE_ROLE = "maintenance"
+
+
+def _build_services(role: str) -> list:
+    # Импорт внутри: модули воркера создают asyncio-примитивы, им место в дочернем процессе.
+    if role == WORKER_ROLE:
+        from app.workers.payment_worker import PaymentWorker
+
+        return [PaymentWorker(gateway=PaymentGatewayClient())]
+
+    from app.workers.outbox_relay import OutboxRelay
+    from app.workers.retry_scheduler import RetryPump
+    from app.workers.task_archiver import PaymentTaskArchiver
+    from app.workers.task_reaper import PaymentTaskReaper
+
+    return [OutboxRelay(), RetryPump(), PaymentTaskReaper(), PaymentTaskArchiver()]
+
+
+async def _serve(role: str) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    services = _build_services(role)
+    try:
+        for service in services:
+            await service.start()
+        await stop.wait()
+    finally:
+        for service in reversed(services):
+            await service.stop()
+        await dispose_engine()
+
+
+def _child_main(role: str) -> None:
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, signal.SIG_DFL)
+    rebuild_engine()
+    asyncio.run(_serve(role))
+
+
+@dataclass
+class _Child:
+    name: str
+    role: str
+    process: multiprocessing.Process | None = None
+    started_at: float = 0.0
+    failures: int = 0
+    restart_at: float = 0.0
+
+
+class Supervisor:
+    def __init__(self, procs: int, with_maintenance: bool = True):
+        self._ctx = multiprocessing.get_context("fork")
+        self._children = [_Child(f"{WORKER_ROLE}-{index}", WORKER_ROLE) for index in range(procs)]
+        if with_maintenance:
+            self._children.append(_Child(MAINTENANCE_ROLE, MAINTENANCE_ROLE))
+        self._stop_event = threading.Event()
+
+    def stop(self, *_: object) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        logger.info("supervisor started: children=%s", len(self._children))
+
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            for child in self._children:
+                if self._stop_event.is_set():
+                    # Остановка уже идёт: вышедших детей не перезапускаем, остальных остановит _shutdown.
+                    break
+                if child.process is None:
+                    if now >= child.restart_at:
+                        self._spawn(child)
+                elif not child.process.is_alive():
+                    self._on_exit(child, now)
+            self._stop_event.wait(settings.supervisor_check_interval_seconds)
+
+        self._shutdown()
+        logger.info("supervisor stopped")
+
+    def _spawn(self, child: _Child) -> None:
+        process = self._ctx.Process(target=_child_main, args=(child.role,), name=child.name)
+        process.start()
+        child.process = process
+        child.started_at = time.monotonic()
+        logger.info("child started: name=%s pid=%s", child.name, process.pid)
+
+    def _on_exit(self, child: _Child, now: float) -> None:
+        process = child.process
+        process.join()
+        child.process = None
+
+        # Сигналы супервизор шлёт только в _shutdown, так что любой выход здесь — неожиданный, даже с кодом 0:
+        # служебный процесс, вышедший «чисто», остановил бы relay, pump и reaper насовсем. Если остановка
+        # пришла всей группе процессов (SIGTERM от systemd), супервизор получит её раньше, чем пройдёт backoff.
+
+        # Процесс, проживший дольше максимального backoff, считаем стабильным — счётчик падений с нуля.
+        if now - child.started_at > settings.supervisor_restart_backoff_max_seconds:
+            child.failures = 0
+        child.failures += 1
+        delay = settings.supervisor_restart_backoff_base_seconds * (2 ** (child.failures - 1))
+        delay = min(delay, settings.supervisor_restart_backoff_max_seconds)
+        child.restart_at = now + delay
+        logger.warning(
+            "child exited: name=%s pid=%s exitcode=%s restart_in=%.1f",
+            child.name,
+            process.pid,
+            process.exitcode,
+            delay,
+        )
+
+    def _shutdown(self) -> None:
+        running = [child.process for child in self._children if child.process and child.process.is_alive()]
+        logger.info("supervisor stopping: running=%s", len(running))
+        for process in running:
+            process.terminate()
+
+        deadline = time.monotonic() + settings.supervisor_shutdown_timeout_seconds
+        for process in running:
+            process.join(max(deadline - time.monotonic(), 0))
+
+        for process in running:
+            if process.is_alive():
+                logger.error("child did not stop in time, killing: name=%s pid=%s", process.name, process.pid)
+                process.kill()
+                process.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procs", type=int, default=settings.supervisor_procs, help="число процессов PaymentWorker")
+    parser.add_argument(
+        "--no-maintenance",
+        action="store_true",
+        help="не запускать служебный процесс (reaper и архиватор payment_tasks)",
+    )
+    args = parser.parse_args()
+
+    setup_logging()
+    Supervisor(procs=args.procs, with_maintenance=not args.no_maintenance).run()
+
+
+if __name__ == "__main__":
+    main()
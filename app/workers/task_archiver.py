@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+import time
+from datetime import datetime, timedelta, timezone
+
+from app.core.logging import setup_logging
+from app.core.metrics import metrics
+from app.core.settings import settings
+from app.infrastructure.db.session import AsyncSessionLocal, dispose_engine
+from app.infrastructure.repositories.payment_outbox import PaymentOutboxRepository
+from app.infrastructure.repositories.payment_task import PaymentTaskRepository
+
+logger = logging.getLogger("task_archiver")
+
+
+class PaymentTaskArchiver:
+    """Убирает завершённые задачи из payment_tasks маленькими пачками, чтобы очередь не пухла от истории."""
+
+    def __init__(self) -> None:
+        self._stop_event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        self._stop_event.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    async def run(self) -> None:
+        logger.info(
+            "task archiver started: mode=%s after_seconds=%s batch_size=%s",
+            settings.task_archive_mode,
+            settings.task_archive_after_seconds,
+            settings.task_archive_batch_size,
+        )
+        while not self._stop_event.is_set():
+            try:
+                await self.archive_once()
+                await self.purge_outbox_once()
+            except Exception:
+                logger.exception("task archive pass failed")
+            await self._sleep(settings.task_archive_interval_seconds)
+        logger.info("task archiver stopped")
+
+    async def archive_once(self) -> int:
+        finished_before = datetime.now(timezone.utc) - timedelta(seconds=settings.task_archive_after_seconds)
+        keep_archive = settings.task_archive_mode == "archive"
+        started = time.perf_counter()
+        total = 0
+
+        while not self._stop_event.is_set():
+            # Каждая пачка — своя короткая транзакция: строки не держатся под lock дольше одного запроса.
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    moved = await PaymentTaskRepository(session).archive_finished(
+                        finished_before=finished_before,
+                        limit=settings.task_archive_batch_size,
+                        keep_archive=keep_archive,
+                    )
+            total += moved
+            if moved < settings.task_archive_batch_size:
+                break
+            await self._sleep(settings.task_archive_batch_pause_seconds)
+
+        if total:
+            elapsed = max(time.perf_counter() - started, 1e-6)
+            rows_per_second = int(total / elapsed)
+            await metrics.inc("payment_tasks_archived_total", total)
+            await metrics.set("payment_tasks_archive_rows_per_second", rows_per_second)
+            logger.info(
+                "tasks archived: mode=%s rows=%s seconds=%.2f rows_per_second=%s",
+                settings.task_archive_mode,
+                total,
+                elapsed,
+                rows_per_second,
+            )
+        return total
+
+    async def purge_outbox_once(self) -> int:
+        # Отправленные записи outbox relay уже не читает; держим их столько же, сколько задачи.
+        sent_before = datetime.now(timezone.utc) - timedelta(seconds=settings.task_archive_after_seconds)
+        total = 0
+        while not self._stop_event.is_set():
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    purged = await PaymentOutboxRepository(session).purge_sent(
+                        sent_before=sent_before,
+                        limit=settings.task_archive_batch_size,
+                    )
+            total += purged
+            if purged < settings.task_archive_batch_size:
+                break
+            await self._sleep(settings.task_archive_batch_pause_seconds)
+
+        if total:
+            await metrics.inc("payment_outbox_purged_total", total)
+            logger.info("outbox purged: rows=%s", total)
+        return total
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _main() -> None:
+    archiver = PaymentTaskArchiver()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await archiver.start()
+    await stop.wait()
+    await archiver.stop()
+    await dispose_engine()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(_main())
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import signal
+from datetime import datetime, timedelta, timezone
+
+from app.core.logging import setup_logging
+from app.core.metrics import metrics
+from app.core.settings import settings
+from app.infrastructure.db.session import AsyncSessionLocal, dispose_engine
+from app.infrastructure.repositories.payment_task import PaymentTaskRepository
+
+logger = logging.getLogger("task_reaper")
+
+
+class PaymentTaskReaper:
+    """Возвращает в очередь задачи, зависшие в PROCESSING дольше worker_processing_timeout_seconds."""
+
+    def __init__(self) -> None:
+        self._stop_event = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        self._stop_event.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    async def run(self) -> None:
+        logger.info(
+            "task reaper started: timeout_seconds=%s interval_seconds=%s",
+            settings.worker_processing_timeout_seconds,
+            settings.task_reaper_interval_seconds,
+        )
+        while not self._stop_event.is_set():
+            try:
+                await self.reap_once()
+            except Exception:
+                logger.exception("task reaper pass failed")
+            await self._sleep(settings.task_reaper_interval_seconds)
+        logger.info("task reaper stopped")
+
+    async def reap_once(self) -> int:
+        stuck_before = datetime.now(timezone.utc) - timedelta(seconds=settings.worker_processing_timeout_seconds)
+        total = 0
+
+        while not self._stop_event.is_set():
+            async with AsyncSessionLocal() as session:
+                async with session.begin():
+                    task_ids = await PaymentTaskRepository(session).reclaim_stuck(
+                        stuck_before=stuck_before,
+                        limit=settings.task_reaper_batch_size,
+                    )
+            if task_ids:
+                await metrics.inc("payment_tasks_reclaimed_total", len(task_ids))
+                logger.warning("stuck tasks reclaimed: count=%s task_ids=%s", len(task_ids), task_ids)
+            total += len(task_ids)
+            if len(task_ids) < settings.task_reaper_batch_size:
+                break
+        return total
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stop_event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _main() -> None:
+    reaper = PaymentTaskReaper()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await reaper.start()
+    await stop.wait()
+    await reaper.stop()
+    await dispose_engine()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(_main())
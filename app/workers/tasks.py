@@ -2,16 +2,32 @@
 
 import asyncio
 import logging
+import math
+from datetime import datetime, timezone
 
 from celery import shared_task
+from celery.signals import celeryd_after_setup, worker_process_init, worker_process_shutdown
 
 from app.core.settings import settings
-from app.workers.celery_app import celery_app
+from app.infrastructure.db.session import dispose_engine, rebuild_engine
+from app.infrastructure.payment_gateway.http import gateway_client
+from app.infrastructure.repositories.payment_retry import DueRetry
+from app.workers.celery_app import (
+    PAYMENT_QUEUE,
+    PROCESS_PAYMENT_BATCH_TASK,
+    PROCESS_PAYMENT_TASK,
+    celery_app,
+    payment_batch_concurrency,
+)
 from app.workers.payment_processor import PaymentProcessor
+from app.workers.retry_scheduler import deferred_retry, retry_at, schedule_retries
 
 logger = logging.getLogger("payments_task")
 
+MAX_RETRIES = 10
+
 _worker_loop: asyncio.AbstractEventLoop | None = None
+_processor: PaymentProcessor | None = None
 
 
 def _run_async(coro):
@@ -22,16 +38,136 @@ def _run_async(coro):
     return _worker_loop.run_until_complete(coro)
 
 
-@celery_app.task(bind=True, name="payments.process", max_retries=10)
+def retry_countdown(retries: int, retry_after: float | None = None) -> float:
+    # exponential backoff based on celery retry count
+    countdown = settings.gateway_backoff_base_seconds * (2 ** retries)
+    countdown = min(countdown, settings.gateway_backoff_max_seconds)
+    # Retry-After шлюза — нижняя граница: раньше него повтор снова получит 429/503.
+    return max(countdown, retry_after or 0.0)
+
+
+def _get_processor() -> PaymentProcessor:
+    global _processor
+    # В пулах без fork (solo, threads) worker_process_init не приходит — создаём при первой задаче.
+    if _processor is None:
+        _processor = PaymentProcessor(gateway=gateway_client)
+    return _processor
+
+
+@celeryd_after_setup.connect
+def _check_partition_concurrency(sender, instance, **_) -> None:
+    # Лимиты пачки (_BATCH_WAVES) и payment_batch_concurrency рассчитаны на то, что партицию
+    # разбирает один процесс; --concurrency N > 1 раздаст её сообщения N дочерним процессам.
+    if settings.payment_partitions > 0 and (instance.concurrency or 1) > 1:
+        logger.warning(
+            "partitioned queues need --concurrency 1, per-user order is not kept: concurrency=%s partitions=%s",
+            instance.concurrency,
+            settings.payment_partitions,
+        )
+
+
+@worker_process_init.connect
+def _open_worker_resources(**_) -> None:
+    # Engine с пулом соединений к БД, пул к шлюзу и процессор создаются один раз
+    # на дочерний процесс, уже после fork, и живут между задачами.
+    global _processor
+    rebuild_engine()
+    _processor = PaymentProcessor(gateway=gateway_client)
+    _run_async(gateway_client.open())
+
+
+@worker_process_shutdown.connect
+def _close_worker_resources(**_) -> None:
+    global _processor
+    _processor = None
+    _run_async(gateway_client.close())
+    _run_async(dispose_engine())
+
+
+def _delivery_queue(task) -> str:
+    # Ретрай возвращается в ту же очередь-партицию, из которой пришло сообщение.
+    return (task.request.delivery_info or {}).get("routing_key") or PAYMENT_QUEUE
+
+
+def _schedule_or_retry(task, retries: list[DueRetry], args: list | None = None) -> None:
+    """Записывает ретраи в payment_retries; если запись не удалась — ретраит сообщение средствами Celery."""
+    try:
+        _run_async(schedule_retries(retries))
+    except Exception as exc:
+        # Сообщение подтверждается и при исключении (acks_late без acks_on_failure_or_timeout=False),
+        # и без строки в payment_retries платёж остался бы NEW без ретрая. ETA-сообщение держит срок.
+        now = datetime.now(timezone.utc)
+        countdown = max((retry.due_at - now).total_seconds() for retry in retries)
+        logger.exception(
+            "retry scheduling failed, falling back to celery retry: payment_ids=%s countdown=%.1f",
+            [retry.payment_id for retry in retries],
+            countdown,
+        )
+        raise task.retry(args=args, exc=exc, countdown=max(countdown, 0.0))
+
+
+@celery_app.task(bind=True, name=PROCESS_PAYMENT_TASK, max_retries=MAX_RETRIES)
 def process_payment(self, payment_id: int) -> str:
-    processor = PaymentProcessor()
+    processor = _get_processor()
     result = _run_async(processor.process(payment_id))
 
     if result == "retry":
-        # exponential backoff based on celery retry count
-        countdown = settings.gateway_backoff_base_seconds * (2 ** self.request.retries)
-        countdown = min(countdown, settings.gateway_backoff_max_seconds)
+        retries = self.request.retries
+        retry_after = processor.pop_retry_after(payment_id)
+        if retries >= MAX_RETRIES:
+            logger.error("max retries exceeded: payment_id=%s retries=%s", payment_id, retries)
+            return result
+        # Не self.retry(countdown): ETA-сообщение висело бы в памяти воркера до срока.
+        countdown = retry_countdown(retries, retry_after)
         logger.warning("celery retry: payment_id=%s countdown=%s", payment_id, countdown)
-        raise self.retry(countdown=countdown)
+        _schedule_or_retry(self, [DueRetry(payment_id, retries + 1, _delivery_queue(self), retry_at(countdown))])
+    elif result == "deferred":
+        delay = processor.pop_retry_after(payment_id)
+        _schedule_or_retry(self, [deferred_retry(payment_id, self.request.retries, _delivery_queue(self), delay)])
 
     return result
+
+
+# Лимиты пачки — лимиты одного платежа, умноженные на число "волн" при ограниченной конкурентности
+# (в партициях пачка разбирается последовательно).
+_BATCH_WAVES = math.ceil(
+    settings.enqueue_batch_max_size
+    / (1 if settings.payment_partitions > 0 else settings.payment_batch_concurrency)
+)
+
+
+@celery_app.task(
+    bind=True,
+    name=PROCESS_PAYMENT_BATCH_TASK,
+    time_limit=settings.celery_task_time_limit_seconds * _BATCH_WAVES,
+    soft_time_limit=settings.celery_task_soft_time_limit_seconds * _BATCH_WAVES,
+)
+def process_payment_batch(self, payment_ids: list[int]) -> dict[str, str]:
+    queue = _delivery_queue(self)
+    processor = _get_processor()
+    results = _run_async(
+        processor.process_many(
+            payment_ids,
+            concurrency=payment_batch_concurrency(queue),
+            time_limit=settings.celery_task_time_limit_seconds,
+        )
+    )
+
+    # Пачку целиком не повторяем: неудачные платежи уходят в ретрай по одному.
+    retries = []
+    for payment_id, result in results.items():
+        if result not in ("retry", "error"):
+            continue
+        countdown = retry_countdown(0, processor.pop_retry_after(payment_id))
+        retries.append(DueRetry(payment_id, 1, queue, retry_at(countdown)))
+        logger.warning("celery retry: payment_id=%s countdown=%s batch_size=%s", payment_id, countdown, len(results))
+    retries += [
+        deferred_retry(payment_id, 0, queue, processor.pop_retry_after(payment_id))
+        for payment_id, result in results.items()
+        if result == "deferred"
+    ]
+    if retries:
+        # Повторяем только платежи, чей ретрай не записался, а не всю пачку.
+        _schedule_or_retry(self, retries, args=[[retry.payment_id for retry in retries]])
+
+    return {str(payment_id): result for payment_id, result in results.items()}
@@ -0,0 +1,88 @@
+"""Накладные расходы на одну Celery-задачу: всё создаётся заново или живёт весь процесс.
+
+Каждая итерация делает то же, что любая задача process_payment помимо бизнес-логики:
+один запрос в БД (SELECT 1) и один HTTP-запрос к шлюзу (HEAD PAYMENT_GATEWAY_URL).
+
+* per-task — как до хуков worker_process_init: новый event loop, новый engine
+  и новый HTTP-клиент на каждую задачу, соединения открываются с нуля;
+* per-process — как сейчас: один loop, engine и пул клиента шлюза на процесс.
+
+    python -m benchmarks.celery_task_overhead --tasks 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+from sqlalchemy import text
+
+from app.core.settings import settings
+from app.infrastructure.db.session import build_engine
+from app.infrastructure.payment_gateway.http import PaymentGatewayClient
+
+
+async def _task_body(engine, http: httpx.AsyncClient) -> None:
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+    await http.head(settings.payment_gateway_url)
+
+
+async def _per_task_once() -> None:
+    engine = build_engine()
+    http = PaymentGatewayClient()._build_client()
+    try:
+        await _task_body(engine, http)
+    finally:
+        await http.aclose()
+        await engine.dispose()
+
+
+def run_per_task(tasks: int) -> list[float]:
+    samples = []
+    for _ in range(tasks):
+        started = time.perf_counter()
+        asyncio.run(_per_task_once())
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def run_per_process(tasks: int) -> list[float]:
+    loop = asyncio.new_event_loop()
+    engine = build_engine()
+    http = PaymentGatewayClient()._build_client()
+    samples = []
+    try:
+        for _ in range(tasks):
+            started = time.perf_counter()
+            loop.run_until_complete(_task_body(engine, http))
+            samples.append(time.perf_counter() - started)
+    finally:
+        loop.run_until_complete(http.aclose())
+        loop.run_until_complete(engine.dispose())
+        loop.close()
+    return samples
+
+
+def _report(name: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    p50 = statistics.median(samples) * 1000
+    p95 = samples[max(int(len(samples) * 0.95) - 1, 0)] * 1000
+    print(f"{name:>12} | {p50:>8.2f} | {p95:>8.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'mode':>12} | {'p50, ms':>8} | {'p95, ms':>8}")
+    _report("per-task", run_per_task(args.tasks))
+    _report("per-process", run_per_process(args.tasks))
+
+
+if __name__ == "__main__":
+    main()
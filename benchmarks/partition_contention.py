@@ -0,0 +1,116 @@
+"""Конкуренция за строку users при скошенном распределении платежей по пользователям.
+
+Каждый "платёж" повторяет критическую секцию PaymentProcessor._apply_success:
+SELECT ... FOR UPDATE строки пользователя, работа под блокировкой (--hold-ms),
+UPDATE баланса и COMMIT. Пользователь платежа выбирается по закону Ципфа
+(--skew 0 — равномерно, чем больше, тем "горячее" первые аккаунты).
+
+* shared — как одна очередь payments: любой из --workers берёт любой платёж,
+  и платежи горячего пользователя ждут друг друга на блокировке;
+* partitioned — как очереди payments.p{N} (PAYMENT_PARTITIONS=--workers):
+  воркер владеет партицией user_id % N и обрабатывает её платежи по одному.
+
+Пользователи создаются на время прогона и удаляются в конце:
+
+    python -m benchmarks.partition_contention --users 1000 --payments 5000 --workers 16 --skew 1.2
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+
+from app.infrastructure.db.session import build_engine
+
+SEED_USERS = text("INSERT INTO users (balance) SELECT 0 FROM generate_series(1, :count) RETURNING id")
+LOCK_USER = text("SELECT balance FROM users WHERE id = :user_id FOR UPDATE")
+CREDIT_USER = text("UPDATE users SET balance = balance + 1 WHERE id = :user_id")
+DROP_USERS = text("DELETE FROM users WHERE id = ANY(:ids)")
+
+
+def skewed_users(user_ids: list[int], payments: int, skew: float, seed: int) -> list[int]:
+    weights = [1 / (rank ** skew) for rank in range(1, len(user_ids) + 1)]
+    return random.Random(seed).choices(user_ids, weights=weights, k=payments)
+
+
+async def _pay(engine, user_id: int, hold: float) -> float:
+    async with engine.begin() as conn:
+        started = time.perf_counter()
+        await conn.execute(LOCK_USER, {"user_id": user_id})
+        waited = time.perf_counter() - started
+        await asyncio.sleep(hold)
+        await conn.execute(CREDIT_USER, {"user_id": user_id})
+    return waited
+
+
+async def run_shared(engine, payments: list[int], workers: int, hold: float) -> list[float]:
+    backlog: asyncio.Queue[int] = asyncio.Queue()
+    for user_id in payments:
+        backlog.put_nowait(user_id)
+    waits: list[float] = []
+
+    async def worker() -> None:
+        while not backlog.empty():
+            waits.append(await _pay(engine, backlog.get_nowait(), hold))
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return waits
+
+
+async def run_partitioned(engine, payments: list[int], workers: int, hold: float) -> list[float]:
+    partitions: list[list[int]] = [[] for _ in range(workers)]
+    for user_id in payments:
+        partitions[user_id % workers].append(user_id)
+    waits: list[float] = []
+
+    async def worker(partition: list[int]) -> None:
+        for user_id in partition:
+            waits.append(await _pay(engine, user_id, hold))
+
+    await asyncio.gather(*(worker(partition) for partition in partitions))
+    return waits
+
+
+def _report(name: str, elapsed: float, waits: list[float]) -> None:
+    waits = sorted(waits)
+    p50 = statistics.median(waits) * 1000
+    p95 = waits[max(int(len(waits) * 0.95) - 1, 0)] * 1000
+    print(f"{name:>12} | {elapsed:>8.2f} | {len(waits) / elapsed:>10.0f} | {p50:>12.2f} | {p95:>12.2f}")
+
+
+async def run(users: int, payments: int, workers: int, skew: float, hold_ms: float, seed: int) -> None:
+    engine = build_engine()
+    async with engine.begin() as conn:
+        user_ids = list((await conn.execute(SEED_USERS, {"count": users})).scalars().all())
+    try:
+        plan = skewed_users(user_ids, payments, skew, seed)
+        print(f"{'mode':>12} | {'seconds':>8} | {'payments/s':>10} | {'lock p50, ms':>12} | {'lock p95, ms':>12}")
+        for name, runner in (("shared", run_shared), ("partitioned", run_partitioned)):
+            started = time.perf_counter()
+            waits = await runner(engine, plan, workers, hold_ms / 1000)
+            _report(name, time.perf_counter() - started, waits)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(DROP_USERS, {"ids": user_ids})
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--payments", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=16, help="воркеров в shared и партиций в partitioned")
+    parser.add_argument("--skew", type=float, default=1.2, help="показатель распределения Ципфа")
+    parser.add_argument("--hold-ms", type=float, default=2.0, help="время работы под блокировкой строки users")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.payments, args.workers, args.skew, args.hold_ms, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Латентность резервирования задач в зависимости от размера истории payment_tasks.
+
+Наполняет payment_tasks завершёнными (done) строками в несколько шагов и на каждом
+шаге замеряет PaymentTaskRepository.reserve_batch при небольшом живом backlog'е.
+Всё выполняется в одной транзакции, которая в конце откатывается, поэтому скрипт
+можно запускать на dev-базе с применёнными миграциями:
+
+    python -m benchmarks.reservation_latency --sizes 10000 100000 1000000
+
+Без индексов из миграции 0004 время растёт вместе с историей (seq scan),
+с ними — остаётся примерно постоянным.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+from app.core.settings import settings
+from app.infrastructure.db.session import AsyncSessionLocal, engine
+from app.infrastructure.repositories.payment_task import PaymentTaskRepository
+
+SEED_USER = text("INSERT INTO users (balance) VALUES (0) RETURNING id")
+
+SEED_TASKS = text(
+    """
+    WITH new_payments AS (
+        INSERT INTO payments (user_id, amount, commission, status, attempts)
+        SELECT :user_id, 10, 0.2, CAST(:payment_status AS paymentstatus), 1
+        FROM generate_series(1, :count)
+        RETURNING id
+    )
+    INSERT INTO payment_tasks (payment_id, status, attempts, created_at)
+    SELECT id, CAST(:task_status AS paymenttaskstatus), 1, now() - interval '1 day'
+    FROM new_payments
+    """
+)
+
+
+async def _reserve_once(session, batch_size: int) -> float:
+    now = datetime.now(timezone.utc)
+    savepoint = await session.begin_nested()
+    started = time.perf_counter()
+    await PaymentTaskRepository(session).reserve_batch(now=now, limit=batch_size)
+    elapsed = time.perf_counter() - started
+    await savepoint.rollback()
+    return elapsed
+
+
+async def run(sizes: list[int], backlog: int, batch_size: int, repeats: int) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.begin()
+        try:
+            user_id = (await session.execute(SEED_USER)).scalar_one()
+            await session.execute(
+                SEED_TASKS,
+                {"user_id": user_id, "count": backlog, "payment_status": "new", "task_status": "new"},
+            )
+
+            seeded = 0
+            print(f"{'history rows':>14} | {'p50, ms':>8} | {'p95, ms':>8}")
+            for size in sorted(sizes):
+                await session.execute(
+                    SEED_TASKS,
+                    {"user_id": user_id, "count": size - seeded, "payment_status": "success", "task_status": "done"},
+                )
+                seeded = size
+                await session.execute(text("ANALYZE payment_tasks"))
+
+                samples = sorted([await _reserve_once(session, batch_size) for _ in range(repeats)])
+                p50 = statistics.median(samples) * 1000
+                p95 = samples[max(int(len(samples) * 0.95) - 1, 0)] * 1000
+                print(f"{size:>14} | {p50:>8.2f} | {p95:>8.2f}")
+        finally:
+            await session.rollback()
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--backlog", type=int, default=100, help="живых задач в статусе new")
+    parser.add_argument("--batch-size", type=int, default=settings.worker_batch_size)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.sizes, args.backlog, args.batch_size, args.repeats))
+
+
+if __name__ == "__main__":
+    main()
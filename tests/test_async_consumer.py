@@ -0,0 +1,229 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.workers.async_consumer import AsyncPaymentConsumer
+from app.workers.celery_app import assigned_partitions, payment_queues
+from app.workers.payment_processor import PaymentProcessor
+
+
+class FakeMessage:
+    def __init__(self, payment_id, retries=0, task="payments.process", queue="payments"):
+        self.headers = {"task": task, "id": "t-1", "retries": retries}
+        self.delivery_info = {"routing_key": queue}
+        self.body = ([payment_id], {}, {})
+        self.acked = False
+        self.rejected = False
+        self.requeued = False
+
+    def ack(self):
+        self.acked = True
+
+    def reject(self):
+        self.rejected = True
+
+    def requeue(self):
+        self.requeued = True
+
+
+class FakeProcessor(PaymentProcessor):
+    def __init__(self, result="success", delay=0.0, results=None):
+        super().__init__()
+        self.result = result
+        self.results = results or {}
+        self.delay = delay
+        self.processed = []
+
+    async def process(self, payment_id):
+        await asyncio.sleep(self.delay)
+        self.processed.append(payment_id)
+        result = self.results.get(payment_id, self.result)
+        if isinstance(result, Exception):
+            raise result
+        if isinstance(result, tuple):
+            result, self._retry_after[payment_id] = result
+        return result
+
+
+async def _deliver(consumer, message):
+    consumer._loop = asyncio.get_running_loop()
+    consumer._on_message(message.body, message)
+    # Обработчик запланирован через run_coroutine_threadsafe — даём ему отработать.
+    settlement = await asyncio.to_thread(consumer._settlements.get, True, 1)
+    consumer._settle(settlement)
+
+
+@pytest.mark.asyncio
+async def test_consumer_acks_only_after_processing():
+    processor = FakeProcessor(delay=0.01)
+    consumer = AsyncPaymentConsumer(concurrency=5, processor=processor)
+    message = FakeMessage(7)
+
+    consumer._loop = asyncio.get_running_loop()
+    consumer._on_message(message.body, message)
+    assert not message.acked
+
+    consumer._settle(await asyncio.to_thread(consumer._settlements.get, True, 1))
+    assert processor.processed == [7]
+    assert message.acked
+    assert consumer._unacked == 0
+
+
+def _collect_retries(monkeypatch, scheduled, fail=False):
+    async def schedule_retries(retries):
+        if fail:
+            raise RuntimeError("db down")
+        scheduled.extend(retries)
+
+    monkeypatch.setattr("app.workers.async_consumer.schedule_retries", schedule_retries)
+
+
+@pytest.mark.asyncio
+async def test_consumer_schedules_retry_and_time_limit(monkeypatch):
+    scheduled = []
+    _collect_retries(monkeypatch, scheduled)
+    monkeypatch.setattr("app.workers.async_consumer.settings.celery_task_time_limit_seconds", 0.01)
+
+    await _deliver(AsyncPaymentConsumer(processor=FakeProcessor(result="retry")), FakeMessage(1, retries=2))
+    slow = FakeMessage(2)
+    await _deliver(AsyncPaymentConsumer(processor=FakeProcessor(delay=1)), slow)
+
+    assert [(retry.payment_id, retry.retries) for retry in scheduled] == [(1, 3), (2, 1)]
+    assert slow.acked
+
+
+@pytest.mark.asyncio
+async def test_consumer_batch_retries_only_failed_members(monkeypatch):
+    scheduled = []
+    _collect_retries(monkeypatch, scheduled)
+    processor = FakeProcessor(results={2: "retry", 3: RuntimeError("db down")})
+    message = FakeMessage([1, 2, 3, 4], task="payments.process_batch", queue="payments.p1")
+
+    await _deliver(AsyncPaymentConsumer(processor=processor), message)
+
+    assert sorted(processor.processed) == [1, 2, 3, 4]
+    assert [(retry.payment_id, retry.retries, retry.queue) for retry in scheduled] == [
+        (2, 1, "payments.p1"),
+        (3, 1, "payments.p1"),
+    ]
+    assert message.acked
+
+
+@pytest.mark.asyncio
+async def test_consumer_retry_and_deferral_honor_retry_after(monkeypatch):
+    scheduled = []
+    _collect_retries(monkeypatch, scheduled)
+    processor = FakeProcessor(results={1: ("retry", 600), 2: ("deferred", 120)})
+    message = FakeMessage([1, 2], task="payments.process_batch")
+    before = datetime.now(timezone.utc)
+
+    await _deliver(AsyncPaymentConsumer(processor=processor), message)
+
+    due = {retry.payment_id: (retry.retries, retry.due_at - before) for retry in scheduled}
+    assert due[1][0] == 1 and due[1][1] >= timedelta(seconds=600)
+    # Отсрочка попыткой не считается.
+    assert due[2][0] == 0 and timedelta(seconds=120) <= due[2][1] < timedelta(seconds=130)
+
+
+@pytest.mark.asyncio
+async def test_consumer_requeues_when_retry_cannot_be_scheduled(monkeypatch):
+    _collect_retries(monkeypatch, [], fail=True)
+    message = FakeMessage(1)
+
+    await _deliver(AsyncPaymentConsumer(processor=FakeProcessor(result="retry")), message)
+
+    assert message.requeued
+    assert not message.acked
+
+
+@pytest.mark.asyncio
+async def test_consumer_postpones_future_eta_instead_of_sleeping(monkeypatch):
+    scheduled = []
+    _collect_retries(monkeypatch, scheduled)
+    processor = FakeProcessor()
+    eta = datetime.now(timezone.utc) + timedelta(hours=1)
+    message = FakeMessage([1, 2], retries=3, task="payments.process_batch", queue="payments.p2")
+    message.headers["eta"] = eta.isoformat()
+
+    # Далёкий ETA не держит слот: сообщение подтверждается сразу, срок уходит в payment_retries.
+    await asyncio.wait_for(_deliver(AsyncPaymentConsumer(processor=processor), message), timeout=2)
+
+    assert processor.processed == []
+    assert [(retry.payment_id, retry.retries, retry.queue, retry.due_at) for retry in scheduled] == [
+        (1, 3, "payments.p2", eta),
+        (2, 3, "payments.p2", eta),
+    ]
+    assert message.acked
+
+
+@pytest.mark.asyncio
+async def test_consumer_requeues_message_when_handling_crashes():
+    class CrashingProcessor(FakeProcessor):
+        async def process_many(self, payment_ids, concurrency, time_limit=None):
+            raise RuntimeError("db down")
+
+    consumer = AsyncPaymentConsumer(processor=CrashingProcessor())
+    message = FakeMessage(1)
+
+    await _deliver(consumer, message)
+
+    assert message.requeued
+    assert consumer._unacked == 0
+
+
+def test_consumer_rejects_malformed_message():
+    consumer = AsyncPaymentConsumer(processor=FakeProcessor())
+    for body in ("garbage", ([], {}, {}), (["not-an-id"], {}, {})):
+        message = FakeMessage(1)
+        consumer._on_message(body, message)
+
+        assert message.rejected
+    assert consumer._unacked == 0
+
+
+def test_consumer_rejects_unknown_task():
+    message = FakeMessage(1, task="payments.other")
+    AsyncPaymentConsumer(processor=FakeProcessor())._on_message(message.body, message)
+
+    assert message.rejected
+    assert not message.acked
+
+
+@pytest.mark.asyncio
+async def test_consumer_serializes_messages_of_one_partition():
+    active = []
+    overlaps = []
+
+    class TrackingProcessor(FakeProcessor):
+        async def process(self, payment_id):
+            active.append(payment_id)
+            overlaps.append(len(active))
+            await asyncio.sleep(0.01)
+            active.remove(payment_id)
+            return "success"
+
+    consumer = AsyncPaymentConsumer(concurrency=10, processor=TrackingProcessor())
+    consumer._loop = asyncio.get_running_loop()
+    messages = [FakeMessage(payment_id, queue="payments.p0") for payment_id in (1, 2, 3)]
+    messages.append(FakeMessage([4, 5], task="payments.process_batch", queue="payments.p0"))
+    for message in messages:
+        consumer._on_message(message.body, message)
+    for _ in messages:
+        consumer._settle(await asyncio.to_thread(consumer._settlements.get, True, 1))
+
+    assert max(overlaps) == 1
+    assert all(message.acked for message in messages)
+
+
+def test_consumer_subscribes_only_to_assigned_partitions(monkeypatch):
+    monkeypatch.setattr("app.workers.celery_app.settings.payment_partitions", 4)
+    queues = {queue.name: queue for queue in payment_queues()}
+    monkeypatch.setattr("app.workers.async_consumer.celery_app.amqp.queues", queues, raising=False)
+
+    partitions = assigned_partitions(1, 2)
+    consumer = AsyncPaymentConsumer(processor=FakeProcessor(), partitions=partitions)
+
+    assert partitions == [1, 3]
+    assert [queue.name for queue in consumer._task_queues()] == ["payments", "payments.p1", "payments.p3"]
+    assert len(AsyncPaymentConsumer(processor=FakeProcessor())._task_queues()) == 5
@@ -0,0 +1,179 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+from app.infrastructure.db.models.payment import PaymentStatus
+from app.infrastructure.db.models.payment_task import PaymentTaskStatus
+from app.infrastructure.db.models.transaction import TransactionStatus, TransactionType
+from app.infrastructure.repositories.payment_finalization import LockedTaskRow
+from app.workers.finalizer import OutcomeKind, PaymentFinalizer, TaskOutcome
+
+
+class FakeSession:
+    def begin(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class FakeFinalizationRepo:
+    def __init__(self, rows: list[LockedTaskRow], balances: dict[int, Decimal]):
+        self.rows = {row.task_id: row for row in rows}
+        self.balances = balances
+        self.written = {}
+
+    def __call__(self, session):
+        return self
+
+    async def lock_tasks(self, task_ids):
+        return {task_id: self.rows[task_id] for task_id in task_ids if task_id in self.rows}
+
+    async def lock_balances(self, user_ids):
+        return {user_id: self.balances[user_id] for user_id in user_ids if user_id in self.balances}
+
+    async def update_balances(self, balances):
+        self.written["balances"] = balances
+
+    async def update_payments(self, changes):
+        self.written["payments"] = {change.payment_id: change for change in changes}
+
+    async def update_transactions(self, statuses):
+        self.written["transactions"] = statuses
+
+    async def update_tasks(self, changes):
+        self.written["tasks"] = {change.task_id: change for change in changes}
+
+    async def insert_dlq(self, records):
+        self.written["dlq"] = records
+        return [record["payment_id"] for record in records]
+
+
+def _row(task_id, user_id, amount, kind, attempts=1, lease_version=1, task_status=PaymentTaskStatus.PROCESSING):
+    return LockedTaskRow(
+        task_id=task_id,
+        task_status=task_status,
+        task_attempts=attempts,
+        lease_version=lease_version,
+        payment_id=task_id * 10,
+        payment_status=PaymentStatus.PROCESSING,
+        payment_attempts=attempts,
+        user_id=user_id,
+        amount=Decimal(amount),
+        commission=Decimal("0"),
+        transaction_type=kind,
+    )
+
+
+@pytest.fixture
+def fake_repo(monkeypatch):
+    def install(rows, balances):
+        repo = FakeFinalizationRepo(rows, balances)
+        monkeypatch.setattr("app.workers.finalizer.AsyncSessionLocal", FakeSession)
+        monkeypatch.setattr("app.workers.finalizer.PaymentFinalizationRepository", repo)
+        return repo
+
+    return install
+
+
+@pytest.mark.asyncio
+async def test_finalizer_checks_funds_per_row_within_batch(fake_repo):
+    repo = fake_repo(
+        [_row(1, 7, "60", TransactionType.WITHDRAW), _row(2, 7, "60", TransactionType.WITHDRAW)],
+        {7: Decimal("100")},
+    )
+
+    await PaymentFinalizer().apply([TaskOutcome(1, OutcomeKind.SUCCESS), TaskOutcome(2, OutcomeKind.SUCCESS)])
+
+    assert repo.written["balances"] == {7: Decimal("40")}
+    assert repo.written["payments"][10].status == PaymentStatus.SUCCESS
+    assert repo.written["payments"][20].status == PaymentStatus.FAILED
+    assert repo.written["payments"][20].last_error == "insufficient_funds"
+    assert repo.written["transactions"] == {10: TransactionStatus.SUCCESS, 20: TransactionStatus.FAILED}
+    assert [record["payment_id"] for record in repo.written["dlq"]] == [20]
+
+
+@pytest.mark.asyncio
+async def test_finalizer_missing_user_and_transaction_go_to_dlq(fake_repo):
+    repo = fake_repo(
+        [_row(1, 7, "10", TransactionType.DEPOSIT), _row(2, 8, "10", None)],
+        {8: Decimal("0")},
+    )
+
+    await PaymentFinalizer().apply([TaskOutcome(1, OutcomeKind.SUCCESS), TaskOutcome(2, OutcomeKind.SUCCESS)])
+
+    assert repo.written["balances"] == {}
+    assert repo.written["payments"][10].last_error == "missing_user"
+    assert repo.written["payments"][20].last_error == "missing_transaction"
+    assert repo.written["tasks"][1].status == PaymentTaskStatus.FAILED
+    assert repo.written["tasks"][2].status == PaymentTaskStatus.FAILED
+    assert len(repo.written["dlq"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_finalizer_retry_rearms_task_until_max_attempts(fake_repo, monkeypatch):
+    monkeypatch.setattr("app.workers.finalizer.settings.gateway_max_attempts", 2)
+    repo = fake_repo(
+        [_row(1, 7, "10", TransactionType.DEPOSIT, attempts=1), _row(2, 7, "10", TransactionType.DEPOSIT, attempts=2)],
+        {7: Decimal("0")},
+    )
+
+    await PaymentFinalizer().apply([
+        TaskOutcome(1, OutcomeKind.RETRY, "timeout"),
+        TaskOutcome(2, OutcomeKind.RETRY, "timeout"),
+    ])
+
+    assert repo.written["tasks"][1].status == PaymentTaskStatus.NEW
+    assert repo.written["tasks"][1].next_retry_at is not None
+    assert repo.written["tasks"][2].status == PaymentTaskStatus.FAILED
+    assert [record["payment_id"] for record in repo.written["dlq"]] == [20]
+
+
+@pytest.mark.asyncio
+async def test_finalizer_retry_waits_for_gateway_retry_after(fake_repo):
+    repo = fake_repo([_row(1, 7, "10", TransactionType.DEPOSIT)], {7: Decimal("0")})
+    before = datetime.now(timezone.utc)
+
+    await PaymentFinalizer().apply([TaskOutcome(1, OutcomeKind.RETRY, "gateway_error_429", retry_after=600)])
+
+    assert repo.written["tasks"][1].next_retry_at >= before + timedelta(seconds=600)
+
+
+@pytest.mark.asyncio
+async def test_finalizer_deferral_returns_attempt_even_at_max_attempts(fake_repo, monkeypatch):
+    monkeypatch.setattr("app.workers.finalizer.settings.gateway_max_attempts", 2)
+    repo = fake_repo([_row(1, 7, "10", TransactionType.DEPOSIT, attempts=2)], {7: Decimal("0")})
+
+    await PaymentFinalizer().apply([TaskOutcome(1, OutcomeKind.DEFERRED, "circuit_open", retry_after=30)])
+
+    task = repo.written["tasks"][1]
+    assert (task.status, task.attempts) == (PaymentTaskStatus.NEW, 1)
+    assert repo.written["payments"][10].attempts == 1
+    assert task.next_retry_at == repo.written["payments"][10].next_retry_at
+    assert repo.written["dlq"] == []
+
+
+@pytest.mark.asyncio
+async def test_finalizer_skips_outcomes_with_stale_lease(fake_repo):
+    repo = fake_repo(
+        [
+            _row(1, 7, "10", TransactionType.DEPOSIT, lease_version=2),
+            _row(2, 7, "10", TransactionType.DEPOSIT, lease_version=1, task_status=PaymentTaskStatus.NEW),
+            _row(3, 7, "10", TransactionType.DEPOSIT, lease_version=1),
+        ],
+        {7: Decimal("0")},
+    )
+
+    await PaymentFinalizer().apply([
+        TaskOutcome(1, OutcomeKind.SUCCESS, lease_version=1),
+        TaskOutcome(2, OutcomeKind.SUCCESS, lease_version=1),
+        TaskOutcome(3, OutcomeKind.SUCCESS, lease_version=1),
+    ])
+
+    assert repo.written["balances"] == {7: Decimal("10")}
+    assert list(repo.written["tasks"]) == [3]
+    assert list(repo.written["payments"]) == [30]
@@ -1,12 +1,24 @@
-﻿import httpx
+﻿import asyncio
+import os
+
+import httpx
 import pytest
 
 from app.infrastructure.payment_gateway.http import PaymentGatewayClient
+from app.infrastructure.payment_gateway.rate_limit import GatewayRateLimiter, parse_retry_after
+from app.infrastructure.payment_gateway.resilience import AdaptiveConcurrencyLimit, CircuitBreaker, CircuitState
+
+
+@pytest.fixture(autouse=True)
+def _process_local_rate_limit(monkeypatch):
+    # Тесты не делят bucket хоста ни друг с другом, ни с соседними прогонами.
+    monkeypatch.setattr("app.infrastructure.payment_gateway.rate_limit.settings.gateway_rate_limit_state_path", "")
 
 
 class DummyResponse:
-    def __init__(self, status_code: int):
+    def __init__(self, status_code: int, headers: dict[str, str] | None = None):
         self.status_code = status_code
+        self.headers = headers or {}
 
 
 class DummyClient:
@@ -24,11 +36,14 @@ class DummyClient:
             raise self._response
         return self._response
 
+    async def aclose(self):
+        return None
+
 
 @pytest.mark.asyncio
 async def test_gateway_success(monkeypatch):
     client = PaymentGatewayClient(base_url="http://example")
-    monkeypatch.setattr("httpx.AsyncClient", lambda timeout=None: DummyClient(DummyResponse(200)))
+    monkeypatch.setattr("httpx.AsyncClient", lambda **kwargs: DummyClient(DummyResponse(200)))
 
     result = await client.charge({"x": 1})
     assert result.success is True
@@ -37,7 +52,7 @@ async def test_gateway_success(monkeypatch):
 @pytest.mark.asyncio
 async def test_gateway_retryable_error(monkeypatch):
     client = PaymentGatewayClient(base_url="http://example")
-    monkeypatch.setattr("httpx.AsyncClient", lambda timeout=None: DummyClient(DummyResponse(503)))
+    monkeypatch.setattr("httpx.AsyncClient", lambda **kwargs: DummyClient(DummyResponse(503)))
 
     result = await client.charge({"x": 1})
     assert result.success is False
@@ -47,7 +62,7 @@ async def test_gateway_retryable_error(monkeypatch):
 @pytest.mark.asyncio
 async def test_gateway_non_retryable_error(monkeypatch):
     client = PaymentGatewayClient(base_url="http://example")
-    monkeypatch.setattr("httpx.AsyncClient", lambda timeout=None: DummyClient(DummyResponse(400)))
+    monkeypatch.setattr("httpx.AsyncClient", lambda **kwargs: DummyClient(DummyResponse(400)))
 
     result = await client.charge({"x": 1})
     assert result.success is False
@@ -57,8 +72,189 @@ async def test_gateway_non_retryable_error(monkeypatch):
 @pytest.mark.asyncio
 async def test_gateway_timeout(monkeypatch):
     client = PaymentGatewayClient(base_url="http://example")
-    monkeypatch.setattr("httpx.AsyncClient", lambda timeout=None: DummyClient(httpx.TimeoutException("timeout")))
+    monkeypatch.setattr("httpx.AsyncClient", lambda **kwargs: DummyClient(httpx.TimeoutException("timeout")))
 
     result = await client.charge({"x": 1})
     assert result.success is False
     assert result.error == "timeout"
+
+
+@pytest.mark.asyncio
+async def test_gateway_reuses_pooled_client(monkeypatch):
+    created: list[DummyClient] = []
+
+    def factory(**kwargs):
+        created.append(DummyClient(DummyResponse(200)))
+        return created[-1]
+
+    client = PaymentGatewayClient(base_url="http://example")
+    monkeypatch.setattr("httpx.AsyncClient", factory)
+
+    await client.charge({"x": 1})
+    await client.charge({"x": 2})
+    assert len(created) == 1
+
+    await client.close()
+    assert client.is_open is False
+
+    await client.charge({"x": 3})
+    assert len(created) == 2
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_circuit_breaker_opens_and_recovers_through_half_open():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window_seconds=10, min_calls=4, failure_rate=0.5, open_seconds=5, half_open_calls=2, clock=clock)
+
+    for failed in (False, True, False, True):
+        assert breaker.allow()
+        breaker.record(failed)
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow()
+
+    clock.now += 5
+    assert breaker.allow()
+    assert breaker.allow()
+    # Пробных вызовов не больше half_open_calls.
+    assert not breaker.allow()
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_gateway_short_circuits_when_open(monkeypatch):
+    calls: list[str] = []
+
+    class CountingClient(DummyClient):
+        async def post(self, url, json):
+            calls.append(url)
+            return await super().post(url, json)
+
+    client = PaymentGatewayClient(base_url="http://example")
+    client.breaker = CircuitBreaker(min_calls=2, failure_rate=0.5, open_seconds=60)
+    monkeypatch.setattr("httpx.AsyncClient", lambda **kwargs: CountingClient(httpx.TimeoutException("timeout")))
+
+    await client.charge({"x": 1})
+    await client.charge({"x": 1})
+    result = await client.charge({"x": 1})
+
+    assert len(calls) == 2
+    assert result.error == "circuit_open"
+    # Отсечённый вызов не тратит попытку и возвращается в очередь к закрытию цепи.
+    assert result.attempted is False
+    assert 0 < result.retry_after <= 60
+
+
+@pytest.mark.asyncio
+async def test_gateway_fails_fast_when_open_and_limit_is_saturated():
+    client = PaymentGatewayClient(base_url="http://example", timeout_seconds=5)
+    client.breaker = CircuitBreaker(min_calls=1, failure_rate=0.5, open_seconds=60)
+    client.breaker.record(True)
+    client.limit = AdaptiveConcurrencyLimit(initial=1, min_limit=1, max_limit=1)
+    assert await client.limit.acquire(0)
+
+    # Цепь разомкнута: отказ без ожидания места в лимите, занятый слот не трогаем.
+    result = await asyncio.wait_for(client.charge({"x": 1}), timeout=1)
+
+    assert result.error == "circuit_open"
+    assert client.limit.in_flight == 1
+    await client.close()
+
+
+def test_concurrency_limit_grows_when_healthy_and_backs_off_on_failure():
+    clock = FakeClock()
+    limit = AdaptiveConcurrencyLimit(
+        initial=10, min_limit=1, max_limit=20, latency_target_seconds=0.5, backoff_ratio=0.5, clock=clock
+    )
+    limit.in_flight = 10
+
+    # Аддитивный рост: примерно +1 за limit успешных вызовов.
+    for _ in range(12):
+        limit.record(0.1, failed=False)
+    assert limit.limit == 11
+
+    clock.now = 100
+    limit.record(0.1, failed=True)
+    assert limit.limit == 5
+    # Остальные сбои той же пачки начались до снижения и лимит больше не режут.
+    for _ in range(5):
+        limit.record(0.1, failed=True)
+    assert limit.limit == 5
+    clock.now = 101
+    limit.record(0.9, failed=False)
+    assert limit.limit == 2
+
+
+def test_circuit_breaker_honors_explicit_zero_settings():
+    breaker = CircuitBreaker(min_calls=0, failure_rate=0.0, open_seconds=0)
+
+    assert (breaker.min_calls, breaker.failure_rate, breaker.open_seconds) == (0, 0.0, 0)
+
+
+def test_parse_retry_after_seconds_and_http_date():
+    now = 1_800_000_000.0
+
+    assert parse_retry_after("7", now) == 7
+    assert parse_retry_after("Fri, 15 Jan 2027 08:00:10 GMT", 1_800_000_000.0) == 10
+    assert parse_retry_after("soon", now) is None
+
+
+def test_rate_limiter_state_is_shared_between_processes(tmp_path):
+    clock = FakeClock()
+    clock.now = 1000.0
+    path = str(tmp_path / "rate-limit")
+    first = GatewayRateLimiter(rate_per_second=10, burst=2, path=path, clock=clock)
+    second = GatewayRateLimiter(rate_per_second=10, burst=2, path=path, clock=clock)
+
+    assert first.acquire() == 0
+    assert second.acquire() == 0
+    # Квота общая: третий вызов из любого процесса ждёт токен.
+    assert first.acquire() == pytest.approx(0.1)
+
+    assert second.observe(429, {"retry-after": "3"}) == 3
+    assert first.acquire() == pytest.approx(3)
+    first.close()
+    second.close()
+
+
+def test_rate_limiter_reopens_state_file_after_fork(tmp_path):
+    limiter = GatewayRateLimiter(rate_per_second=10, burst=2, path=str(tmp_path / "rate-limit"))
+    assert limiter.acquire() == 0
+    inherited_fd = limiter._shared._fd
+
+    pid = os.fork()
+    if pid == 0:
+        # Ребёнок не должен держать flock на описании файла родителя.
+        forgot = limiter._shared._fd is None
+        reopened = forgot and limiter.acquire() == 0 and limiter._shared._fd is not None
+        os._exit(0 if reopened else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert limiter._shared._fd == inherited_fd
+    limiter.close()
+
+
+@pytest.mark.asyncio
+async def test_gateway_honors_retry_after(monkeypatch, tmp_path):
+    client = PaymentGatewayClient(base_url="http://example")
+    client.rate_limiter = GatewayRateLimiter(path=str(tmp_path / "rate-limit"))
+    monkeypatch.setattr("httpx.AsyncClient", lambda **kwargs: DummyClient(DummyResponse(429, {"retry-after": "30"})))
+
+    first = await client.charge({"x": 1})
+    second = await client.charge({"x": 1})
+
+    assert first.raw_status == 429
+    assert first.retry_after == 30
+    assert second.error == "rate_limited"
+    assert second.attempted is False
+    assert second.retry_after == pytest.approx(30, abs=1)
+    await client.close()
@@ -0,0 +1,24 @@
+from app.infrastructure.idempotency_filter import BloomFilter, IdempotencyKeyFilter
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives():
+    bloom = BloomFilter(capacity=1000, false_positive_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"in-{i}".encode())
+
+    assert all(f"in-{i}".encode() in bloom for i in range(1000))
+    false_positives = sum(f"out-{i}".encode() in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_filter_answers_maybe_until_warmed_and_rotates_generations():
+    key_filter = IdempotencyKeyFilter(capacity=100, false_positive_rate=0.01)
+    assert key_filter.might_contain(1, "never-added")
+
+    key_filter.ready = True
+    for i in range(250):
+        key_filter.add(1, f"key-{i}")
+
+    # Текущее и предыдущее поколения помнят последние ключи, самое старое поколение выброшено.
+    assert all(key_filter.might_contain(1, f"key-{i}") for i in range(100, 250))
+    assert sum(key_filter.might_contain(1, f"key-{i}") for i in range(100)) < 10
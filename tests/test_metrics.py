@@ -1,4 +1,6 @@
-﻿import pytest
+﻿import asyncio
+
+import pytest
 
 from app.core.metrics import MetricsRegistry
 
@@ -15,3 +17,47 @@ async def test_metrics_inc_and_snapshot():
 
     assert snapshot["a"] == 3
     assert snapshot["b"] == 5
+
+
+@pytest.mark.asyncio
+async def test_metrics_timer_accumulates_microseconds():
+    registry = MetricsRegistry()
+
+    async with registry.timer("db_time_us_total"):
+        await asyncio.sleep(0.01)
+    async with registry.timer("db_time_us_total"):
+        pass
+
+    snapshot = await registry.snapshot()
+
+    assert snapshot["db_time_us_total"] >= 10_000
+
+
+@pytest.mark.asyncio
+async def test_metrics_set_overwrites_gauge():
+    registry = MetricsRegistry()
+
+    await registry.set("rows_per_second", 10)
+    await registry.set("rows_per_second", 4)
+
+    snapshot = await registry.snapshot()
+
+    assert snapshot["rows_per_second"] == 4
+
+
+@pytest.mark.asyncio
+async def test_metrics_observe_fills_cumulative_buckets():
+    registry = MetricsRegistry()
+
+    await registry.observe("publish_latency_ms", 3, buckets=(1, 5, 10))
+    await registry.observe("publish_latency_ms", 7, buckets=(1, 5, 10))
+    await registry.observe("publish_latency_ms", 50, buckets=(1, 5, 10))
+
+    snapshot = await registry.snapshot()
+
+    assert "publish_latency_ms_le_1" not in snapshot
+    assert snapshot["publish_latency_ms_le_5"] == 1
+    assert snapshot["publish_latency_ms_le_10"] == 2
+    assert snapshot["publish_latency_ms_le_inf"] == 3
+    assert snapshot["publish_latency_ms_count"] == 3
+    assert snapshot["publish_latency_ms_sum"] == 60
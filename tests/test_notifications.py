@@ -0,0 +1,31 @@
+import asyncpg
+import pytest
+
+from app.infrastructure.db.notifications import PgNotificationListener
+
+
+class FailingListenConnection:
+    def __init__(self):
+        self.closed = False
+
+    async def add_listener(self, channel, callback):
+        raise asyncpg.PostgresError("listen denied")
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_listener_closes_connection_when_listen_fails(monkeypatch):
+    conn = FailingListenConnection()
+
+    async def connect(dsn):
+        return conn
+
+    monkeypatch.setattr("app.infrastructure.db.notifications.asyncpg.connect", connect)
+    listener = PgNotificationListener("payment_tasks", lambda: None, database_url="postgresql+asyncpg://x:y@localhost/z")
+
+    assert await listener.connect() is False
+    # Открытое соединение без LISTEN не должно утекать на каждой попытке переподключения.
+    assert conn.closed
+    assert not listener.connected
@@ -0,0 +1,60 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from app.infrastructure.repositories.payment_outbox import OutboxRecord
+from app.workers.outbox_relay import OutboxRelay
+
+
+class FakePublisher:
+    def __init__(self, confirm=True):
+        self.confirm = confirm
+        self.published = []
+
+    def publish(self, payment_ids, queue=None):
+        self.published.append((queue, payment_ids))
+        future = asyncio.get_running_loop().create_future()
+        if self.confirm:
+            future.set_result(None)
+        return future
+
+
+def _records(*payment_ids, users=None):
+    now = datetime.now(timezone.utc)
+    users = users or {}
+    return [
+        OutboxRecord(id=payment_id, payment_id=payment_id, user_id=users.get(payment_id, 1), created_at=now)
+        for payment_id in payment_ids
+    ]
+
+
+@pytest.mark.asyncio
+async def test_relay_publishes_outbox_batch_in_chunks(monkeypatch):
+    monkeypatch.setattr("app.workers.outbox_relay.settings.enqueue_batch_max_size", 2)
+    publisher = FakePublisher()
+
+    await OutboxRelay(backend="celery", publisher=publisher)._publish(_records(1, 2, 3, 4, 5))
+
+    assert publisher.published == [("payments", [1, 2]), ("payments", [3, 4]), ("payments", [5])]
+
+
+@pytest.mark.asyncio
+async def test_relay_routes_payments_to_user_partitions(monkeypatch):
+    monkeypatch.setattr("app.workers.celery_app.settings.payment_partitions", 4)
+    publisher = FakePublisher()
+    # payment_id -> user_id: платежи пользователей 1 и 5 попадают в одну партицию.
+    records = _records(10, 11, 12, 13, users={10: 1, 11: 2, 12: 5, 13: 1})
+
+    await OutboxRelay(backend="celery", publisher=publisher)._publish(records)
+
+    assert publisher.published == [("payments.p1", [10, 12, 13]), ("payments.p2", [11])]
+
+
+@pytest.mark.asyncio
+async def test_relay_fails_batch_without_broker_confirms(monkeypatch):
+    monkeypatch.setattr("app.workers.outbox_relay.settings.outbox_relay_publish_timeout_seconds", 0.01)
+
+    # Исключение откатывает транзакцию relay: записи outbox остаются неотправленными.
+    with pytest.raises(asyncio.TimeoutError):
+        await OutboxRelay(backend="celery", publisher=FakePublisher(confirm=False))._publish(_records(1))
@@ -0,0 +1,48 @@
+import pytest
+
+from app.core.retry_budget import RetryBudget
+from app.infrastructure.db.models.payment import PaymentStatus
+from app.infrastructure.repositories.payment_task import PaymentTaskRepository, ReservedPaymentTask
+from app.workers.payment_worker import PaymentWorker
+
+
+def _task(task_id, attempts, credited):
+    return ReservedPaymentTask(task_id, task_id, attempts, 1, PaymentStatus.NEW, None, credited, 7, 10, 0, None)
+
+
+@pytest.mark.asyncio
+async def test_retry_budget_is_credited_once_per_payment(monkeypatch):
+    budget = RetryBudget(ratio=1, min_per_second=0, max_tokens=10, path="")
+    while budget.try_spend():
+        pass
+    monkeypatch.setattr("app.workers.payment_worker.retry_budget", budget)
+
+    # Отложенная задача снова резервируется с attempts=1, но бюджет уже пополняла — это ретрай.
+    deferred = await PaymentWorker._apply_retry_budget([_task(1, 1, False), _task(2, 1, True), _task(3, 2, True)])
+
+    assert [task.task_id for task in deferred] == [3]
+    assert budget.tokens == 0
+
+
+@pytest.mark.asyncio
+async def test_close_finalized_fails_tasks_in_one_statement():
+    class RecordingSession:
+        def __init__(self):
+            self.statements = []
+
+        async def execute(self, stmt):
+            self.statements.append(stmt)
+
+    def finalized(task_id, status, error):
+        return ReservedPaymentTask(task_id, task_id, 1, 1, status, error, True, 7, 10, 0, None)
+
+    session = RecordingSession()
+    await PaymentTaskRepository(session).close_finalized([
+        finalized(1, PaymentStatus.FAILED, "insufficient_funds"),
+        finalized(2, PaymentStatus.FAILED, "gateway_error_400"),
+        finalized(3, PaymentStatus.FAILED, None),
+        finalized(4, PaymentStatus.SUCCESS, None),
+    ])
+
+    # Одна пачка — один UPDATE для done и один для failed, а не запрос на каждую задачу.
+    assert len(session.statements) == 2
@@ -0,0 +1,70 @@
+import json
+
+import httpx
+import pytest
+
+from app.api.v1.ndjson import MAX_LINE_BYTES, iter_lines
+from app.application.dto.payment import PaymentBatchResultDTO
+
+
+async def _chunks(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+class FakeSessionFactory:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+class FakeBatchUseCase:
+    def __init__(self):
+        self.calls: list[int] = []
+
+    async def execute(self, items):
+        self.calls.append(len(items))
+        return [PaymentBatchResultDTO(user_id=item.user_id, status="processing", payment_id=item.user_id) for item in items]
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_splits_across_chunks_and_drops_long_lines():
+    long_line = b"x" * (MAX_LINE_BYTES + 1)
+    lines = [line async for line in iter_lines(_chunks(b'{"a":', b"1}\n\n", long_line, b"\n", b"tail"))]
+
+    assert lines == [b'{"a":1}', b"", None, b"tail"]
+
+
+@pytest.mark.asyncio
+async def test_batch_stream_commits_in_chunks_and_reports_each_line(monkeypatch):
+    from app.main import app
+
+    use_case = FakeBatchUseCase()
+    monkeypatch.setattr("app.api.v1.payments.AsyncSessionLocal", FakeSessionFactory)
+    monkeypatch.setattr("app.api.v1.payments.build_payments_batch_use_case", lambda session: use_case)
+    monkeypatch.setattr("app.api.v1.payments.settings.payments_stream_chunk_size", 2)
+
+    body = b"\n".join(
+        [
+            b'{"type": "deposit", "user_id": 1, "amount": 10}',
+            b'{"type": "withdraw", "user_id": 2, "amount": -1}',
+            b'{"type": "withdraw", "user_id": 3, "amount": 5}',
+            b'{"type": "deposit", "user_id": 4, "amount": 1}',
+        ]
+    )
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post(
+            "/api/v1/payments/batch/stream",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [(r["line"], r["status"]) for r in results] == [(2, "failed"), (1, "processing"), (3, "processing"), (4, "processing")]
+    assert results[0]["error"].startswith("invalid_line: amount")
+    assert use_case.calls == [2, 1]
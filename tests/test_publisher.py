@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from app.workers.publisher import PaymentPublisher, _ConfirmTracker, _Item
+
+
+def test_confirm_tracker_handles_multiple_ack_and_nack():
+    tracker = _ConfirmTracker()
+    items = [_Item([payment_id], 0.0) for payment_id in (1, 2, 3, 4)]
+    for item in items:
+        tracker.published(item)
+
+    tracker.on_ack(2, multiple=True)
+    tracker.on_nack(3, multiple=False)
+    tracker.on_ack(4, multiple=False)
+
+    assert tracker.acked == [items[0], items[1], items[3]]
+    assert tracker.nacked == [items[2]]
+    assert tracker.unconfirmed == {}
+
+
+@pytest.mark.asyncio
+async def test_publisher_falls_back_to_executor_when_buffer_full():
+    sent = []
+    publisher = PaymentPublisher(send=sent.append, buffer_size=1)
+    publisher._loop = asyncio.get_running_loop()
+
+    publisher.publish([1])
+    await asyncio.wait_for(publisher.publish([2, 3]), timeout=1)
+
+    assert publisher._buffer.qsize() == 1
+    assert sent == [[2, 3]]
+
+
+@pytest.mark.asyncio
+async def test_publisher_resolves_acked_items_when_batch_fails():
+    class FailingConnection:
+        def __init__(self, tracker):
+            self.tracker = tracker
+
+        def drain_events(self, timeout):
+            # Брокер успел подтвердить первое сообщение, затем соединение оборвалось.
+            self.tracker.on_ack(1, multiple=False)
+            raise ConnectionError("connection reset")
+
+    loop = asyncio.get_running_loop()
+    publisher = PaymentPublisher(send=lambda payment_ids, **options: None)
+    publisher._loop = loop
+    batch = [_Item([payment_id], 0.0, confirmed=loop.create_future()) for payment_id in (1, 2)]
+    tracker = _ConfirmTracker()
+
+    with pytest.raises(ConnectionError):
+        await asyncio.to_thread(publisher._publish_batch, FailingConnection(tracker), None, tracker, batch)
+    await asyncio.sleep(0)
+
+    assert batch[0].confirmed.done()
+    assert not batch[1].confirmed.done()
+    assert publisher._retry == [batch[1]]
@@ -0,0 +1,57 @@
+from app.core.retry_budget import RetryBudget
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_retries_are_capped_by_ratio_of_first_attempts():
+    budget = RetryBudget(ratio=0.1, min_per_second=0, max_tokens=10, path="", clock=FakeClock())
+    while budget.try_spend():
+        pass
+
+    for _ in range(20):
+        budget.deposit()
+
+    assert budget.try_spend()
+    assert budget.try_spend()
+    # 20 первых попыток при ratio=0.1 дают ровно два ретрая.
+    assert not budget.try_spend()
+
+
+def test_budget_refills_slowly_without_traffic():
+    clock = FakeClock()
+    budget = RetryBudget(ratio=0.1, min_per_second=1, max_tokens=5, path="", clock=clock)
+    while budget.try_spend():
+        pass
+
+    clock.now += 2.5
+    assert budget.try_spend()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+    clock.now += 60
+    assert budget.tokens == 5
+
+
+def test_budget_is_shared_between_processes(tmp_path):
+    clock = FakeClock()
+    path = str(tmp_path / "retry-budget")
+    first = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2, path=path, clock=clock)
+    second = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2, path=path, clock=clock)
+
+    assert first.try_spend()
+    assert second.try_spend()
+    # Бюджет один на хост: второй процесс не получает свои max_tokens.
+    assert not first.try_spend()
+
+    first.deposit()
+    second.deposit()
+    assert first.tokens == 1
+    assert second.try_spend()
+    first.close()
+    second.close()
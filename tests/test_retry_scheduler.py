@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.infrastructure.repositories.payment_retry import due_bucket
+from app.workers.retry_scheduler import RetryPump
+
+
+def test_due_bucket_floors_to_bucket_start():
+    due_at = datetime(2026, 3, 28, 12, 0, 7, 500000, tzinfo=timezone.utc)
+
+    assert due_bucket(due_at, 5) == datetime(2026, 3, 28, 12, 0, 5, tzinfo=timezone.utc)
+    assert due_bucket(due_at, 60) == datetime(2026, 3, 28, 12, 0, tzinfo=timezone.utc)
+
+
+def test_retry_pump_rate_is_capped_by_batch_size(monkeypatch):
+    monkeypatch.setattr("app.workers.retry_scheduler.settings.retry_pump_batch_size", 50)
+    pump = RetryPump(publisher=object(), rate_per_second=100)
+
+    pump._refill(0.25)
+    assert pump._tokens == 25
+    # После долгого простоя pump не выпускает весь накопленный бэклог разом.
+    pump._refill(60)
+    assert pump._tokens == 50
+
+
+class _Session:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.mark.asyncio
+async def test_retry_pump_sleeps_until_next_due_retry(monkeypatch):
+    next_due = {"at": None}
+
+    class FakeRetryRepo:
+        def __init__(self, session):
+            pass
+
+        async def next_due_at(self):
+            return next_due["at"]
+
+    monkeypatch.setattr("app.workers.retry_scheduler.AsyncSessionLocal", _Session)
+    monkeypatch.setattr("app.workers.retry_scheduler.PaymentRetryRepository", FakeRetryRepo)
+    monkeypatch.setattr("app.workers.retry_scheduler.settings.retry_pump_interval_seconds", 0.5)
+    monkeypatch.setattr("app.workers.retry_scheduler.settings.retry_pump_max_idle_seconds", 5.0)
+    pump = RetryPump(publisher=object(), rate_per_second=100)
+    pump._tokens = 10
+
+    # Пока ретраи выпускаются, pump проходит с обычным интервалом.
+    assert await pump._next_delay(released=3) == 0.5
+    assert await pump._next_delay(released=0) == 5.0
+
+    next_due["at"] = datetime.now(timezone.utc) + timedelta(seconds=2)
+    assert await pump._next_delay(released=0) == pytest.approx(2, abs=0.1)
+    next_due["at"] = datetime.now(timezone.utc) + timedelta(minutes=10)
+    assert await pump._next_delay(released=0) == 5.0
+    next_due["at"] = datetime.now(timezone.utc) - timedelta(seconds=1)
+    assert await pump._next_delay(released=0) == 0.5
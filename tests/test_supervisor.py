@@ -0,0 +1,51 @@
+from app.workers.supervisor import Supervisor
+
+
+class FakeProcess:
+    def __init__(self, exitcode):
+        self.exitcode = exitcode
+        self.pid = 42
+
+    def join(self, timeout=None):
+        pass
+
+    def is_alive(self):
+        return False
+
+
+def test_supervisor_restarts_children_that_exit_on_their_own():
+    supervisor = Supervisor(procs=3, with_maintenance=False)
+    clean, crashed, signalled = supervisor._children
+    clean.process = FakeProcess(0)
+    crashed.process = FakeProcess(1)
+    signalled.process = FakeProcess(-9)
+
+    for child in supervisor._children:
+        supervisor._on_exit(child, now=100.0)
+
+    # Даже чистый выход без команды супервизора — повод перезапустить: иначе служебный процесс пропал бы насовсем.
+    for child in supervisor._children:
+        assert child.process is None
+        assert child.failures == 1 and child.restart_at > 100.0
+
+
+def test_supervisor_does_not_restart_children_during_shutdown(monkeypatch):
+    supervisor = Supervisor(procs=2, with_maintenance=False)
+    running, exited = supervisor._children
+
+    class StoppingProcess(FakeProcess):
+        def is_alive(self):
+            # SIGTERM пришёл супервизору, пока он обходил детей.
+            supervisor.stop()
+            return True
+
+    running.process = StoppingProcess(None)
+    monkeypatch.setattr("app.workers.supervisor.signal.signal", lambda *args: None)
+    monkeypatch.setattr(supervisor, "_shutdown", lambda: None)
+    spawned = []
+    monkeypatch.setattr(supervisor, "_spawn", spawned.append)
+
+    supervisor.run()
+
+    assert exited.process is None
+    assert spawned == []
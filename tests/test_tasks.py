@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.infrastructure.repositories.payment_retry import DueRetry
+from app.workers.tasks import _schedule_or_retry
+
+
+class CeleryRetry(Exception):
+    pass
+
+
+class FakeTask:
+    def __init__(self):
+        self.retry_kwargs = None
+
+    def retry(self, **kwargs):
+        self.retry_kwargs = kwargs
+        return CeleryRetry()
+
+
+def test_failed_retry_scheduling_falls_back_to_celery_retry(monkeypatch):
+    async def schedule_retries(retries):
+        raise ConnectionError("db is down")
+
+    monkeypatch.setattr("app.workers.tasks.schedule_retries", schedule_retries)
+    task = FakeTask()
+    now = datetime.now(timezone.utc)
+    retries = [DueRetry(1, 1, "payments", now + timedelta(seconds=5)), DueRetry(2, 1, "payments", now + timedelta(seconds=30))]
+
+    # Без записи в payment_retries ретрай не должен потеряться вместе с подтверждённым сообщением.
+    with pytest.raises(CeleryRetry):
+        _schedule_or_retry(task, retries, args=[[1, 2]])
+
+    assert task.retry_kwargs["args"] == [[1, 2]]
+    assert task.retry_kwargs["countdown"] == pytest.approx(30, abs=1)
+    assert isinstance(task.retry_kwargs["exc"], ConnectionError)
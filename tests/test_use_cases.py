@@ -1,11 +1,15 @@
 ﻿import pytest
 
-from app.application.dto.payment import DepositDTO, WithdrawDTO
+from app.application.dto.payment import DepositDTO, PaymentBatchItemDTO, WithdrawDTO
+from app.application.use_cases.create_payments_batch import CreatePaymentsBatchUseCase
 from app.application.use_cases.deposit_balance import DepositBalanceUseCase
 from app.application.use_cases.withdraw_balance import WithdrawBalanceUseCase
 from app.domain.entities.user import User
-from app.domain.exceptions import UserInsufficientFundsError
+from app.domain.exceptions import PaymentIdempotencyConflictError, UserInsufficientFundsError, UserNotFoundError
 from app.infrastructure.db.models.payment import PaymentStatus
+from app.infrastructure.db.models.transaction import TransactionStatus, TransactionType
+from app.infrastructure.idempotency_filter import IdempotencyKeyFilter
+from app.infrastructure.repositories.payment_creation import CreatedPayment, PaymentCreationRepository
 
 
 class FakeSession:
@@ -46,13 +50,18 @@ class FakeUserRepo:
     async def save(self, user: User) -> None:
         self.users[user.id] = user
 
+    async def get_many(self, user_ids: list[int]):
+        return {user_id: self.users[user_id] for user_id in user_ids if user_id in self.users}
+
 
 class FakePaymentRepo:
     def __init__(self):
         self._payments: list[FakePayment] = []
         self._id = 1
 
-    async def create(self, user_id: int, amount: float, commission: float, status: PaymentStatus, idempotency_key=None):
+    async def create(
+        self, user_id: int, amount: float, commission: float, status: PaymentStatus, idempotency_key=None, last_error=None
+    ):
         payment = FakePayment(
             id=self._id,
             user_id=user_id,
@@ -65,12 +74,41 @@ class FakePaymentRepo:
         self._payments.append(payment)
         return payment
 
+    async def create_or_get(
+        self, user_id: int, amount: float, commission: float, status: PaymentStatus, idempotency_key=None, last_error=None
+    ):
+        existing = await self.get_by_idempotency_key(user_id, idempotency_key) if idempotency_key else None
+        if existing:
+            return existing.id, False
+        payment = await self.create(user_id, amount, commission, status, idempotency_key, last_error)
+        payment.last_error = last_error
+        return payment.id, True
+
     async def get_by_idempotency_key(self, user_id: int, key: str):
         for p in self._payments:
             if p.user_id == user_id and p.idempotency_key == key:
                 return p
         return None
 
+    async def create_many(self, rows: list[dict]):
+        ids = []
+        for row in rows:
+            payment_id, created = await self.create_or_get(**row)
+            ids.append(payment_id if created else None)
+        return ids
+
+    async def fail_many(self, payment_ids, last_error):
+        for p in self._payments:
+            if p.id in payment_ids:
+                p.status, p.last_error = PaymentStatus.FAILED, last_error
+
+    async def get_by_idempotency_keys(self, keys):
+        return {
+            (p.user_id, p.idempotency_key): (p.id, p.status)
+            for p in self._payments
+            if (p.user_id, p.idempotency_key) in keys
+        }
+
 
 class FakeTransactionRepo:
     def __init__(self):
@@ -80,67 +118,98 @@ class FakeTransactionRepo:
         self.items.append(kwargs)
         return kwargs
 
+    async def create_many(self, rows: list[dict]):
+        self.items.extend(rows)
 
-class TaskCollector:
+
+class FakeOutboxRepo:
     def __init__(self):
         self.items: list[int] = []
 
-    def enqueue(self, payment_id: int):
+    async def add(self, payment_id: int):
         self.items.append(payment_id)
 
+    async def add_many(self, payment_ids: list[int]):
+        self.items.extend(payment_ids)
+
+
+class FakeCreationRepo:
+    """Создание одним запросом поверх фейковых репозиториев: пользователь, ключ, баланс, очередь."""
+
+    def __init__(self, users: dict[int, User], payment_repo, transaction_repo, outbox):
+        self.users = users
+        self.payment_repo = payment_repo
+        self.transaction_repo = transaction_repo
+        self.outbox = outbox
+
+    async def create(self, user_id: int, amount: float, commission: float, type: TransactionType, idempotency_key=None):
+        user = self.users.get(user_id)
+        if user is None:
+            return None
+        insufficient = type == TransactionType.WITHDRAW and user.balance < round(amount + commission, 2)
+        status = PaymentStatus.FAILED if insufficient else PaymentStatus.NEW
+        payment_id, created = await self.payment_repo.create_or_get(
+            user_id, amount, commission, status, idempotency_key, "insufficient_funds" if insufficient else None
+        )
+        if not created:
+            existing = await self.payment_repo.get_by_idempotency_key(user_id, idempotency_key)
+            return CreatedPayment(payment_id, existing.status, created=False)
+        await self.transaction_repo.create(
+            user_id=user_id,
+            payment_id=payment_id,
+            amount=amount,
+            commission=commission,
+            type=type,
+            status=TransactionStatus.FAILED if insufficient else TransactionStatus.PROCESSING,
+        )
+        if not insufficient:
+            await self.outbox.add(payment_id)
+        return CreatedPayment(payment_id, status, created=True)
+
 
 @pytest.mark.asyncio
-async def test_deposit_creates_payment_transaction_and_task(monkeypatch):
+async def test_deposit_creates_payment_transaction_and_outbox_record():
     session = FakeSession()
     users = {1: User(id=1, balance=0)}
-    user_repo = FakeUserRepo(users)
     payment_repo = FakePaymentRepo()
     transaction_repo = FakeTransactionRepo()
-    tasks = TaskCollector()
-
-    monkeypatch.setattr("app.application.use_cases.deposit_balance.enqueue_payment", tasks.enqueue)
+    outbox = FakeOutboxRepo()
 
-    use_case = DepositBalanceUseCase(user_repo, payment_repo, transaction_repo, session)
+    use_case = DepositBalanceUseCase(FakeCreationRepo(users, payment_repo, transaction_repo, outbox), session)
     payment_id = await use_case.execute(DepositDTO(user_id=1, amount=100, idempotency_key="k1"))
 
     assert payment_id == 1
     assert len(payment_repo._payments) == 1
     assert len(transaction_repo.items) == 1
-    assert tasks.items == [1]
+    assert outbox.items == [1]
 
 
 @pytest.mark.asyncio
-async def test_deposit_idempotency_returns_existing(monkeypatch):
+async def test_deposit_idempotency_returns_existing():
     session = FakeSession()
     users = {1: User(id=1, balance=0)}
-    user_repo = FakeUserRepo(users)
     payment_repo = FakePaymentRepo()
     transaction_repo = FakeTransactionRepo()
-    tasks = TaskCollector()
+    outbox = FakeOutboxRepo()
 
-    monkeypatch.setattr("app.application.use_cases.deposit_balance.enqueue_payment", tasks.enqueue)
-
-    use_case = DepositBalanceUseCase(user_repo, payment_repo, transaction_repo, session)
+    use_case = DepositBalanceUseCase(FakeCreationRepo(users, payment_repo, transaction_repo, outbox), session)
     first_id = await use_case.execute(DepositDTO(user_id=1, amount=100, idempotency_key="k1"))
     second_id = await use_case.execute(DepositDTO(user_id=1, amount=100, idempotency_key="k1"))
 
     assert first_id == second_id
     assert len(payment_repo._payments) == 1
-    assert tasks.items == [1]
+    assert outbox.items == [1]
 
 
 @pytest.mark.asyncio
-async def test_withdraw_insufficient_funds_creates_failed_payment(monkeypatch):
+async def test_withdraw_insufficient_funds_creates_failed_payment():
     session = FakeSession()
     users = {1: User(id=1, balance=0)}
-    user_repo = FakeUserRepo(users)
     payment_repo = FakePaymentRepo()
     transaction_repo = FakeTransactionRepo()
-    tasks = TaskCollector()
-
-    monkeypatch.setattr("app.application.use_cases.withdraw_balance.enqueue_payment", tasks.enqueue)
+    outbox = FakeOutboxRepo()
 
-    use_case = WithdrawBalanceUseCase(user_repo, payment_repo, transaction_repo, session)
+    use_case = WithdrawBalanceUseCase(FakeCreationRepo(users, payment_repo, transaction_repo, outbox), session)
 
     with pytest.raises(UserInsufficientFundsError):
         await use_case.execute(WithdrawDTO(user_id=1, amount=10, idempotency_key="k2"))
@@ -148,23 +217,198 @@ async def test_withdraw_insufficient_funds_creates_failed_payment(monkeypatch):
     assert len(payment_repo._payments) == 1
     assert payment_repo._payments[0].status == PaymentStatus.FAILED
     assert len(transaction_repo.items) == 1
-    assert tasks.items == []
+    assert outbox.items == []
 
 
 @pytest.mark.asyncio
-async def test_withdraw_success_enqueues_task(monkeypatch):
+async def test_withdraw_success_writes_outbox_record():
     session = FakeSession()
     users = {1: User(id=1, balance=100)}
-    user_repo = FakeUserRepo(users)
     payment_repo = FakePaymentRepo()
     transaction_repo = FakeTransactionRepo()
-    tasks = TaskCollector()
+    outbox = FakeOutboxRepo()
 
-    monkeypatch.setattr("app.application.use_cases.withdraw_balance.enqueue_payment", tasks.enqueue)
-
-    use_case = WithdrawBalanceUseCase(user_repo, payment_repo, transaction_repo, session)
+    use_case = WithdrawBalanceUseCase(FakeCreationRepo(users, payment_repo, transaction_repo, outbox), session)
     payment_id = await use_case.execute(WithdrawDTO(user_id=1, amount=10, idempotency_key="k3"))
 
     assert payment_id == 1
     assert len(payment_repo._payments) == 1
-    assert tasks.items == [1]
+    assert outbox.items == [1]
+
+
+@pytest.mark.asyncio
+async def test_withdraw_unknown_user_raises_not_found():
+    payment_repo = FakePaymentRepo()
+    outbox = FakeOutboxRepo()
+    use_case = WithdrawBalanceUseCase(FakeCreationRepo({}, payment_repo, FakeTransactionRepo(), outbox), FakeSession())
+
+    with pytest.raises(UserNotFoundError):
+        await use_case.execute(WithdrawDTO(user_id=1, amount=10))
+
+    assert payment_repo._payments == []
+    assert outbox.items == []
+
+
+class FakeResult:
+    def __init__(self, row):
+        self.row = row
+
+    def one_or_none(self):
+        return self.row
+
+
+class ScriptedSession:
+    def __init__(self, *rows):
+        self.rows = list(rows)
+
+    async def execute(self, stmt):
+        return FakeResult(self.rows.pop(0))
+
+
+@pytest.mark.asyncio
+async def test_creation_repo_conflict_with_invisible_payment_is_409():
+    # Вставка упёрлась в ключ (id платежа NULL), а повторный SELECT строки не нашёл.
+    repo = PaymentCreationRepository(ScriptedSession((1, None, None), None), queue_backend="db")
+
+    with pytest.raises(PaymentIdempotencyConflictError):
+        await repo.create(1, 10, 0.2, TransactionType.DEPOSIT, idempotency_key="k1")
+
+
+@pytest.mark.asyncio
+async def test_payments_batch_returns_per_item_results():
+    session = FakeSession()
+    users = {1: User(id=1, balance=100), 2: User(id=2, balance=0)}
+    payment_repo = FakePaymentRepo()
+    await payment_repo.create(user_id=2, amount=5, commission=0.1, status=PaymentStatus.SUCCESS, idempotency_key="old")
+    transaction_repo = FakeTransactionRepo()
+    outbox = FakeOutboxRepo()
+
+    use_case = CreatePaymentsBatchUseCase(FakeUserRepo(users), payment_repo, transaction_repo, outbox, session)
+    results = await use_case.execute(
+        [
+            PaymentBatchItemDTO(type="withdraw", user_id=1, amount=60, idempotency_key="a"),
+            # Остаток уже занят первым списанием пакета.
+            PaymentBatchItemDTO(type="withdraw", user_id=1, amount=60),
+            PaymentBatchItemDTO(type="deposit", user_id=2, amount=5, idempotency_key="old"),
+            PaymentBatchItemDTO(type="deposit", user_id=3, amount=5),
+            PaymentBatchItemDTO(type="withdraw", user_id=1, amount=60, idempotency_key="a"),
+        ]
+    )
+
+    assert [(r.payment_id, r.status, r.error, r.idempotent) for r in results] == [
+        (2, "processing", None, False),
+        (3, "failed", "insufficient_funds", False),
+        (1, "success", None, True),
+        (None, "failed", "user_not_found", False),
+        (2, "processing", None, True),
+    ]
+    assert len(transaction_repo.items) == 2
+    assert outbox.items == [2]
+
+
+def _racing_lookup(payment_repo, visible_after: int):
+    # Ключ занимает параллельный запрос: первые поиски его не видят, видит только вставка.
+    calls = []
+    get_by_keys = payment_repo.get_by_idempotency_keys
+
+    async def lookup(keys):
+        calls.append(keys)
+        return await get_by_keys(keys) if len(calls) > visible_after else {}
+
+    payment_repo.get_by_idempotency_keys = lookup
+
+
+@pytest.mark.asyncio
+async def test_payments_batch_conflict_does_not_hold_balance():
+    payment_repo = FakePaymentRepo()
+    await payment_repo.create(user_id=1, amount=60, commission=0, status=PaymentStatus.NEW, idempotency_key="race")
+    _racing_lookup(payment_repo, visible_after=1)
+    outbox = FakeOutboxRepo()
+    use_case = CreatePaymentsBatchUseCase(
+        FakeUserRepo({1: User(id=1, balance=100)}), payment_repo, FakeTransactionRepo(), outbox, FakeSession()
+    )
+
+    results = await use_case.execute(
+        [
+            PaymentBatchItemDTO(type="withdraw", user_id=1, amount=60, idempotency_key="race"),
+            PaymentBatchItemDTO(type="withdraw", user_id=1, amount=60),
+        ]
+    )
+
+    # Повтор не занимает остаток: второе списание проходит.
+    assert [(r.payment_id, r.status, r.error, r.idempotent) for r in results] == [
+        (1, "processing", None, True),
+        (2, "processing", None, False),
+    ]
+    assert outbox.items == [2]
+
+
+@pytest.mark.asyncio
+async def test_payments_batch_reports_conflict_with_invisible_payment():
+    payment_repo = FakePaymentRepo()
+    await payment_repo.create(user_id=1, amount=5, commission=0, status=PaymentStatus.NEW, idempotency_key="race")
+    _racing_lookup(payment_repo, visible_after=2)
+    use_case = CreatePaymentsBatchUseCase(
+        FakeUserRepo({1: User(id=1, balance=0)}), payment_repo, FakeTransactionRepo(), FakeOutboxRepo(), FakeSession()
+    )
+
+    results = await use_case.execute([PaymentBatchItemDTO(type="deposit", user_id=1, amount=5, idempotency_key="race")])
+
+    assert [(r.payment_id, r.status, r.error) for r in results] == [(None, "failed", "idempotency_conflict")]
+
+
+@pytest.mark.asyncio
+async def test_payments_batch_skips_lookup_on_filter_miss_and_handles_conflict(monkeypatch):
+    key_filter = IdempotencyKeyFilter(capacity=100, false_positive_rate=0.01)
+    key_filter.ready = True
+    monkeypatch.setattr("app.application.use_cases.create_payments_batch.idempotency_filter", key_filter)
+
+    payment_repo = FakePaymentRepo()
+    # Ключ занят другим процессом: фильтр этого процесса о нём не знает.
+    await payment_repo.create(user_id=1, amount=5, commission=0.1, status=PaymentStatus.NEW, idempotency_key="other")
+    lookups = []
+    get_by_keys = payment_repo.get_by_idempotency_keys
+
+    async def counting_lookup(keys):
+        lookups.append(list(keys))
+        return await get_by_keys(keys)
+
+    payment_repo.get_by_idempotency_keys = counting_lookup
+    outbox = FakeOutboxRepo()
+    use_case = CreatePaymentsBatchUseCase(
+        FakeUserRepo({1: User(id=1, balance=0)}), payment_repo, FakeTransactionRepo(), outbox, FakeSession()
+    )
+    results = await use_case.execute(
+        [
+            PaymentBatchItemDTO(type="deposit", user_id=1, amount=10, idempotency_key="new"),
+            PaymentBatchItemDTO(type="deposit", user_id=1, amount=5, idempotency_key="other"),
+        ]
+    )
+
+    # До вставки в БД не ходили; повтор распознан по конфликту уникального индекса.
+    assert lookups == [[(1, "other")]]
+    assert [(r.payment_id, r.status, r.idempotent) for r in results] == [(2, "processing", False), (1, "processing", True)]
+    assert outbox.items == [2]
+    assert key_filter.might_contain(1, "new")
+
+
+@pytest.mark.asyncio
+async def test_payments_batch_filter_miss_on_withdraw_does_not_hold_balance(monkeypatch):
+    # Фильтр прогрет, но ключа не знает (например, его создал другой процесс): поиск пропущен.
+    key_filter = IdempotencyKeyFilter(capacity=100, false_positive_rate=0.01)
+    key_filter.ready = True
+    monkeypatch.setattr("app.application.use_cases.create_payments_batch.idempotency_filter", key_filter)
+    payment_repo = FakePaymentRepo()
+    await payment_repo.create(user_id=1, amount=60, commission=0, status=PaymentStatus.SUCCESS, idempotency_key="old")
+    use_case = CreatePaymentsBatchUseCase(
+        FakeUserRepo({1: User(id=1, balance=100)}), payment_repo, FakeTransactionRepo(), FakeOutboxRepo(), FakeSession()
+    )
+
+    results = await use_case.execute(
+        [
+            PaymentBatchItemDTO(type="withdraw", user_id=1, amount=60, idempotency_key="old"),
+            PaymentBatchItemDTO(type="withdraw", user_id=1, amount=60, idempotency_key="next"),
+        ]
+    )
+
+    assert [(r.payment_id, r.status, r.idempotent) for r in results] == [(1, "success", True), (2, "processing", False)]